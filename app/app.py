@@ -1,58 +1,132 @@
+import os
 from pathlib import Path
 
-from dash import Dash, html, dcc, callback, Output, Input
+from dash import Dash, html, dcc, callback, Output, Input, State
 import dash
 import dash_bootstrap_components as dbc
 
-import data
+import cache
+import catalog
+import memo
+import profiling
+import watcher
 
 OUTPUT_PATH = "../output"
-DATA = data.extract_data(output_path=OUTPUT_PATH)
-DATA.to_csv("output_data.csv", index=False)
+# Other runs to compare with the output folder (see catalog), if the file exists
+CATALOG_FILE = "catalog.json"
+DEBUG = True
+# Precision of the cached cell data: "single" (compact) or "double" (see data.get_column_dtypes)
+PRECISION = "single"
+# Interpolation of the substance concentrations at the cell positions: "nearest" or "trilinear"
+INTERPOLATION = "trilinear"
+# Keep the figures in a file shared by the processes of the server (see memo)
+FIGURE_DISK_CACHE = True
+# Time (in milliseconds) between two checks for new frames in the cache
+LIVE_INTERVAL = 5000
+# Profile every callback request with cProfile from the start (see the diagnostics page)
+PROFILE_CALLBACKS = False
 
 # stylesheet with the .dbc class from dash-bootstrap-templates library
 DBC_CSS = "https://cdn.jsdelivr.net/gh/AnnMarieW/dash-bootstrap-templates/dbc.min.css"
 
-# Bootstrap Sandstone theme
-app = Dash(
-    __name__,
-    external_stylesheets=[dbc.themes.SIMPLEX, DBC_CSS, dbc.icons.FONT_AWESOME],
-    use_pages=True,
-)
-
 
 #################################################################
 # NAVBAR (APP HEADER)
 # Simple header to be displayed at the top of the application.
 # Can also be used to navigate through the app.
+# The run selector lists the runs of the catalog, so the navbar is created with the app.
 #################################################################
-navbar = dbc.NavbarSimple(
-    children=[
-        dcc.Store(id="time-data"),
-        dbc.NavItem(dbc.NavLink("Home", href="/")),
-        dbc.DropdownMenu(
-            children=[
-                dbc.DropdownMenuItem("More", header=True),
-                dbc.DropdownMenuItem("Single time", href="/single-time"),
-                dbc.DropdownMenuItem("Time series", href="/data-series"),
-                dbc.DropdownMenuItem("Animations", href="/animations"),
-                dbc.DropdownMenuItem("Table view", href="/table-view"),
-            ],
-            nav=True,
-            in_navbar=True,
-            label="More",
-        ),
-    ],
-    brand="PhysiCell Data Visualizer",
-    brand_href="/",
-    fixed="top",
-    color="dark",
-    dark=True,
-)
+def get_navbar() -> dbc.NavbarSimple:
+    """Returns the header of the app, with the selector of the displayed run."""
+    return dbc.NavbarSimple(
+        children=[
+            dcc.Store(id="time-data"),
+            dcc.Interval(id="live-interval", interval=LIVE_INTERVAL),
+            dbc.NavItem(
+                dcc.Dropdown(
+                    options=catalog.RUNS.names,
+                    value=catalog.DEFAULT_RUN,
+                    clearable=False,
+                    persistence=True,
+                    id="run",
+                ),
+                style={"width": "200px"},
+            ),
+            dbc.NavItem(dbc.NavLink("Home", href="/")),
+            dbc.DropdownMenu(
+                children=[
+                    dbc.DropdownMenuItem("More", header=True),
+                    dbc.DropdownMenuItem("Single time", href="/single-time"),
+                    dbc.DropdownMenuItem("Time series", href="/data-series"),
+                    dbc.DropdownMenuItem("Animations", href="/animations"),
+                    dbc.DropdownMenuItem("Table view", href="/table-view"),
+                    dbc.DropdownMenuItem("Diagnostics", href="/diagnostics"),
+                ],
+                nav=True,
+                in_navbar=True,
+                label="More",
+            ),
+        ],
+        brand="PhysiCell Data Visualizer",
+        brand_href="/",
+        fixed="top",
+        color="dark",
+        dark=True,
+    )
 
-app.layout = html.Div(
-    [dbc.Row(navbar), dbc.Row([dash.page_container], style={"padding-top": "100px"})]
+
+# Method to share the time range of the selected run with the pages
+# It is only updated when time points are added (or another run is selected), so that
+# the pages update their controls and figures only when there is new data.
+@callback(
+    Output("time-data", "data"),
+    [Input("live-interval", "n_intervals"), Input("run", "value")],
+    State("time-data", "data"),
 )
+def update_time_data(_, run, time_data):
+    times = cache.get_times(catalog.get_run(run).cache_path)
+    # The cache of the run may not have been built yet
+    if not times:
+        return dash.no_update
+    if time_data is not None and time_data.get("run") == run and times[-1] <= time_data["last"]:
+        return dash.no_update
+    return {"run": run, "first": times[0], "last": times[-1]}
+
 
+def create_app() -> Dash:
+    """Creates the app (the pages read the cached data, so the cache must be built first)."""
+    # Bootstrap Sandstone theme
+    app = Dash(
+        __name__,
+        external_stylesheets=[dbc.themes.SIMPLEX, DBC_CSS, dbc.icons.FONT_AWESOME],
+        use_pages=True,
+    )
+    app.layout = html.Div(
+        [dbc.Row(get_navbar()), dbc.Row([dash.page_container], style={"padding-top": "100px"})]
+    )
+    # The time of each callback (and of its stages) is shown on the diagnostics page
+    profiling.instrument(app.server)
+    return app
+
+
+# The cell files are read in a process pool, whose workers import this module again
+# when they are spawned (e.g., on Windows). The data extraction and the app itself
+# are only set up in the main process.
 if __name__ == "__main__":
-    app.run_server(debug=True)
+    catalog.configure(OUTPUT_PATH, CATALOG_FILE)
+    # The pages read the cell data from the cache (only new or changed frames are read)
+    catalog.RUNS.build(precision=PRECISION, interpolation=INTERPOLATION)
+    # In debug mode, the app is served by a child process of the reloader: the new frames
+    # are only ingested there, so that two watchers never write to the cache
+    if not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        for run in catalog.RUNS.runs:
+            watcher.OutputWatcher(
+                run.output_path, run.cache_path, precision=PRECISION, interpolation=INTERPOLATION
+            ).start()
+
+    profiling.configure(cache.CACHE_PATH / profiling.PROFILES_FOLDER, PROFILE_CALLBACKS)
+    if FIGURE_DISK_CACHE:
+        memo.configure(disk_path=cache.CACHE_PATH / memo.DISK_FILE)
+
+    app = create_app()
+    app.run_server(debug=DEBUG)
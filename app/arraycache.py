@@ -0,0 +1,51 @@
+"""A memory-bounded LRU cache for NumPy arrays, shared by the data loaders of the pages."""
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+import numpy as np
+
+
+class ArrayCache:
+    """A thread-safe LRU cache of NumPy arrays that evicts arrays to stay within a memory budget."""
+
+    def __init__(self, memory_budget: int):
+        self.memory_budget = memory_budget
+        self.size = 0
+        self._arrays: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._arrays
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """Returns the cached array (marking it as recently used), or None if it isn't cached."""
+        with self._lock:
+            if key not in self._arrays:
+                return None
+            self._arrays.move_to_end(key)
+            return self._arrays[key]
+
+    def put(self, key: Hashable, array: np.ndarray) -> None:
+        """Caches the array, evicting the least recently used arrays if needed."""
+        with self._lock:
+            if key in self._arrays:
+                self.size -= self._arrays.pop(key).nbytes
+            self._arrays[key] = array
+            self.size += array.nbytes
+            # The newest array is always kept, even if it doesn't fit the budget on its own
+            while self.size > self.memory_budget and len(self._arrays) > 1:
+                _, evicted = self._arrays.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> None:
+        """Removes the cached arrays whose keys match the predicate."""
+        with self._lock:
+            for key in [key for key in self._arrays if predicate(key)]:
+                self.size -= self._arrays.pop(key).nbytes
+
+    def clear(self) -> None:
+        """Removes every cached array."""
+        with self._lock:
+            self._arrays.clear()
+            self.size = 0
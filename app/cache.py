@@ -0,0 +1,486 @@
+"""
+Columnar on-disk cache for the extracted cell data.
+
+The cell data is stored as a Parquet dataset partitioned by time point (one folder per
+time point, named "time=<value>"), so that the pages can read only the columns and time
+points that they need. The cache keeps the size and modification time of the source
+output files of each frame, so that only new or changed frames are read when the cache is
+updated.
+
+The cache is updated while the pages read it (e.g., in live-tail mode), so the files of a
+time point are never modified: new files are written next to them, and the manifest lists
+the file of each time point. The pages only read the files listed in the manifest, which
+is replaced at once when the new files are ready.
+"""
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+import data
+import gridstore
+import profiling
+import sampling
+import simindex
+import timeseries
+import tracks
+from simindex import FileStats, get_file_stats
+
+CACHE_PATH = Path("cache")
+CELLS_FOLDER = "cells"
+MANIFEST_FILE = "manifest.json"
+# Marks a cache whose track store is ahead of its manifest (it is rebuilt if the build was
+# interrupted before the manifest was written)
+BUILD_FILE = "building"
+# Prefix of the temporary folders of the cell files being written
+WRITING_PREFIX = "writing-"
+STATS_FILE = "stats.parquet"
+SERIES_FILE = "series.parquet"
+
+PARTITIONING = ds.partitioning(pa.schema([("time", pa.float64())]), flavor="hive")
+
+
+def read_manifest(cache_path: Union[str, Path] = CACHE_PATH) -> Optional[dict]:
+    """Returns the manifest of the cache, or None if the cache hasn't been built."""
+    manifest_file = Path(cache_path) / MANIFEST_FILE
+    if not manifest_file.is_file():
+        return None
+    with open(manifest_file, "r") as file:
+        manifest = json.load(file)
+    # JSON stores the frame numbers as strings and the (size, mtime) tuples as lists
+    manifest["initial"] = tuple(manifest["initial"])
+    if "partitions" in manifest:
+        manifest["partitions"] = {
+            float(time_value): file for time_value, file in manifest["partitions"].items()
+        }
+    manifest["frames"] = {
+        int(frame): {name: tuple(stats) for name, stats in files.items()}
+        for frame, files in manifest["frames"].items()
+    }
+    return manifest
+
+
+def write_manifest(
+    output_path: Union[str, Path],
+    frame_stats: Dict[int, Dict[str, FileStats]],
+    partitions: Dict[float, str],
+    cache_path: Union[str, Path] = CACHE_PATH,
+    precision: str = "single",
+    interpolation: str = "trilinear",
+) -> None:
+    """
+    Saves the output files that have been ingested into the cache, the cell file of each
+    time point (see write_cells), their precision and the interpolation method of the
+    sampled concentrations.
+
+    The manifest is written to a temporary file first, which then replaces the manifest,
+    so that it is never read while being written.
+    """
+    manifest = {
+        "output_path": str(Path(output_path).resolve()),
+        "initial": get_file_stats(Path(output_path) / "initial.xml"),
+        "precision": precision,
+        "interpolation": interpolation,
+        "frames": frame_stats,
+        "partitions": partitions,
+    }
+    manifest_file = Path(cache_path) / MANIFEST_FILE
+    temporary_file = manifest_file.with_suffix(".tmp")
+    with open(temporary_file, "w") as file:
+        json.dump(manifest, file)
+    os.replace(temporary_file, manifest_file)
+
+
+def is_compatible(
+    manifest: Optional[dict],
+    output_path: Union[str, Path],
+    precision: str = "single",
+    interpolation: str = "trilinear",
+) -> bool:
+    """Checks if the cache can be updated from the output folder instead of being rebuilt."""
+    return (
+        manifest is not None
+        and manifest["output_path"] == str(Path(output_path).resolve())
+        and manifest["initial"] == get_file_stats(Path(output_path) / "initial.xml")
+        and manifest.get("precision", "double") == precision
+        # Caches built before the concentrations were sampled don't have an interpolation
+        and manifest.get("interpolation") == interpolation
+        # Nor the caches built before the cell files were listed in the manifest
+        and "partitions" in manifest
+    )
+
+
+def get_changed_frames(
+    manifest: dict, frame_stats: Dict[int, Dict[str, FileStats]]
+) -> List[int]:
+    """Returns the frames that are new or whose files changed since they were cached."""
+    return [
+        frame
+        for frame, stats in frame_stats.items()
+        if manifest["frames"].get(frame) != stats
+    ]
+
+
+def get_partitions(cache_path: Union[str, Path] = CACHE_PATH) -> Dict[float, Path]:
+    """
+    Returns the cell files of the cached time points, as listed in the manifest.
+
+    The files that aren't listed (being written, or replaced by the last build) are ignored.
+    """
+    manifest = read_manifest(cache_path)
+    if manifest is None:
+        return {}
+    cells_path = Path(cache_path) / CELLS_FOLDER
+    return {
+        time_value: cells_path / file
+        for time_value, file in manifest.get("partitions", {}).items()
+    }
+
+
+def write_cells(
+    cells: pd.DataFrame, cache_path: Union[str, Path] = CACHE_PATH, rebuild: bool = False
+) -> Dict[float, str]:
+    """
+    Writes the cell data of each time point to a new file of its partition, and returns
+    the files (relative to the cells folder) by time point. The statistics are updated
+    (see write_stats).
+
+    The files are written to a temporary folder, then moved (renamed) into their
+    partitions, so that a partition never holds a half-written file. The files of the
+    same time points are kept: the pages read them until the new files are listed in the
+    manifest (see get_partitions), and they are removed by the next build (see
+    remove_unused_files).
+    """
+    cells_path = Path(cache_path) / CELLS_FOLDER
+    build = uuid.uuid4().hex[:8]
+    writing_path = cells_path / f"{WRITING_PREFIX}{build}"
+    ds.write_dataset(
+        pa.Table.from_pandas(cells, preserve_index=False),
+        writing_path,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"part-{build}-{{i}}.parquet",
+        max_partitions=max(1024, cells["time"].nunique()),
+    )
+
+    files = {}
+    for partition in writing_path.glob("time=*"):
+        (cells_path / partition.name).mkdir(exist_ok=True)
+        for file in partition.glob("*.parquet"):
+            file.replace(cells_path / partition.name / file.name)
+            files[float(partition.name.split("=")[1])] = f"{partition.name}/{file.name}"
+    shutil.rmtree(writing_path)
+    write_stats(cells, cache_path, rebuild)
+    return files
+
+
+def remove_unused_files(
+    manifest: Optional[dict], cache_path: Union[str, Path] = CACHE_PATH
+) -> None:
+    """
+    Removes the cell files that aren't listed in the manifest (replaced by the build of
+    the manifest, or left by an interrupted build) and the empty partitions.
+
+    This is done before the next build, so that the pages that read the previous
+    manifest can still read the replaced files in the meantime.
+    """
+    cells_path = Path(cache_path) / CELLS_FOLDER
+    if not cells_path.is_dir():
+        return
+    listed = set() if manifest is None else set(manifest.get("partitions", {}).values())
+    for folder in cells_path.iterdir():
+        if folder.name.startswith(WRITING_PREFIX):
+            shutil.rmtree(folder)
+            continue
+        for file in folder.iterdir():
+            if f"{folder.name}/{file.name}" not in listed:
+                file.unlink()
+        if not any(folder.iterdir()):
+            folder.rmdir()
+
+
+def write_table(table: pd.DataFrame, path: Path) -> None:
+    """
+    Saves the table to a Parquet file, through a temporary file that then replaces it (so
+    that the pages never read a missing or half-written file).
+    """
+    temporary_file = path.with_suffix(".tmp")
+    table.to_parquet(temporary_file, index=False)
+    os.replace(temporary_file, path)
+
+
+def write_stats(
+    cells: pd.DataFrame, cache_path: Union[str, Path] = CACHE_PATH, rebuild: bool = False
+) -> None:
+    """
+    Saves the minimum and maximum of every cell variable at each of the passed time points.
+
+    The statistics of other time points are kept, unless rebuild is set. The global
+    statistics can then be computed from this small table, without reading the cell data.
+    """
+    stats = (
+        cells.groupby("time")
+        .agg(["min", "max"])
+        .stack(level=1)
+        .rename_axis(["time", "statistic"])
+        .reset_index()
+    )
+    previous_stats = None if rebuild else load_stats(cache_path)
+    if previous_stats is not None:
+        previous_stats = previous_stats[~previous_stats["time"].isin(stats["time"])]
+        stats = pd.concat([previous_stats, stats], ignore_index=True)
+    write_table(stats, Path(cache_path) / STATS_FILE)
+
+
+def load_stats(cache_path: Union[str, Path] = CACHE_PATH) -> Optional[pd.DataFrame]:
+    """Returns the per-time point statistics of the cell variables (None if there are none)."""
+    stats_file = Path(cache_path) / STATS_FILE
+    if not stats_file.is_file():
+        return None
+    return pd.read_parquet(stats_file)
+
+
+def write_series(
+    cells: pd.DataFrame,
+    variables: Sequence[str],
+    cache_path: Union[str, Path] = CACHE_PATH,
+    rebuild: bool = False,
+) -> None:
+    """
+    Saves the aggregates of each of the passed time points (see timeseries.compute_series).
+
+    The aggregates of other time points are kept, unless rebuild is set.
+    """
+    series = timeseries.compute_series(cells, variables)
+    previous_series = None if rebuild else load_series(cache_path)
+    if previous_series is not None:
+        previous_series = previous_series[~previous_series["time"].isin(series["time"])]
+        series = pd.concat([previous_series, series], ignore_index=True)
+    # Phases or types that appear in the new frames have no cells in the previous ones
+    counts = timeseries.get_count_columns(series.columns)
+    series[counts] = series[counts].fillna(0).astype(int)
+    write_table(series.sort_values("time"), Path(cache_path) / SERIES_FILE)
+
+
+@profiling.timed("load")
+def load_series(cache_path: Union[str, Path] = CACHE_PATH) -> Optional[pd.DataFrame]:
+    """Returns the per-time point aggregates of the cell data (None if there are none)."""
+    series_file = Path(cache_path) / SERIES_FILE
+    if not series_file.is_file():
+        return None
+    profiling.add_bytes_read(series_file.stat().st_size)
+    return pd.read_parquet(series_file)
+
+
+def build_cache(
+    output_path: Union[str, Path],
+    cache_path: Union[str, Path] = CACHE_PATH,
+    incremental: bool = True,
+    precision: str = "single",
+    interpolation: str = "trilinear",
+) -> List[int]:
+    """
+    Extracts the cell data into the cache and returns the frames that were (re)ingested.
+
+    Only the frames that are new or changed since the last build are read, unless
+    incremental is False or the cache can't be updated (e.g., when frames were removed or
+    the precision changed, see is_compatible), in which case it is rebuilt. The sampled
+    substance concentrations (see sampling), the time series (see timeseries) and the
+    track store (see tracks) are updated with the cell files, which the pages read once
+    the manifest is written.
+    """
+    cache_path = Path(cache_path)
+    manifest = read_manifest(cache_path)
+    index = simindex.build_index(output_path, cache_path / simindex.INDEX_FILE)
+    frame_stats = {frame: entry["files"] for frame, entry in index.frames.items()}
+
+    # Removed frames usually mean the simulation was restarted, so the cache is rebuilt
+    # An interrupted build (see BUILD_FILE) leaves a cache that must be rebuilt
+    if (
+        incremental
+        and is_compatible(manifest, output_path, precision, interpolation)
+        and manifest["frames"].keys() <= frame_stats.keys()
+        and (cache_path / SERIES_FILE).is_file()
+        and (cache_path / tracks.TRACKS_FOLDER / tracks.SEGMENTS_FILE).is_file()
+        and not (cache_path / BUILD_FILE).exists()
+    ):
+        frames = get_changed_frames(manifest, frame_stats)
+        gridstore.remove_frames(frames, cache_path / gridstore.STORE_FOLDER)
+        replaced_frames = [frame for frame in frames if frame in manifest["frames"]]
+        partitions = manifest["partitions"]
+        rebuild = False
+    else:
+        frames = list(frame_stats)
+        # The pages read the previous build until it is replaced: the statistics and
+        # series are overwritten at once, and the cell files are listed in its manifest
+        # until the new one is written (so they are only removed by the next build)
+        partitions = {}
+        shutil.rmtree(cache_path / gridstore.STORE_FOLDER, ignore_errors=True)
+        replaced_frames = []
+        rebuild = True
+
+    if not frames:
+        return frames
+
+    remove_unused_files(manifest, cache_path)
+    cells = data.extract_data_parallel(
+        output_path=str(output_path),
+        frames=frames,
+        time=index.get_time_series(),
+        max_cell_num=index.max_cell_id + 1,
+        precision=precision,
+    )
+    sampling.add_concentrations(
+        cells, output_path, index.get_time_series()[frames], interpolation, precision
+    )
+    partitions.update(write_cells(cells, cache_path, rebuild))
+    write_series(cells, get_series_variables(index), cache_path, rebuild)
+    # The cell files and series of the frames are replaced if they are ingested again, but
+    # not the rows added to the track store: it must be rebuilt if the manifest isn't written
+    replaced_times = index.get_time_series()[replaced_frames]
+    (cache_path / BUILD_FILE).touch()
+    try:
+        tracks.add_frames(cells, cache_path / tracks.TRACKS_FOLDER, replaced_times, rebuild)
+    except Exception:
+        # The segment list is written last, so the track store wasn't changed
+        (cache_path / BUILD_FILE).unlink()
+        raise
+    write_manifest(output_path, frame_stats, partitions, cache_path, precision, interpolation)
+    (cache_path / BUILD_FILE).unlink()
+    return frames
+
+
+def get_series_variables(index: simindex.SimulationIndex) -> List[str]:
+    """
+    Returns the cell variables aggregated in the time series: the custom variables and
+    the sampled substance concentrations (see sampling).
+    """
+    return timeseries.get_custom_variables(index.variables) + sampling.get_columns(
+        index.substances
+    )
+
+
+def get_simulation_index(cache_path: Union[str, Path] = CACHE_PATH) -> simindex.SimulationIndex:
+    """Returns the index of the output folder the cache was built from."""
+    return simindex.get_index(Path(cache_path) / simindex.INDEX_FILE)
+
+
+def get_dataset(cache_path: Union[str, Path] = CACHE_PATH) -> ds.Dataset:
+    """
+    Opens the cached cell data without reading it (files are memory-mapped when read).
+
+    The files are ordered by time point, so the rows are read in chronological order.
+    """
+    files = [str(file) for _, file in sorted(get_partitions(cache_path).items())]
+    return ds.dataset(
+        files,
+        format="parquet",
+        partitioning=PARTITIONING,
+        partition_base_dir=str(Path(cache_path) / CELLS_FOLDER),
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def get_columns(cache_path: Union[str, Path] = CACHE_PATH) -> List[str]:
+    """Returns the names of the cached cell variables (including the time)."""
+    return get_dataset(cache_path).schema.names
+
+
+def get_times(cache_path: Union[str, Path] = CACHE_PATH) -> List[float]:
+    """Returns the cached time points, as listed in the manifest."""
+    return sorted(get_partitions(cache_path))
+
+
+@profiling.timed("load")
+def load_cells(
+    columns: Optional[Sequence[str]] = None,
+    times: Optional[Sequence[float]] = None,
+    cache_path: Union[str, Path] = CACHE_PATH,
+) -> pd.DataFrame:
+    """
+    Reads the cached cell data into a Pandas DataFrame.
+
+    Only the passed columns and time points are read from disk. By default, all the
+    columns and time points are loaded. The cell types and phases are loaded as
+    categories (see data.CATEGORICAL_VARIABLES), which are smaller and faster to group by.
+    """
+    dataset = get_dataset(cache_path)
+    row_filter = None if times is None else ds.field("time").isin(list(times))
+    table = dataset.to_table(
+        columns=None if columns is None else list(columns), filter=row_filter
+    )
+    profiling.add_bytes_read(table.nbytes)
+    categories = [c for c in data.CATEGORICAL_VARIABLES if c in table.column_names]
+    return table.to_pandas(categories=categories)
+
+
+@profiling.timed("load")
+def query_cells(
+    row_filter: Optional[ds.Expression] = None,
+    sort_by: Optional[Sequence[Tuple[str, str]]] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    cache_path: Union[str, Path] = CACHE_PATH,
+) -> Tuple[pd.DataFrame, int]:
+    """
+    Returns a page of the cached cell data and the number of rows that match the filter.
+
+    The filter is applied while scanning the files (time points that don't match are
+    not read). When sorting, only the sort columns of the matching rows are read and
+    sorted, to find the rows of the page. Then, only the rows of the page are read.
+
+    Parameters
+    ----------
+    row_filter
+        A pyarrow.dataset expression to select the rows.
+    sort_by
+        Pairs of column names and orders ("ascending" or "descending").
+    offset
+        The index of the first row of the page.
+    limit
+        The number of rows in the page (all the remaining rows by default).
+    """
+    dataset = get_dataset(cache_path)
+    total = dataset.count_rows(filter=row_filter)
+    stop = total if limit is None else min(offset + limit, total)
+    if offset >= stop:
+        return dataset.schema.empty_table().to_pandas(), total
+
+    if sort_by:
+        # Only the sort columns of the matching rows are read to find the rows of the page
+        keys = dataset.to_table(columns=[column for column, _ in sort_by], filter=row_filter)
+        rows = pc.sort_indices(keys, sort_keys=list(sort_by))[offset:stop]
+        profiling.add_bytes_read(keys.nbytes)
+    else:
+        rows = list(range(offset, stop))
+    page = dataset.take(rows, filter=row_filter)
+    profiling.add_bytes_read(page.nbytes)
+    return page.to_pandas(), total
+
+
+def aggregate_cells(
+    variable: str,
+    statistic: str = "mean",
+    group_by: Optional[str] = None,
+    times: Optional[Sequence[float]] = None,
+    cache_path: Union[str, Path] = CACHE_PATH,
+) -> pd.DataFrame:
+    """
+    Computes a statistic of a cell variable at each time point (see timeseries.aggregate).
+
+    Only the needed columns (and time points, if passed) are read from the cache. The
+    cell types and phases are aggregated as numbers (they are loaded as categories).
+    """
+    columns = ["time", "total_volume", variable] + ([group_by] if group_by else [])
+    cells = load_cells(list(dict.fromkeys(columns)), times, cache_path)
+    if variable in data.CATEGORICAL_VARIABLES:
+        cells[variable] = cells[variable].astype(cells[variable].cat.categories.dtype)
+    return timeseries.aggregate(cells, variable, statistic, group_by)
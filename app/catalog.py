@@ -0,0 +1,147 @@
+"""
+Catalog of the simulation runs (output folders) served by the app.
+
+Several runs (e.g., the results of a parameter sweep) can be compared without
+restarting the server: each run is ingested into its own folder of the cache, and the
+pages read the run selected in the navigation bar. The runs are listed in a JSON file
+that maps their names to their output folders:
+
+    {"control": "../sweep/control/output", "high_oxygen": "../sweep/high_oxygen/output"}
+
+The default run (the app's output folder) keeps the top-level cache folder, the other
+runs are cached in "runs/<name>". The memory caches (cell columns, grids and figures)
+are shared by every run, so the runs that aren't being looked at are evicted first.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Union
+
+import cache
+import simindex
+import timeindex
+
+# Name of the run of the app's output folder
+DEFAULT_RUN = "output"
+# Folder of the caches of the other runs (in the cache folder)
+RUNS_FOLDER = "runs"
+# Runs ingested at the same time (the cell files of each run are read in a process pool)
+MAX_WORKERS = 4
+
+
+class Run(NamedTuple):
+    """A simulation run: its name, output folder and cache folder."""
+
+    name: str
+    output_path: Path
+    cache_path: Path
+
+
+class Catalog:
+    """The runs served by the app, by name (the first one is the default run)."""
+
+    def __init__(self):
+        self._runs: Dict[str, Run] = {}
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._runs)
+
+    @property
+    def runs(self) -> List[Run]:
+        return list(self._runs.values())
+
+    def register(
+        self,
+        name: str,
+        output_path: Union[str, Path],
+        cache_path: Optional[Union[str, Path]] = None,
+    ) -> Run:
+        """
+        Adds a run (cached in the runs folder, by default) and returns it.
+
+        The names identify the runs in the pages, so a name can't be given to another run
+        (e.g., a run of the catalog file named after the default run).
+        """
+        if cache_path is None:
+            cache_path = cache.CACHE_PATH / RUNS_FOLDER / name
+        run = Run(name, Path(output_path), Path(cache_path))
+        if self._runs.get(name, run) != run:
+            raise ValueError(f"Run name already used: {name} (by {self._runs[name].output_path})")
+        self._runs[name] = run
+        return run
+
+    def load(self, catalog_file: Union[str, Path]) -> None:
+        """Registers the runs listed in a catalog file (paths are relative to the file)."""
+        catalog_file = Path(catalog_file)
+        with open(catalog_file, "r") as file:
+            runs = json.load(file)
+        for name, output_path in runs.items():
+            self.register(name, catalog_file.parent / output_path)
+
+    def get(self, name: Optional[str] = None) -> Run:
+        """Returns the run with the given name (the default run if it isn't registered)."""
+        if not self._runs:
+            raise LookupError("No run is registered (see catalog.configure)")
+        return self._runs.get(name, next(iter(self._runs.values())))
+
+    def build(
+        self,
+        precision: str = "single",
+        interpolation: str = "trilinear",
+        max_workers: int = MAX_WORKERS,
+    ) -> Dict[str, List[int]]:
+        """
+        Ingests the runs into the cache, concurrently, and returns the ingested frames.
+
+        As in cache.build_cache, only new or changed frames are read.
+        """
+        def build_run(run: Run) -> List[int]:
+            return cache.build_cache(
+                run.output_path, run.cache_path, precision=precision, interpolation=interpolation
+            )
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            return dict(zip(self.names, executor.map(build_run, self.runs)))
+
+
+RUNS = Catalog()
+
+
+def configure(
+    output_path: Union[str, Path], catalog_file: Optional[Union[str, Path]] = None
+) -> None:
+    """
+    Sets the output folder of the default run and registers the runs of the catalog file.
+
+    The pages read the runs when they are imported, so this is called before the app is
+    created.
+    """
+    RUNS.register(DEFAULT_RUN, output_path, cache.CACHE_PATH)
+    if catalog_file is not None and Path(catalog_file).is_file():
+        RUNS.load(catalog_file)
+
+
+def get_run(name: Optional[str] = None) -> Run:
+    """Returns the run with the given name (see Catalog.get)."""
+    return RUNS.get(name)
+
+
+def get_index(name: Optional[str] = None) -> timeindex.TimeIndex:
+    """Returns the TimeIndex of the run's cache, shared by all the pages."""
+    return timeindex.get_index(get_run(name).cache_path)
+
+
+def get_simulation(name: Optional[str] = None) -> simindex.SimulationIndex:
+    """Returns the index of the run's output folder."""
+    return cache.get_simulation_index(get_run(name).cache_path)
+
+
+def get_version(name: Optional[str] = None, *args) -> Optional[int]:
+    """
+    Returns the version of the run's cache (see TimeIndex.version).
+
+    The other arguments are ignored, so that it can be passed to memo.memoize for
+    functions that take the run as their first argument.
+    """
+    return get_index(name).version
@@ -1,11 +1,17 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Sequence
 from xml.etree import ElementTree
 from scipy import io as sio
 
+import numpy as np
 import pandas as pd
 from physicool import processing
 
+import matfile
+
 
 def get_file_name(time: int) -> str:
     """
@@ -20,9 +26,18 @@ def get_file_name(time: int) -> str:
 
 
 def get_max_cell_num(output_path: str) -> int:
+    """
+    Returns the number of rows needed to hold the cells of any time point (maximum cell ID + 1).
+
+    Every cell file is read, as the population may shrink (the last file doesn't always
+    have the most cells). simindex.SimulationIndex keeps this value between runs.
+    """
     number_of_cell_files = int(processing.get_cell_file_num(output_path=Path(output_path), version="1.10.2"))
-    file_name = get_file_name(number_of_cell_files - 1)
-    return len(sio.loadmat(f"{output_path}/{file_name}")["cells"][0])
+    id_row = get_variables_idx(output_path=output_path)["ID"]
+    return 1 + max(
+        int(read_cell_rows(f"{output_path}/{get_file_name(frame)}", [id_row])[0].max(initial=-1))
+        for frame in range(number_of_cell_files)
+    )
 
 
 def get_variables_idx(output_path: str = "output") -> Dict[str, int]:
@@ -45,13 +60,18 @@ def get_simulation_time_interval(output_path: str = "output") -> float:
     return float(tree.find("metadata/current_time").text)
 
 
+def get_frame_time(frame: int, output_path: str = "output") -> float:
+    """Returns the current time of the given output file number, from its XML file."""
+    tree = ElementTree.parse(f"{output_path}/output{str(frame).zfill(8)}.xml")
+    return float(tree.find("metadata/current_time").text)
+
+
 def get_time(output_path: str = "output") -> pd.Series:
     """Returns a map of the simulation time points and corresponding file number."""
     frames = int(
         processing.get_cell_file_num(output_path=Path(output_path), version="1.10.2")
     )
-    time_interval = get_simulation_time_interval(output_path=output_path)
-    return pd.Series([frame * time_interval for frame in range(frames)])
+    return pd.Series([get_frame_time(frame, output_path) for frame in range(frames)])
 
 
 def extract_data(output_path: str = "output") -> pd.DataFrame:
@@ -82,6 +102,96 @@ def extract_data(output_path: str = "output") -> pd.DataFrame:
     return pd.concat(data, ignore_index=True)
 
 
+# Precision policies of the extracted cell data (see get_column_dtypes)
+PRECISIONS = ("single", "double")
+# Cell variables holding integer codes, and the type they are stored as
+INTEGER_VARIABLES = {
+    "ID": np.int32,
+    "cell_type": np.int16,
+    "cycle_model": np.int16,
+    "current_phase": np.int16,
+}
+# Integer variables with a few distinct values, loaded as categories to group the cells
+CATEGORICAL_VARIABLES = ["cell_type", "current_phase"]
+
+
+def get_column_dtypes(columns: Sequence[str], precision: str = "single") -> Dict[str, np.dtype]:
+    """
+    Returns the type of each column of the extracted cell data for the precision policy.
+
+    With the "single" policy, IDs, cell types and phases are stored as integers, the other
+    cell variables as float32 and the time as float64. With the "double" policy, every
+    column is stored as float64 (as in extract_data).
+
+    >>> get_column_dtypes(["ID", "position_x", "time"])
+    {'ID': dtype('int32'), 'position_x': dtype('float32'), 'time': dtype('float64')}
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision policy: {precision} (expected one of {PRECISIONS})")
+    if precision == "double":
+        return {column: np.dtype(np.float64) for column in columns}
+    return {
+        column: np.dtype(np.float64 if column == "time" else INTEGER_VARIABLES.get(column, np.float32))
+        for column in columns
+    }
+
+
+def read_cell_rows(path: str, rows: List[int]) -> np.ndarray:
+    """Returns only the requested variable rows of a cell file (see matfile.read_rows)."""
+    return matfile.read_rows(path, "cells", rows)
+
+
+def extract_data_parallel(
+    output_path: str = "output",
+    max_workers: Optional[int] = None,
+    frames: Optional[Sequence[int]] = None,
+    time: Optional[pd.Series] = None,
+    max_cell_num: Optional[int] = None,
+    precision: str = "single",
+) -> pd.DataFrame:
+    """
+    Extracts the internal cell data into a Pandas DataFrame, reading the cell files in a process pool.
+
+    Returns the same long-format DataFrame as extract_data: one row per cell ID (from 0 to the
+    maximum number of cells) and time point, with zeros for the cells that don't exist at that time.
+    Instead of building one DataFrame per time point, the cell data is scattered into one
+    preallocated array per column, using the cell IDs as row indices. The type of each column
+    is set by the precision policy (see get_column_dtypes). If frames (output file numbers) are
+    passed, only these time points are extracted. The time points (indexed by output file
+    number) and maximum number of cells can be passed to avoid reading them from the output
+    files (e.g., from a simindex.SimulationIndex).
+    """
+    if time is None:
+        time = get_time(output_path)
+    if frames is not None:
+        time = time[list(frames)]
+    cell_variables = get_variables_idx(output_path=output_path)
+    if max_cell_num is None:
+        max_cell_num = get_max_cell_num(output_path)
+    id_row = cell_variables["ID"]
+
+    dtypes = get_column_dtypes(list(cell_variables) + ["time"], precision)
+    columns = {column: np.zeros(len(time) * max_cell_num, dtype) for column, dtype in dtypes.items()}
+    columns["ID"][:] = np.tile(np.arange(max_cell_num), len(time))
+    columns["time"][:] = np.repeat(time.to_numpy(), max_cell_num)
+
+    paths = [f"{output_path}/{get_file_name(time_idx)}" for time_idx in time.index]
+    rows = list(cell_variables.values())
+    # Bigger chunks keep the inter-process overhead low when there are many small files
+    chunksize = max(1, len(paths) // (4 * (max_workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        cell_rows = executor.map(read_cell_rows, paths, repeat(rows), chunksize=chunksize)
+        for position, cells in enumerate(cell_rows):
+            ids = cells[rows.index(id_row)].astype(int)
+            # Cells with IDs outside of the preallocated range are dropped, as in extract_data
+            in_range = ids < max_cell_num
+            cell_idx = position * max_cell_num + ids[in_range]
+            for values, variable in zip(cells, cell_variables):
+                columns[variable][cell_idx] = values[in_range]
+
+    return pd.DataFrame(columns)
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
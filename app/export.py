@@ -0,0 +1,267 @@
+"""
+Renders the figures of the app to image files (PNG or SVG) or movies (MP4), without a browser.
+
+Run from the app folder, e.g., to save the 2D scatter plots colored by the cell volume and
+the oxygen heatmaps of every tenth time point, and a movie of the animation:
+
+    python export.py --plots scatter-2d heatmap --variables total_volume --substances oxygen --step 10
+    python export.py --plots animation --variables current_phase --format mp4 --fps 10
+
+The figures are drawn by the same functions as the pages (see figures). The time points
+are rendered in a process pool: each task reads the cells (and the grid slices) of its
+time point once, and draws every requested figure from them. The files are saved in
+"<output dir>/<run>/<plot>[-<variable or substance>]/", one per time point, and the
+frames of a movie are passed to ffmpeg in memory. Saving the images requires kaleido.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import time as timer
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import plotly.graph_objects as go
+
+import catalog
+import figures
+import gridstore
+import lod
+import timeindex
+from app import CATALOG_FILE, INTERPOLATION, OUTPUT_PATH, PRECISION
+
+try:
+    import kaleido
+except ImportError:
+    kaleido = None
+
+EXPORT_PATH = Path("exports")
+# Figures that can be exported (see figures)
+PLOTS = ["scatter-3d", "scatter-2d", "heatmap", "animation"]
+FORMATS = ["png", "svg", "mp4"]
+# Size (in pixels) of the saved images
+WIDTH = 800
+HEIGHT = 600
+
+
+class ExportOptions(NamedTuple):
+    """The figures to draw at each time point, and how to draw them."""
+
+    plots: List[str]
+    variables: List[str]
+    substances: List[str]
+    axis: str
+    index: Optional[int]
+    palette: str
+    point_budget: int
+    image_format: str
+    width: int
+    height: int
+    # Ranges of the variables over all the time points, so that the frames share their scales
+    ranges: Dict[str, Tuple[float, float]]
+
+
+def get_figure_names(options: ExportOptions) -> List[str]:
+    """Returns the names of the figures drawn at each time point (and of their folders)."""
+    names = []
+    for plot in options.plots:
+        if plot == "scatter-3d":
+            names.append(plot)
+        elif plot == "heatmap":
+            names += [f"{plot}-{substance}" for substance in options.substances]
+        else:
+            names += [f"{plot}-{variable}" for variable in options.variables]
+    return names
+
+
+def draw_figures(
+    run: catalog.Run, frame: int, time: float, options: ExportOptions
+) -> Dict[str, go.Figure]:
+    """
+    Draws the figures of a time point, by name (see get_figure_names).
+
+    The cell variables of every figure are read together, and each grid slice once.
+    """
+    columns = ["ID", "position_x", "position_y", "position_z", "total_volume", "current_phase"]
+    cells = timeindex.get_index(run.cache_path).get_frame(time, columns + options.variables)
+    cells = timeindex.remove_padding(cells)
+
+    figs = {}
+    for plot in options.plots:
+        if plot == "scatter-3d":
+            coordinates = ["position_x", "position_y", "position_z"]
+            figs[plot] = figures.plot_scatter_3d(
+                lod.downsample(cells, coordinates, options.point_budget)
+            )
+        elif plot == "heatmap":
+            store_path = run.cache_path / gridstore.STORE_FOLDER
+            for substance in options.substances:
+                grid = gridstore.read_slice(
+                    frame, substance, options.axis, options.index, run.output_path, store_path
+                )
+                figs[f"{plot}-{substance}"] = figures.plot_heatmap(
+                    grid, options.palette, options.axis
+                )
+        else:
+            binned = lod.downsample(cells, ["position_x", "position_y"], options.point_budget)
+            for variable in options.variables:
+                if plot == "scatter-2d":
+                    figs[f"{plot}-{variable}"] = figures.plot_scatter_2d(
+                        binned, variable, options.ranges[variable]
+                    )
+                else:
+                    figs[f"{plot}-{variable}"] = figures.plot_animation_frame(
+                        binned,
+                        variable,
+                        time,
+                        options.ranges[variable],
+                        options.ranges["position_x"],
+                        options.ranges["position_y"],
+                    )
+    return figs
+
+
+def render_frame(
+    run: catalog.Run, frame: int, time: float, options: ExportOptions, export_path: Path
+) -> Dict[str, bytes]:
+    """
+    Draws the figures of a time point and saves them to image files.
+
+    For movies, the PNG images are returned instead (by figure name), to be passed to
+    ffmpeg in order.
+    """
+    images = {}
+    image_format = "png" if options.image_format == "mp4" else options.image_format
+    for name, fig in draw_figures(run, frame, time, options).items():
+        image = fig.to_image(format=image_format, width=options.width, height=options.height)
+        if options.image_format == "mp4":
+            images[name] = image
+        else:
+            (export_path / name / f"{str(frame).zfill(8)}.{image_format}").write_bytes(image)
+    return images
+
+
+def open_movie(path: Path, fps: int) -> subprocess.Popen:
+    """Starts an ffmpeg process that encodes the PNG images written to its input."""
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "image2pipe", "-framerate", str(fps), "-i", "-",
+        # H.264 needs an even width and height
+        "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p",
+        str(path),
+    ]
+    return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+
+def export(
+    run: catalog.Run,
+    times: Sequence[float],
+    options: ExportOptions,
+    export_path: Path = EXPORT_PATH,
+    fps: int = 10,
+    max_workers: Optional[int] = None,
+) -> None:
+    """Renders the figures of the given time points of the run."""
+    if kaleido is None:
+        raise RuntimeError("Saving the figures requires kaleido (pip install kaleido)")
+    if options.image_format == "mp4" and shutil.which("ffmpeg") is None:
+        raise RuntimeError("Saving movies requires ffmpeg")
+
+    export_path = export_path / run.name
+    names = get_figure_names(options)
+    movies = {}
+    if options.image_format == "mp4":
+        export_path.mkdir(parents=True, exist_ok=True)
+        movies = {name: open_movie(export_path / f"{name}.mp4", fps) for name in names}
+    else:
+        for name in names:
+            (export_path / name).mkdir(parents=True, exist_ok=True)
+
+    simulation = catalog.get_simulation(run.name)
+    frames = [simulation.get_frame_number(time) for time in times]
+    # Bigger chunks keep the inter-process overhead low when there are many frames
+    chunksize = max(1, len(frames) // (4 * (max_workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        rendered = executor.map(
+            render_frame,
+            repeat(run),
+            frames,
+            times,
+            repeat(options),
+            repeat(export_path),
+            chunksize=chunksize,
+        )
+        # The frames are returned in order, as a movie needs them
+        for position, images in enumerate(rendered, 1):
+            for name, image in images.items():
+                movies[name].stdin.write(image)
+            print(f"\rRendered {position}/{len(frames)} frames", end="", flush=True)
+    print()
+
+    for movie in movies.values():
+        movie.stdin.close()
+        movie.wait()
+
+
+def main(arguments: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--run", default=catalog.DEFAULT_RUN, help="run of the catalog")
+    parser.add_argument("--plots", nargs="+", choices=PLOTS, default=["scatter-2d"])
+    parser.add_argument(
+        "--variables", nargs="+", default=["current_phase"],
+        help="cell variables coloring the 2D scatter plots and animations",
+    )
+    parser.add_argument(
+        "--substances", nargs="+", help="substances of the heatmaps (all by default)"
+    )
+    parser.add_argument("--start", type=int, default=0, help="first time point (position)")
+    parser.add_argument("--stop", type=int, help="last time point (excluded)")
+    parser.add_argument("--step", type=int, default=1)
+    parser.add_argument("--axis", choices=gridstore.AXES, default="z", help="slice axis")
+    parser.add_argument("--slice-index", type=int, default=0)
+    parser.add_argument(
+        "--projection", action="store_true", help="maximum projection instead of a slice"
+    )
+    parser.add_argument("--palette", default="darkmint", help="color scale of the heatmaps")
+    parser.add_argument("--point-budget", type=int, default=lod.POINT_BUDGET)
+    parser.add_argument("--format", choices=FORMATS, default="png")
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--fps", type=int, default=10, help="frames per second of the movies")
+    parser.add_argument("--workers", type=int, help="processes rendering the frames")
+    parser.add_argument("--output-dir", type=Path, default=EXPORT_PATH)
+    args = parser.parse_args(arguments)
+
+    catalog.configure(OUTPUT_PATH, CATALOG_FILE)
+    # The figures are drawn from the cache, which is updated first (as when the app starts)
+    catalog.RUNS.build(precision=PRECISION, interpolation=INTERPOLATION)
+    run = catalog.get_run(args.run)
+    index = catalog.get_index(run.name)
+    simulation = catalog.get_simulation(run.name)
+
+    columns = ["position_x", "position_y", *args.variables]
+    options = ExportOptions(
+        plots=args.plots,
+        variables=args.variables,
+        substances=args.substances or simulation.substances,
+        axis=args.axis,
+        index=None if args.projection else args.slice_index,
+        palette=args.palette,
+        point_budget=args.point_budget,
+        image_format=args.format,
+        width=args.width,
+        height=args.height,
+        ranges={column: index.get_range(column) for column in columns},
+    )
+    times = index.times[args.start:args.stop:args.step]
+
+    start = timer.perf_counter()
+    export(run, times, options, args.output_dir, args.fps, args.workers)
+    print(f"Saved in {args.output_dir / run.name} ({timer.perf_counter() - start:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Figures of the cell data and microenvironment, shared by the pages and the exporter.
+
+The functions only plot the data they are passed (already read and downsampled), so
+that the same figures are drawn in the browser (see pages/single-time.py and
+pages/animations.py) and saved to image files without a browser (see export).
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import gridstore
+import profiling
+
+Range = Tuple[float, float]
+
+
+@profiling.timed("figure")
+def plot_scatter_3d(cells: pd.DataFrame) -> go.Figure:
+    """Plots the cells in 3D, colored by their phase."""
+    fig = px.scatter_3d(
+        cells,
+        x="position_x",
+        y="position_y",
+        z="position_z",
+        size="total_volume",
+        color="current_phase",
+        hover_data=["current_phase", "count"],
+        opacity=0.7,
+    )
+    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0))
+    fig.update(layout_showlegend=False)
+    return fig
+
+
+@profiling.timed("figure")
+def plot_status_3d(cells: pd.DataFrame) -> go.Figure:
+    """Plots the cells in 3D, colored by their status (the "live_status" column)."""
+    fig = px.scatter_3d(
+        cells,
+        x="position_x",
+        y="position_y",
+        z="position_z",
+        size="total_volume",
+        color="live_status",
+        hover_data=["current_phase", "count"],
+        opacity=0.7,
+    )
+    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0))
+    return fig
+
+
+@profiling.timed("figure")
+def plot_scatter_2d(cells: pd.DataFrame, custom_data: str, color_range: Range) -> go.Figure:
+    """
+    Plots the cells in the xy plane, colored by the custom data.
+
+    The color range is usually the range of the variable over all the time points, so
+    that the colors can be compared between frames.
+    """
+    fig = px.scatter(
+        cells,
+        x="position_x",
+        y="position_y",
+        size="total_volume",
+        color_continuous_scale="viridis",
+        range_color=color_range,
+        color=custom_data,
+        # The cell ID is the first value of the custom data (see pages/single-time.py)
+        hover_data=["ID", "current_phase", "count"],
+        opacity=0.7,
+    )
+    # Keeps the zoom when the figure is updated
+    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0), uirevision="2d-scatter")
+    return fig
+
+
+@profiling.timed("figure")
+def plot_animation_frame(
+    cells: pd.DataFrame,
+    custom_data: str,
+    time: float,
+    color_range: Range,
+    x_range: Range,
+    y_range: Range,
+) -> go.Figure:
+    """
+    Plots a frame of the animation: the 2D scatter plot with fixed axes and the time.
+
+    The animations page draws the same frames in the browser, from the chunks of data
+    sent by update_animation_chunk.
+    """
+    fig = plot_scatter_2d(cells, custom_data, color_range)
+    fig.update_layout(
+        margin=dict(l=0, r=0, b=0, t=30),
+        title_text=f"time = {time}",
+        xaxis_range=x_range,
+        yaxis_range=y_range,
+    )
+    return fig
+
+
+@profiling.timed("figure")
+def plot_heatmap(
+    values: np.ndarray, palette: str, axis: str, ticks: Optional[dict] = None
+) -> go.Figure:
+    """
+    Plots a slice (or projection) of a concentration grid along the axis.
+
+    If the values are quantized, the ticks of the color bar (labelled with the
+    concentrations, see transport.get_quantized_colorbar) are passed, and the values
+    aren't shown on hover.
+    """
+    fig = px.imshow(
+        values,
+        color_continuous_scale=palette,
+        # title=f"Substance: {substance}",
+        # zmin=vmin,
+        # zmax=vmax,
+        # labels=dict(x="X coordinates", y="Y coordinates", color="Concentration"),
+    )
+    fig.update_layout(coloraxis=dict(colorbar=dict(orientation="h", y=-0.5, **(ticks or {}))))
+    # The rows and columns of the slice are the other two axes, in (z, y, x) order
+    rows_axis, columns_axis = [name for name in gridstore.AXES if name != axis]
+    fig.update_xaxes(showticklabels=False, title=columns_axis)
+    fig.update_yaxes(showticklabels=False, title=rows_axis)
+    if ticks is not None:
+        fig.update_traces(hoverinfo="skip", hovertemplate=None)
+    return fig
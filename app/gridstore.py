@@ -0,0 +1,111 @@
+"""
+Chunked on-disk store of the microenvironment grids, to slice 3D grids without decoding them.
+
+The first time a frame is displayed, its microenvironment file is decoded once and the
+grid of each substance is saved as a NumPy file in the cache folder (one folder per
+frame, one file per substance). The files are then memory-mapped: in their (z, y, x)
+order, a z-slice is a contiguous block of the file, and y- and x-slices or projections
+only read the voxels they need, without decoding the output file again.
+"""
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+import microenv
+import profiling
+
+# Name of the store folder (in the cache folder)
+STORE_FOLDER = "grids"
+# Axes of the stored grids, in their order in the files
+AXES = ["z", "y", "x"]
+# Type of the stored concentrations (they are only displayed)
+STORE_DTYPE = np.float32
+
+# One lock per frame, so that concurrent callbacks only write its grids once
+_FRAME_LOCKS: Dict[Tuple[Path, int], threading.Lock] = {}
+_FRAME_LOCKS_LOCK = threading.Lock()
+
+
+def get_frame_folder(frame: int, store_path: Union[str, Path]) -> Path:
+    """Returns the folder of the stored grids of the given frame."""
+    return Path(store_path) / str(frame).zfill(8)
+
+
+def get_grid_path(frame: int, substance: str, store_path: Union[str, Path]) -> Path:
+    """Returns the file of the stored grid of the substance at the given frame."""
+    return get_frame_folder(frame, store_path) / f"{substance}.npy"
+
+
+def write_grids(frame: int, output_path: Union[str, Path], store_path: Union[str, Path]) -> None:
+    """Decodes the microenvironment file of the given frame and stores the grid of each substance."""
+    folder = get_frame_folder(frame, store_path)
+    folder.mkdir(parents=True, exist_ok=True)
+    substances = microenv.get_substances(Path(output_path))
+    for substance, grid in zip(substances, microenv.read_grids(frame, Path(output_path))):
+        path = get_grid_path(frame, substance, store_path)
+        # Written under another name first, so that a grid is never read half-written
+        temporary_path = path.with_suffix(".tmp.npy")
+        np.save(temporary_path, np.ascontiguousarray(grid, dtype=STORE_DTYPE))
+        os.replace(temporary_path, path)
+
+
+def remove_frames(frames: Iterable[int], store_path: Union[str, Path]) -> None:
+    """Removes the stored grids of the given frames (e.g., when their files changed)."""
+    for frame in frames:
+        shutil.rmtree(get_frame_folder(frame, store_path), ignore_errors=True)
+
+
+def open_grid(
+    frame: int, substance: str, output_path: Union[str, Path], store_path: Union[str, Path]
+) -> np.ndarray:
+    """
+    Returns the (z, y, x) grid of the substance at the given frame, memory-mapped.
+
+    The grids of the frame are stored first if needed.
+    """
+    path = get_grid_path(frame, substance, store_path)
+    if not path.is_file():
+        with _FRAME_LOCKS_LOCK:
+            lock = _FRAME_LOCKS.setdefault((Path(store_path), frame), threading.Lock())
+        with lock:
+            # Another callback may have stored the grids while this one was waiting
+            if not path.is_file():
+                write_grids(frame, output_path, store_path)
+    return np.load(path, mmap_mode="r")
+
+
+def get_shape(output_path: Union[str, Path]) -> Dict[str, int]:
+    """Returns the number of voxels along each axis of the microenvironment grids."""
+    x_coords, y_coords, z_coords = microenv.get_mesh(Path(output_path))
+    return {"z": len(z_coords), "y": len(y_coords), "x": len(x_coords)}
+
+
+@profiling.timed("load")
+def read_slice(
+    frame: int,
+    substance: str,
+    axis: str,
+    index: Optional[int],
+    output_path: Union[str, Path],
+    store_path: Union[str, Path],
+) -> np.ndarray:
+    """
+    Returns a 2D view of the grid of the substance at the given frame.
+
+    The view is the slice at the given index along the axis ("z", "y" or "x"), or the
+    maximum intensity projection along the axis if the index is None. The other two
+    axes are kept in (z, y, x) order, e.g., a z-slice has a (y, x) shape.
+    """
+    grid = open_grid(frame, substance, output_path, store_path)
+    position = AXES.index(axis)
+    if index is None:
+        view = grid.max(axis=position)
+    else:
+        view = np.take(grid, min(index, grid.shape[position] - 1), axis=position)
+    profiling.add_bytes_read(grid.nbytes if index is None else view.nbytes)
+    # Copied, so that the file isn't kept open by the returned array
+    return np.array(view)
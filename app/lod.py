@@ -0,0 +1,94 @@
+"""
+Level of detail for the scatter plots of large cell populations.
+
+When there are more cells in view than the point budget of a figure, the cells are
+binned into a regular grid (voxels) and each bin is drawn as a single point, placed at
+the mean position of its cells and holding their count and mean values. Zooming into a
+region reduces the number of cells in view, until they are drawn at full resolution.
+"""
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# Default maximum number of points drawn in a figure
+POINT_BUDGET = 20000
+
+Range = Tuple[float, float]
+
+
+def get_view_range(relayout_data: Optional[Dict]) -> Optional[Tuple[Range, Range]]:
+    """
+    Returns the x and y ranges of a zoomed 2D figure from its relayout data.
+
+    Returns None when the figure shows the whole domain (e.g., after a reset).
+
+    >>> get_view_range({"xaxis.range[0]": 0, "xaxis.range[1]": 10, "yaxis.range[0]": -5, "yaxis.range[1]": 5})
+    ((0, 10), (-5, 5))
+    >>> get_view_range({"xaxis.autorange": True, "yaxis.autorange": True})
+    """
+    keys = ["xaxis.range[0]", "xaxis.range[1]", "yaxis.range[0]", "yaxis.range[1]"]
+    if relayout_data is None or any(key not in relayout_data for key in keys):
+        return None
+    x_min, x_max, y_min, y_max = (relayout_data[key] for key in keys)
+    return (x_min, x_max), (y_min, y_max)
+
+
+def select_region(
+    cells: pd.DataFrame, coordinates: Sequence[str], ranges: Sequence[Range]
+) -> pd.DataFrame:
+    """Returns the cells inside the box defined by the coordinate ranges."""
+    inside = np.ones(len(cells), dtype=bool)
+    for coordinate, (minimum, maximum) in zip(coordinates, ranges):
+        values = cells[coordinate].to_numpy()
+        inside &= (values >= minimum) & (values <= maximum)
+    return cells[inside]
+
+
+def aggregate_bins(
+    cells: pd.DataFrame, coordinates: Sequence[str], bins_per_axis: int
+) -> pd.DataFrame:
+    """
+    Bins the cells in a regular grid and returns the count and mean values of each bin.
+
+    The grid spans the bounding box of the cells, with the same number of bins along
+    each of the passed coordinates.
+    """
+    codes = np.zeros(len(cells), dtype=np.int64)
+    for coordinate in coordinates:
+        values = cells[coordinate].to_numpy()
+        minimum, maximum = values.min(), values.max()
+        width = (maximum - minimum) / bins_per_axis or 1.0
+        bin_idx = np.clip(((values - minimum) / width).astype(np.int64), 0, bins_per_axis - 1)
+        codes = codes * bins_per_axis + bin_idx
+
+    grouped = cells.groupby(codes, sort=False)
+    binned = grouped.mean(numeric_only=True)
+    binned["count"] = grouped.size()
+    return binned.reset_index(drop=True)
+
+
+@profiling.timed("filter")
+def downsample(
+    cells: pd.DataFrame,
+    coordinates: Sequence[str],
+    point_budget: int = POINT_BUDGET,
+    ranges: Optional[Sequence[Range]] = None,
+) -> pd.DataFrame:
+    """
+    Returns the cells to be drawn in a figure, with a "count" column.
+
+    Only the cells inside the ranges (when passed) are kept. If there are more cells
+    than the point budget, they are aggregated in bins (see aggregate_bins), so that the
+    number of points stays within the budget. Otherwise, every cell is returned with a
+    count of 1.
+    """
+    if ranges is not None:
+        cells = select_region(cells, coordinates, ranges)
+    if len(cells) <= point_budget:
+        return cells.assign(count=1)
+
+    bins_per_axis = max(1, int(point_budget ** (1 / len(coordinates))))
+    return aggregate_bins(cells, coordinates, bins_per_axis)
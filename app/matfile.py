@@ -0,0 +1,139 @@
+"""
+Reads selected rows of a matrix from a MAT file, without decoding the whole matrix.
+
+PhysiCell saves the cell data as a (variables, cells) matrix of doubles. When the matrix
+is stored uncompressed (MAT v4, as written by PhysiCell, or uncompressed MAT v5), the
+header is parsed to find where the data starts, and the file is memory-mapped so that
+only the requested variables are copied into memory. Other files (e.g., compressed MAT
+v5 files) are read with scipy.io.loadmat.
+"""
+import struct
+from pathlib import Path
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+from scipy import io as sio
+
+import profiling
+
+# Data layout of a matrix in a file: data offset, (rows, columns) and dtype
+MatrixLayout = Tuple[int, Tuple[int, int], np.dtype]
+
+# MAT v4 precision codes (P digit of the MOPT type)
+MAT4_DTYPES = {0: "f8", 1: "f4", 2: "i4", 3: "i2", 4: "u2", 5: "u1"}
+# MAT v5 data types and classes
+MI_DOUBLE = 9
+MI_MATRIX = 14
+MX_DOUBLE_CLASS = 6
+MAT5_COMPLEX_FLAG = 0x0800
+
+
+def find_mat4_matrix(file, name: str) -> Optional[MatrixLayout]:
+    """Returns the layout of the named matrix in a MAT v4 file (None if it can't be mapped)."""
+    while True:
+        header = file.read(20)
+        if len(header) < 20:
+            return None
+        # The byte order is found from the type, which is always between 0 and 5000
+        byte_order = "<" if 0 <= struct.unpack("<i", header[:4])[0] < 5000 else ">"
+        mopt, n_rows, n_cols, imaginary, name_length = struct.unpack(f"{byte_order}5i", header)
+        precision, matrix_type = mopt // 10 % 10, mopt % 10
+        dtype = np.dtype(byte_order + MAT4_DTYPES[precision])
+        matrix_name = file.read(name_length).rstrip(b"\x00").decode()
+        data_size = n_rows * n_cols * dtype.itemsize * (2 if imaginary else 1)
+
+        if matrix_name == name:
+            if matrix_type != 0 or imaginary:
+                return None
+            return file.tell(), (n_rows, n_cols), dtype
+        file.seek(data_size, 1)
+
+
+def read_mat5_tag(file, byte_order: str) -> Tuple[int, int, Optional[bytes]]:
+    """
+    Reads a MAT v5 data element tag and returns its type and size.
+
+    For small data elements (4 bytes or less, packed in the tag), the data is also returned.
+    """
+    tag = file.read(8)
+    data_type, size = struct.unpack(f"{byte_order}2I", tag)
+    if data_type >> 16:
+        small_size, small_type = data_type >> 16, data_type & 0xFFFF
+        return small_type, small_size, tag[4:4 + small_size]
+    return data_type, size, None
+
+
+def find_mat5_matrix(file, name: str) -> Optional[MatrixLayout]:
+    """Returns the layout of the named matrix in a MAT v5 file (None if it can't be mapped)."""
+    header = file.read(128)
+    byte_order = "<" if header[126:128] == b"IM" else ">"
+    while True:
+        start = file.tell()
+        if len(file.read(8)) < 8:
+            return None
+        file.seek(start)
+        element_type, element_size, _ = read_mat5_tag(file, byte_order)
+        next_element = start + 8 + element_size + (-element_size % 8)
+        # Compressed elements can't be memory-mapped
+        if element_type != MI_MATRIX:
+            file.seek(next_element)
+            continue
+
+        _, _, _ = read_mat5_tag(file, byte_order)
+        flags = struct.unpack(f"{byte_order}2I", file.read(8))[0]
+        _, dims_size, _ = read_mat5_tag(file, byte_order)
+        dims = struct.unpack(f"{byte_order}{dims_size // 4}i", file.read(dims_size))
+        file.read(-dims_size % 8)
+        _, name_size, small_name = read_mat5_tag(file, byte_order)
+        if small_name is None:
+            small_name = file.read(name_size)
+            file.read(-name_size % 8)
+        matrix_name = small_name[:name_size].decode()
+
+        if matrix_name == name:
+            data_type, _, small_data = read_mat5_tag(file, byte_order)
+            if (
+                flags & 0xFF != MX_DOUBLE_CLASS
+                or flags & MAT5_COMPLEX_FLAG
+                or len(dims) != 2
+                or data_type != MI_DOUBLE
+                or small_data is not None
+            ):
+                return None
+            return file.tell(), (dims[0], dims[1]), np.dtype(f"{byte_order}f8")
+        file.seek(next_element)
+
+
+def find_matrix(path: Union[str, Path], name: str) -> Optional[MatrixLayout]:
+    """Returns the layout of the named matrix in a MAT file (None if it can't be mapped)."""
+    with open(path, "rb") as file:
+        # MAT v5 files start with a text header, MAT v4 files with a (small) integer type
+        is_mat4 = 0 in file.read(4)
+        file.seek(0)
+        if is_mat4:
+            return find_mat4_matrix(file, name)
+        return find_mat5_matrix(file, name)
+
+
+@profiling.timed("load")
+def read_rows(path: Union[str, Path], name: str, rows: Sequence[int]) -> np.ndarray:
+    """
+    Returns the passed rows of the named matrix of a MAT file, as a (rows, columns) array.
+
+    The matrix is stored by column, so each row is read with a stride. Only the selected
+    rows are copied into memory.
+    """
+    layout = find_matrix(path, name)
+    if layout is None:
+        profiling.add_bytes_read(Path(path).stat().st_size)
+        return sio.loadmat(path, variable_names=[name])[name][list(rows)]
+
+    offset, (n_rows, n_cols), dtype = layout
+    if n_rows * n_cols == 0:
+        return np.empty((len(rows), n_cols))
+    matrix = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(n_cols, n_rows))
+    selected = np.array(matrix[:, list(rows)].T, dtype=float)
+    profiling.add_bytes_read(len(rows) * n_cols * np.dtype(dtype).itemsize)
+    # Closes the file (it would stay open on Windows otherwise)
+    del matrix
+    return selected
@@ -0,0 +1,242 @@
+"""
+Memoization of the figures (and other outputs) built by the page callbacks.
+
+The results are keyed on the function that built them (page and callback, and a
+fingerprint of its code), its inputs and the version of the cached data, so a figure is
+only built once for each combination of inputs until new frames are ingested. The results are kept in an in-process LRU
+cache and, optionally, in a SQLite file that is shared by every process of the server
+(e.g., the workers of gunicorn).
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+from pathlib import Path
+from types import CodeType
+from typing import Any, Callable, Hashable, Optional, Tuple, Union
+
+import plotly
+from plotly.io.json import to_json_plotly
+
+import profiling
+
+# Memory budget (in bytes of JSON) for the results kept in memory
+MEMORY_BUDGET = 128 * 1024**2
+# Size limit (in bytes, compressed) of the disk cache
+DISK_BUDGET = 1024**3
+# Name of the disk cache file (in the cache folder)
+DISK_FILE = "figures.sqlite"
+# Version of the cached results, to be increased when the results change without a change
+# in the code of the memoized functions (e.g., in the figures module they call)
+FORMAT_VERSION = 1
+
+
+class DiskCache:
+    """
+    A SQLite table of compressed JSON results, shared by several processes.
+
+    The least recently used results are deleted when the file exceeds its size limit.
+    """
+
+    def __init__(self, path: Union[str, Path], size_limit: int = DISK_BUDGET):
+        self.path = Path(path)
+        self.size_limit = size_limit
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, payload BLOB, size INTEGER, accessed REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread."""
+        if getattr(self._local, "connection", None) is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            # Readers don't block the writer (and vice versa)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return self._local.connection
+
+    def get(self, key: str) -> Optional[str]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT payload FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        return zlib.decompress(row[0]).decode()
+
+    def put(self, key: str, payload: str) -> None:
+        compressed = zlib.compress(payload.encode(), 1)
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, compressed, len(compressed), time.time()),
+            )
+            size = connection.execute("SELECT SUM(size) FROM results").fetchone()[0]
+            if size > self.size_limit:
+                # Deletes the oldest results, down to 90% of the limit
+                connection.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM ("
+                    "SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS total "
+                    "FROM results) WHERE total > ?)",
+                    (0.9 * self.size_limit,),
+                )
+
+    def clear(self) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM results")
+
+
+class ResultCache:
+    """
+    A two-tier cache of JSON results: a memory-bounded LRU and an optional DiskCache.
+
+    The results are returned as decoded JSON (dicts, lists and numbers), so a cached
+    figure is sent to the browser without being validated again by Plotly.
+    """
+
+    def __init__(self, memory_budget: int = MEMORY_BUDGET, disk: Optional[DiskCache] = None):
+        self.memory_budget = memory_budget
+        self.disk = disk
+        self.size = 0
+        self._results: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached result (from memory, then from disk), or None."""
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key][0]
+        if self.disk is not None:
+            try:
+                payload = self.disk.get(key)
+            except sqlite3.Error:
+                # The disk cache is only an optimization (e.g., the file may be locked)
+                payload = None
+            if payload is not None:
+                result = json.loads(payload)
+                self._remember(key, result, len(payload))
+                return result
+        return None
+
+    @profiling.timed("serialize")
+    def put(self, key: str, result: Any) -> Any:
+        """Caches the result and returns its decoded JSON version."""
+        payload = to_json_plotly(result)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, payload)
+            except sqlite3.Error:
+                pass
+        result = json.loads(payload)
+        self._remember(key, result, len(payload))
+        return result
+
+    def _remember(self, key: str, result: Any, size: int) -> None:
+        """Keeps the result in memory, evicting the least recently used results."""
+        if size > self.memory_budget:
+            return
+        with self._lock:
+            if key in self._results:
+                self.size -= self._results.pop(key)[1]
+            self._results[key] = (result, size)
+            self.size += size
+            while self.size > self.memory_budget:
+                _, (_, evicted_size) = self._results.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self) -> None:
+        """Forgets the results kept in memory (the disk cache is shared, so it is kept)."""
+        with self._lock:
+            self._results.clear()
+            self.size = 0
+
+
+RESULTS = ResultCache()
+
+
+def configure(
+    memory_budget: int = MEMORY_BUDGET,
+    disk_path: Optional[Union[str, Path]] = None,
+    disk_budget: int = DISK_BUDGET,
+) -> None:
+    """
+    Sets the size of the memory cache and enables the disk cache (if a path is passed).
+
+    A memory budget of 0 disables the memory cache.
+    """
+    RESULTS.memory_budget = memory_budget
+    RESULTS.disk = None if disk_path is None else DiskCache(disk_path, disk_budget)
+    RESULTS.clear()
+
+
+def get_fingerprint(code: CodeType) -> str:
+    """
+    Returns a hash of the bytecode of a function, its constants and the names it uses.
+
+    The nested functions (e.g., lambdas) are included, but not the functions it calls.
+    """
+    fingerprint = hashlib.sha1(code.co_code)
+    for constant in code.co_consts:
+        # The representation of code objects holds their memory address, and the order
+        # of the sets of strings changes between processes
+        if isinstance(constant, CodeType):
+            value = get_fingerprint(constant)
+        elif isinstance(constant, frozenset):
+            value = repr(sorted(map(repr, constant)))
+        else:
+            value = repr(constant)
+        fingerprint.update(value.encode())
+    fingerprint.update(" ".join(code.co_names).encode())
+    return fingerprint.hexdigest()
+
+
+def get_key(name: str, args: tuple, version: Hashable) -> str:
+    """
+    Returns the cache key of a call (a hash of the function name, inputs and version).
+
+    The inputs and version must be JSON serializable (a TypeError is raised otherwise), so
+    that two different calls can't have the same key.
+    """
+    call = json.dumps([name, args, version], sort_keys=True)
+    return hashlib.sha1(call.encode()).hexdigest()
+
+
+def memoize(get_version: Callable[..., Hashable]) -> Callable:
+    """
+    Decorates a function so that its results are cached (see ResultCache).
+
+    The function must only depend on its (JSON serializable) arguments and on the data
+    version returned by get_version, which is called with the same arguments (e.g., to
+    return the version of the run passed to the function). The decorated function
+    returns decoded JSON (e.g., a figure dict instead of a go.Figure).
+    """
+
+    def decorator(function: Callable) -> Callable:
+        # Two callbacks of a page can have the same name, so the line is part of the name.
+        # The results cached on disk by an older version of the code aren't used.
+        name = f"{function.__module__}.{function.__qualname__}"
+        name += f":{function.__code__.co_firstlineno}:{get_fingerprint(function.__code__)}"
+        name += f":{FORMAT_VERSION}:{plotly.__version__}"
+
+        @wraps(function)
+        def wrapper(*args):
+            key = get_key(name, args, get_version(*args))
+            result = RESULTS.get(key)
+            if result is None:
+                result = RESULTS.put(key, function(*args))
+            return result
+
+        return wrapper
+
+    return decorator
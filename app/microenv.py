@@ -0,0 +1,96 @@
+"""
+Loads the microenvironment (substance concentration) grids from the output files.
+
+The decoded grids are kept in a memory-bounded LRU cache shared by every page, so that
+each microenvironment file is only read once while its grids are being displayed.
+"""
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+from xml.etree import ElementTree
+
+import numpy as np
+from scipy import io as sio
+
+import profiling
+import simindex
+from arraycache import ArrayCache
+
+# Memory budget (in bytes) for the decoded grids kept in memory
+MEMORY_BUDGET = 512 * 1024**2
+
+GRIDS = ArrayCache(MEMORY_BUDGET)
+# One lock per microenvironment file, so that concurrent callbacks only read it once
+_FILE_LOCKS: Dict[Tuple[Path, int], threading.Lock] = {}
+_FILE_LOCKS_LOCK = threading.Lock()
+
+
+def get_me_file_name(frame: int) -> str:
+    """Returns the PhysiCell microenvironment output file name for the given frame."""
+    return f"output{str(frame).zfill(8)}_microenvironment0.mat"
+
+
+@lru_cache()
+def get_substances(output_path: Path) -> List[str]:
+    """Returns the substances stored in the output files."""
+    return simindex.get_substances(output_path)
+
+
+@lru_cache()
+def get_mesh(output_path: Path) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the x, y and z coordinates of the microenvironment mesh."""
+    tree = ElementTree.parse(Path(output_path) / "output00000000.xml")
+    mesh = tree.find("microenvironment/domain/mesh")
+    coordinates = []
+    for axis in ["x", "y", "z"]:
+        node = mesh.find(f"{axis}_coordinates")
+        coordinates.append(np.array(node.text.split(node.get("delimiter")), dtype=float))
+    return tuple(coordinates)
+
+
+@profiling.timed("load")
+def read_grids(frame: int, output_path: Path) -> List[np.ndarray]:
+    """
+    Reads the microenvironment file of the given frame and returns the grid of each substance.
+
+    Each grid has a (z, y, x) shape, as the data of physicool.processing.Microenvironment.
+    """
+    x_coords, y_coords, z_coords = get_mesh(output_path)
+    me_file = Path(output_path) / get_me_file_name(frame)
+    me_data = sio.loadmat(me_file)["multiscale_microenvironment"]
+    profiling.add_bytes_read(me_file.stat().st_size)
+    # Group the voxels by z-level, keeping their order in the file within each plane
+    order = np.argsort(me_data[2], kind="stable")
+    shape = (len(z_coords), len(y_coords), len(x_coords))
+    return [
+        me_data[substance_idx + 4, order].reshape(shape)
+        for substance_idx in range(len(get_substances(output_path)))
+    ]
+
+
+def load_grid(frame: int, substance: str, output_path: Path) -> np.ndarray:
+    """
+    Returns the (z, y, x) concentration grid of the substance at the given frame.
+
+    The grids are read from the cache when possible. Otherwise, the grids of every
+    substance in the file are cached, as they are decoded together.
+    """
+    output_path = Path(output_path)
+    key = (output_path, frame, substance)
+    grid = GRIDS.get(key)
+    if grid is not None:
+        return grid
+
+    with _FILE_LOCKS_LOCK:
+        file_lock = _FILE_LOCKS.setdefault((output_path, frame), threading.Lock())
+    with file_lock:
+        # Another callback may have read the file while this one was waiting
+        grid = GRIDS.get(key)
+        if grid is None:
+            substances = get_substances(output_path)
+            grids = read_grids(frame, output_path)
+            for name, substance_grid in zip(substances, grids):
+                GRIDS.put((output_path, frame, name), substance_grid)
+            grid = grids[substances.index(substance)]
+    return grid
@@ -1,70 +1,71 @@
-from pathlib import Path
 from typing import Dict
 
 import dash
 import dash_bootstrap_components as dbc
-from dash import dcc, html, Input, Output, callback
-from physicool import processing
+from dash import dcc, html, Input, Output, State, callback, clientside_callback
 import plotly.express as px
-import pandas as pd
-from scipy import io as sio
+
+import catalog
+import figures
+import lod
+import memo
+import timeindex
+import timeseries
+import transport
 
 palettes = px.colors.named_colorscales()
 
 dash.register_page(__name__)
 
-OUTPUT_PATH = Path("../output")
-frames = (
-    int(processing.get_cell_file_num(output_path=OUTPUT_PATH, version="1.10.2")) - 1
-)
+# The controls are created for the default run, and updated when another run is selected
+INDEX = catalog.get_index()
+# Number of frames sent to the browser at once, and number of frames left in the
+# current chunk when the next one is requested
+CHUNK_SIZE = 20
+CHUNK_MARGIN = 5
+# Time (in milliseconds) between two frames of the animation
+ANIMATION_INTERVAL = 500
+# Maximum number of points drawn in each frame of the animation (see lod.downsample)
+POINT_BUDGET = 20000
 
-SUBSTANCES = processing.Microenvironment(0, OUTPUT_PATH).substances
+SIMULATION = catalog.get_simulation()
+SUBSTANCES = SIMULATION.substances
+# Cell variables of the 3D scatter plot
+SCATTER_3D_VARIABLES = ["position_x", "position_y", "position_z", "current_phase", "total_volume"]
 
 #################################################################
 # CELL CONTAINER
 #################################################################
 
 
-def extract_data(
-    frame: int, variables_map: Dict[str, int], output_path: Path
-) -> pd.DataFrame:
-    """Extracts the passed variables from the output files for the given time point."""
-    time_str = str(frame).zfill(8)
-    path_name = output_path / f"output{time_str}_cells_physicell.mat"
-    cells = sio.loadmat(path_name)["cells"]
-    # Create a DataFrame where each column is a cell variable
-    data = pd.DataFrame({key: cells[value] for key, value in variables_map.items()})
-    # Add the current time point to the DataFrame to identify it later
-    data["time"] = frame
-    return data
-
-
 scatter_3d = dbc.Col([dcc.Graph(id="3d-scatter-time")])
 
 
-@callback(Output("3d-scatter-time", "figure"), Input("frame-slider", "value"))
-def update_bar_chart(slider_range):
-    variables_map = {
-        "position_x": 1,
-        "position_y": 2,
-        "position_z": 3,
-        "current_phase": 7,
-        "total_volume": 4,
-    }
-    df = extract_data(slider_range, variables_map, OUTPUT_PATH)
-    df["live_status"] = df["current_phase"] == 14
-    fig = px.scatter_3d(
-        df,
-        x="position_x",
-        y="position_y",
-        z="position_z",
-        size="total_volume",
-        color="live_status",
-        hover_data=["current_phase"],
-        opacity=0.7,
+@memo.memoize(catalog.get_version)
+def build_scatter_3d(run: str, time: float) -> dict:
+    """Returns the 3D scatter plot of the cells at the time point, colored by their status."""
+    cells = catalog.get_index(run).get_frame(time, columns=SCATTER_3D_VARIABLES)
+    cells = timeindex.remove_padding(cells)
+    cells = cells.assign(live_status=timeseries.is_live(cells["current_phase"]))
+    cells = lod.downsample(
+        cells,
+        coordinates=["position_x", "position_y", "position_z"],
+        point_budget=POINT_BUDGET,
     )
-    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0))
-    return fig
+    # The bins of downsampled cells hold the fraction of live cells
+    cells["live_status"] = cells["live_status"] >= 0.5
+    return transport.encode_figure(figures.plot_status_3d(cells))
+
+
+# Method to update the 3D scatter plot to the current frame of the animation
+@callback(
+    Output("3d-scatter-time", "figure"),
+    [Input("run", "value"), Input("animation-frame", "value")],
+)
+def update_bar_chart(run, frame):
+    times = catalog.get_index(run).times
+    # The slider may not be fitted to the time points of the run yet
+    return build_scatter_3d(run, times[min(frame, len(times) - 1)])
 
 
 scatter_dropdown = dbc.Col(
@@ -84,43 +85,174 @@ scatter_dropdown = dbc.Col(
     ]
 )
 
-scatter_2d = dbc.Col([scatter_dropdown, html.Br(), dcc.Graph(id="2d-scatter-time")])
-
-
-@callback(Output("2d-scatter-time", "figure"), Input("scatter-custom", "value"))
-def update_bar_chart(custom_data):
-    variables_map = {
-        "position_x": 1,
-        "position_y": 2,
-        "position_z": 3,
-        "current_phase": 7,
-        "total_volume": 4,
-        "intra_oxy": 27,
-        "intra_glu": 28,
-        "intra_lac": 29,
-        "intra_energy": 30,
+animation_controls = dbc.Row(
+    [
+        dbc.Col(
+            dbc.Button("Play", id="animation-play", color="primary", n_clicks=0),
+            width="auto",
+        ),
+        dbc.Col(
+            dcc.Slider(
+                min=0,
+                max=len(INDEX.times) - 1,
+                step=1,
+                value=0,
+                id="animation-frame",
+                marks=None,
+                tooltip={"placement": "bottom", "always_visible": True},
+            )
+        ),
+        dcc.Interval(id="animation-interval", interval=ANIMATION_INTERVAL, disabled=True),
+        dcc.Store(id="animation-chunk"),
+    ],
+    align="center",
+)
+
+scatter_2d = dbc.Col(
+    [
+        scatter_dropdown,
+        html.Br(),
+        dcc.Graph(id="2d-scatter-time"),
+        animation_controls,
+    ]
+)
+
+
+@callback(
+    [Output("animation-interval", "disabled"), Output("animation-play", "children")],
+    Input("animation-play", "n_clicks"),
+)
+def toggle_animation(n_clicks):
+    is_playing = n_clicks % 2 == 1
+    return not is_playing, "Pause" if is_playing else "Play"
+
+
+# Method to move the animation to the next frame (runs in the browser)
+clientside_callback(
+    """
+    function(n_intervals, frame, max_frame) {
+        return frame >= max_frame ? 0 : frame + 1;
     }
-    df = pd.concat(
-        [
-            extract_data(frame, variables_map, output_path=OUTPUT_PATH)
-            for frame in range(frames)
-        ],
-        ignore_index=True,
+    """,
+    Output("animation-frame", "value"),
+    Input("animation-interval", "n_intervals"),
+    [State("animation-frame", "value"), State("animation-frame", "max")],
+    prevent_initial_call=True,
+)
+
+
+# The slider is extended when new frames are ingested (live-tail) or another run is selected
+@callback(
+    Output("animation-frame", "max"), [Input("time-data", "data"), Input("run", "value")]
+)
+def update_animation_frames(_, run):
+    return len(catalog.get_index(run).times) - 1
+
+
+@memo.memoize(catalog.get_version)
+def load_animation_frame(run: str, time: float, custom_data: str) -> Dict[str, dict]:
+    """Returns the data of one animation frame (downsampled to the point budget)."""
+    cells = catalog.get_index(run).get_frame(
+        time, columns=["position_x", "position_y", "total_volume", "current_phase", custom_data]
     )
-    fig = px.scatter(
-        df,
-        x="position_x",
-        y="position_y",
-        animation_frame="time",
-        size="total_volume",
-        color_continuous_scale="viridis",
-        range_color=(df[custom_data].min(), df[custom_data].max()),
-        color=custom_data,
-        hover_data=["current_phase"],
-        opacity=0.7,
+    cells = lod.downsample(
+        timeindex.remove_padding(cells),
+        coordinates=["position_x", "position_y"],
+        point_budget=POINT_BUDGET,
     )
-    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0))
-    return fig
+    # The arrays are sent as typed arrays, which the browser passes on to Plotly.js
+    return {
+        "time": time,
+        "x": transport.encode_array(cells["position_x"].to_numpy()),
+        "y": transport.encode_array(cells["position_y"].to_numpy()),
+        "size": transport.encode_array(cells["total_volume"].to_numpy()),
+        "phase": transport.encode_array(cells["current_phase"].to_numpy()),
+        "color": transport.encode_array(cells[custom_data].to_numpy()),
+    }
+
+
+# Method to send the animation frames to the browser in chunks
+# A new chunk, starting at the current frame, is sent when the animation gets close to
+# the end of the current chunk or when the color variable changes. The positions and
+# volumes stay cached in the server, so only the new color variable is read from disk.
+@callback(
+    Output("animation-chunk", "data"),
+    [
+        Input("animation-frame", "value"),
+        Input("scatter-custom", "value"),
+        Input("run", "value"),
+    ],
+    State("animation-chunk", "data"),
+)
+def update_animation_chunk(frame, custom_data, run, chunk):
+    index = catalog.get_index(run)
+    times = index.times
+    if (
+        chunk is not None
+        and chunk.get("run") == run
+        and chunk["color"] == custom_data
+        and chunk["start"] <= frame
+        and min(frame + CHUNK_MARGIN, len(times)) <= chunk["start"] + len(chunk["frames"])
+    ):
+        return dash.no_update
+
+    chunk_times = times[frame:frame + CHUNK_SIZE]
+    max_volume = index.get_range("total_volume")[1]
+    return {
+        "run": run,
+        "start": frame,
+        "color": custom_data,
+        "range": index.get_range(custom_data),
+        "x_range": index.get_range("position_x"),
+        "y_range": index.get_range("position_y"),
+        # Same marker scaling as plotly express (size_max=20)
+        "size_ref": 2.0 * max_volume / 20**2 if max_volume > 0 else 1.0,
+        "frames": [load_animation_frame(run, time, custom_data) for time in chunk_times],
+    }
+
+
+# Method to draw the current frame from the chunk stored in the browser
+clientside_callback(
+    """
+    function(frame, chunk) {
+        if (!chunk || frame < chunk.start || frame >= chunk.start + chunk.frames.length) {
+            return window.dash_clientside.no_update;
+        }
+        const cells = chunk.frames[frame - chunk.start];
+        return {
+            data: [{
+                type: "scattergl",
+                mode: "markers",
+                x: cells.x,
+                y: cells.y,
+                customdata: cells.phase,
+                hovertemplate: "position_x=%{x}<br>position_y=%{y}<br>" +
+                    "current_phase=%{customdata}<extra></extra>",
+                marker: {
+                    size: cells.size,
+                    sizemode: "area",
+                    sizeref: chunk.size_ref,
+                    color: cells.color,
+                    colorscale: "Viridis",
+                    cmin: chunk.range[0],
+                    cmax: chunk.range[1],
+                    opacity: 0.7,
+                    colorbar: {title: {text: chunk.color}},
+                },
+            }],
+            layout: {
+                margin: {l: 0, r: 0, b: 0, t: 30},
+                title: {text: "time = " + cells.time},
+                xaxis: {range: chunk.x_range},
+                yaxis: {range: chunk.y_range},
+                uirevision: "animation",
+            },
+        };
+    }
+    """,
+    Output("2d-scatter-time", "figure"),
+    [Input("animation-frame", "value"), Input("animation-chunk", "data")],
+)
 
 
 scatter_div = dbc.Container([html.H2("Cell data"), dbc.Row([scatter_3d, scatter_2d])])
@@ -0,0 +1,280 @@
+from typing import List, Optional
+
+import dash
+import dash_bootstrap_components as dbc
+from dash import dcc, html, Input, Output, callback
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import cache
+import catalog
+import timeseries
+
+dash.register_page(__name__)
+
+SIMULATION = catalog.get_simulation()
+CUSTOM_VARIABLES = cache.get_series_variables(SIMULATION)
+COLUMNS = [
+    column for column in cache.get_columns(catalog.get_run().cache_path) if column != "time"
+]
+# Groups of the population plot and the prefix of their columns in the series table
+POPULATION_GROUPS = {"Live/dead": "status", "Phase": "phase=", "Cell type": "cell_type="}
+
+
+def get_runs(run: str, compared_runs: Optional[List[str]]) -> List[str]:
+    """Returns the selected run followed by the runs it is compared with."""
+    return list(dict.fromkeys([run] + (compared_runs or [])))
+
+
+def get_label(name: str, run: str, runs: List[str]) -> str:
+    """Returns the legend label of a line (prefixed by its run if several runs are shown)."""
+    return f"{run}: {name}" if len(runs) > 1 else name
+
+
+compare_dropdown = dbc.Container(
+    [
+        html.Label("Compare with runs:", htmlFor="compare-runs"),
+        dcc.Dropdown(options=catalog.RUNS.names, multi=True, id="compare-runs"),
+    ]
+)
+
+#################################################################
+# POPULATION CONTAINER
+#################################################################
+
+population_dropdown = dbc.Col(
+    [
+        html.Label("Count cells by:", htmlFor="population-groups"),
+        dcc.Dropdown(
+            options=[{"label": label, "value": value} for label, value in POPULATION_GROUPS.items()],
+            value="status",
+            clearable=False,
+            id="population-groups",
+        ),
+    ],
+    width=4,
+)
+
+population_div = dbc.Container(
+    [
+        html.H2("Population"),
+        dbc.Row([population_dropdown]),
+        dcc.Graph(id="population-graph"),
+    ]
+)
+
+
+# Method to plot the number of cells of each group over time
+# The counts are read from the precomputed series table (updated with new frames)
+@callback(
+    Output("population-graph", "figure"),
+    [
+        Input("population-groups", "value"),
+        Input("time-data", "data"),
+        Input("run", "value"),
+        Input("compare-runs", "value"),
+    ],
+)
+def update_population(groups, time_data, run, compared_runs):
+    fig = go.Figure()
+    runs = get_runs(run, compared_runs)
+    for name in runs:
+        series = cache.load_series(catalog.get_run(name).cache_path)
+        if groups == "status":
+            columns = ["live", "dead"]
+        else:
+            columns = [column for column in series.columns if column.startswith(groups)]
+        for column in columns:
+            label = get_label(column, name, runs)
+            fig.add_trace(go.Scatter(x=series["time"], y=series[column], name=label))
+    fig.update_layout(
+        margin=dict(l=0, r=0, b=0, t=0),
+        xaxis_title="time",
+        yaxis_title="Number of cells",
+    )
+    return fig
+
+
+#################################################################
+# CELL VARIABLES CONTAINER
+#################################################################
+
+variable_dropdown = dbc.Col(
+    [
+        html.Label("Custom data:", htmlFor="series-variable"),
+        dcc.Dropdown(
+            options=CUSTOM_VARIABLES,
+            value=CUSTOM_VARIABLES[0] if CUSTOM_VARIABLES else None,
+            id="series-variable",
+        ),
+    ],
+    width=4,
+)
+
+variable_div = dbc.Container(
+    [
+        html.H2("Cell variables"),
+        dbc.Row([variable_dropdown]),
+        dcc.Graph(id="variable-graph"),
+    ]
+)
+
+
+# Method to plot the distribution of a custom variable over time
+# The median is drawn with the interquartile range, and the mean with the standard deviation
+@callback(
+    Output("variable-graph", "figure"),
+    [
+        Input("series-variable", "value"),
+        Input("time-data", "data"),
+        Input("run", "value"),
+        Input("compare-runs", "value"),
+    ],
+)
+def update_variable(variable, time_data, run, compared_runs):
+    fig = go.Figure()
+    if variable is None:
+        return fig
+    runs = get_runs(run, compared_runs)
+    for name in runs:
+        series = cache.load_series(catalog.get_run(name).cache_path)
+        if f"{variable}.median" not in series:
+            continue
+        time = series["time"]
+        fig.add_trace(
+            go.Scatter(
+                x=time,
+                y=series[f"{variable}.q25"],
+                line_width=0,
+                showlegend=False,
+                legendgroup=name,
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=time,
+                y=series[f"{variable}.q75"],
+                fill="tonexty",
+                line_width=0,
+                name=get_label("IQR", name, runs),
+                legendgroup=name,
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=time,
+                y=series[f"{variable}.median"],
+                name=get_label("median", name, runs),
+                legendgroup=name,
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=time,
+                y=series[f"{variable}.mean"],
+                error_y=dict(array=series[f"{variable}.std"], thickness=1),
+                name=get_label("mean (± std)", name, runs),
+                legendgroup=name,
+            )
+        )
+    fig.update_layout(
+        margin=dict(l=0, r=0, b=0, t=0), xaxis_title="time", yaxis_title=variable
+    )
+    return fig
+
+
+#################################################################
+# CUSTOM AGGREGATION CONTAINER
+#################################################################
+
+aggregation_controls = dbc.Row(
+    [
+        dbc.Col(
+            [
+                html.Label("Cell variable:", htmlFor="aggregate-variable"),
+                dcc.Dropdown(
+                    options=COLUMNS, value="total_volume", id="aggregate-variable"
+                ),
+            ]
+        ),
+        dbc.Col(
+            [
+                html.Label("Statistic:", htmlFor="aggregate-statistic"),
+                dcc.Dropdown(
+                    options=timeseries.STATISTICS,
+                    value="mean",
+                    clearable=False,
+                    id="aggregate-statistic",
+                ),
+            ]
+        ),
+        dbc.Col(
+            [
+                html.Label("Group by:", htmlFor="aggregate-group"),
+                dcc.Dropdown(
+                    options=[group for group in timeseries.GROUP_VARIABLES if group in COLUMNS],
+                    value="cell_type",
+                    id="aggregate-group",
+                ),
+            ]
+        ),
+    ]
+)
+
+aggregation_div = dbc.Container(
+    [
+        html.H2("Custom aggregation"),
+        aggregation_controls,
+        dcc.Graph(id="aggregate-graph"),
+    ]
+)
+
+
+# Method to plot a statistic of any cell variable, per group of cells
+# Only the selected columns are read from the cache
+@callback(
+    Output("aggregate-graph", "figure"),
+    [
+        Input("aggregate-variable", "value"),
+        Input("aggregate-statistic", "value"),
+        Input("aggregate-group", "value"),
+        Input("time-data", "data"),
+        Input("run", "value"),
+        Input("compare-runs", "value"),
+    ],
+)
+def update_aggregation(variable, statistic, group_by, time_data, run, compared_runs):
+    if variable is None:
+        return go.Figure()
+    runs = get_runs(run, compared_runs)
+    results = []
+    for name in runs:
+        cache_path = catalog.get_run(name).cache_path
+        result = cache.aggregate_cells(variable, statistic, group_by, cache_path=cache_path)
+        result.columns = [get_label(str(column), name, runs) for column in result.columns]
+        results.append(result)
+    fig = px.line(pd.concat(results, axis=1), labels={"value": f"{statistic} of {variable}"})
+    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0), legend_title_text=group_by or "")
+    return fig
+
+
+#################################################################
+# APPLICATION LAYOUT
+#################################################################
+
+layout = dbc.Container(
+    [
+        html.Br(style={"line-height": "50px"}),
+        compare_dropdown,
+        html.Br(),
+        population_div,
+        html.Br(),
+        variable_div,
+        html.Br(),
+        aggregation_div,
+        html.Br(style={"line-height": "100px"}),
+    ],
+    fluid=True,
+    className="dbc",
+)
@@ -0,0 +1,175 @@
+from typing import Dict
+
+import dash
+import dash_bootstrap_components as dbc
+from dash import dcc, html, Input, Output, callback
+import pandas as pd
+import plotly.express as px
+
+import profiling
+
+dash.register_page(__name__)
+
+# Time (in milliseconds) between two updates of the metrics
+REFRESH_INTERVAL = 2000
+# Metrics shown in the table (the median of each stage)
+STAGE_COLUMNS = {f"{stage} (ms)": stage for stage in [*profiling.STAGES, "other"]}
+
+
+def get_table(report: Dict[str, Dict[str, dict]]) -> pd.DataFrame:
+    """Returns one row per callback, with the percentiles of its time and its median stages."""
+    rows = []
+    for output, metrics in sorted(report.items()):
+        if "total" not in metrics:
+            # Stages that didn't run in a request (e.g., prefetching) have no total time
+            continue
+        row = {"callback": output, "requests": int(metrics["total"]["count"])}
+        for percentile in profiling.PERCENTILES:
+            row[f"total {percentile} (ms)"] = metrics["total"][percentile]
+        for column, stage in STAGE_COLUMNS.items():
+            row[column] = metrics[stage]["p50"]
+        row["read (kB)"] = metrics["bytes_read"]["p50"] / 1024
+        row["payload (kB)"] = metrics["payload"]["p50"] / 1024
+        rows.append(row)
+    return pd.DataFrame(rows).round(1)
+
+
+#################################################################
+# CALLBACKS CONTAINER
+#################################################################
+
+histogram_controls = dbc.Row(
+    [
+        dbc.Col(
+            [
+                html.Label("Callback:", htmlFor="diagnostics-callback"),
+                dcc.Dropdown(id="diagnostics-callback"),
+            ]
+        ),
+        dbc.Col(
+            [
+                html.Label("Metric:", htmlFor="diagnostics-metric"),
+                dcc.Dropdown(
+                    options=profiling.TIMES + profiling.SIZES,
+                    value="total",
+                    clearable=False,
+                    id="diagnostics-metric",
+                ),
+            ],
+            width=3,
+        ),
+    ]
+)
+
+callbacks_div = dbc.Container(
+    [
+        html.H2("Callbacks"),
+        html.P(
+            [
+                "Median time of each stage and percentiles of the total time, over the last "
+                f"{profiling.WINDOW} requests of each callback (also available as JSON at ",
+                html.A(profiling.ENDPOINT, href=profiling.ENDPOINT, target="_blank"),
+                ").",
+            ]
+        ),
+        html.Div(id="diagnostics-table"),
+        histogram_controls,
+        dcc.Graph(id="diagnostics-histogram"),
+        dcc.Interval(id="diagnostics-interval", interval=REFRESH_INTERVAL),
+    ]
+)
+
+
+# Method to update the table of the callbacks (and the callbacks of the histogram)
+@callback(
+    [Output("diagnostics-table", "children"), Output("diagnostics-callback", "options")],
+    Input("diagnostics-interval", "n_intervals"),
+)
+def update_table(_):
+    table = get_table(profiling.get_report())
+    if table.empty:
+        return html.P("No callback has been called yet."), []
+    return dbc.Table.from_dataframe(table, size="sm", striped=True), table["callback"].tolist()
+
+
+# Method to plot the histogram of a metric of a callback (over its last requests)
+@callback(
+    Output("diagnostics-histogram", "figure"),
+    [
+        Input("diagnostics-interval", "n_intervals"),
+        Input("diagnostics-callback", "value"),
+        Input("diagnostics-metric", "value"),
+    ],
+)
+def update_histogram(_, output, metric):
+    metrics = profiling.get_report().get(output, {})
+    if metric not in metrics:
+        return px.bar()
+    edges = metrics[metric]["histogram"]["edges"]
+    unit = "bytes" if metric in profiling.SIZES else "ms"
+    fig = px.bar(
+        x=[(start + end) / 2 for start, end in zip(edges, edges[1:])],
+        y=metrics[metric]["histogram"]["counts"],
+        labels={"x": f"{metric} ({unit})", "y": "Number of requests"},
+    )
+    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0), bargap=0)
+    return fig
+
+
+#################################################################
+# PROFILES CONTAINER
+#################################################################
+
+
+def get_profiles_div() -> dbc.Container:
+    """Returns the profile controls (the switch shows whether the requests are profiled)."""
+    return dbc.Container(
+        [
+            html.H2("Profiles"),
+            dbc.Switch(
+                label="Profile each request with cProfile (slows the callbacks down)",
+                value=profiling.is_profiling(),
+                id="diagnostics-profiling",
+            ),
+            dcc.Dropdown(id="diagnostics-profile"),
+            html.Pre(id="diagnostics-profile-summary", style={"font-size": "small"}),
+        ]
+    )
+
+
+# Method to start or stop profiling the requests, and to list the saved profiles
+@callback(
+    Output("diagnostics-profile", "options"),
+    [
+        Input("diagnostics-profiling", "value"),
+        Input("diagnostics-interval", "n_intervals"),
+    ],
+)
+def update_profiles(enabled, _):
+    profiling.set_profiling(enabled)
+    return [{"label": path.stem, "value": str(path)} for path in profiling.get_profiles()]
+
+
+# Method to show the functions that took the most time in a saved profile
+@callback(
+    Output("diagnostics-profile-summary", "children"),
+    Input("diagnostics-profile", "value"),
+)
+def show_profile(profile_file):
+    # Only the saved profiles can be read
+    if profile_file not in [str(path) for path in profiling.get_profiles()]:
+        return "Select a saved profile to see the functions that took the most time."
+    return profiling.get_profile_summary(profile_file)
+
+
+#################################################################
+# APPLICATION LAYOUT
+#################################################################
+
+
+def layout(**_):
+    return dbc.Container(
+        [callbacks_div, html.Br(), get_profiles_div()],
+        fluid=True,
+        className="dbc",
+    )
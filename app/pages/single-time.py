@@ -1,35 +1,63 @@
-from pathlib import Path
-from typing import Dict
+import json
+from functools import partial
+from typing import List, Optional, Tuple
 
 import dash
 import dash_bootstrap_components as dbc
-from dash import dcc, html, Input, Output, callback
-from physicool import processing
+from dash import ctx, dcc, html, Input, Output, State, callback
 import plotly.express as px
-import pandas as pd
-from scipy import io as sio
+import plotly.graph_objects as go
+import numpy as np
+
+import cache
+import catalog
+import figures
+import gridstore
+import lod
+import memo
+import patches
+import prefetch
+import spatial
+import timeindex
+import tracks
+import transport
 
 palettes = px.colors.named_colorscales()
 
 dash.register_page(__name__)
 
-OUTPUT_PATH = Path("../output")
-DATA = pd.read_csv("output_data.csv")
-TIME_INTERVAL = int(DATA["time"].unique()[1])
-print(TIME_INTERVAL)
-
-SUBSTANCES = processing.Microenvironment(0, OUTPUT_PATH).substances
+# The controls are created for the default run, and updated when another run is selected
+RUN = catalog.get_run()
+INDEX = catalog.get_index()
+# Maximum number of points drawn in each scatter plot (see lod.downsample)
+POINT_BUDGET_3D = 10000
+POINT_BUDGET_2D = 20000
+# Bits of the heatmap values sent to the browser: None sends single-precision floats,
+# 8 or 16 sends quantized values (smaller, but without the values on hover)
+HEATMAP_BITS = None
+# Maximum number of cells tracked at the same time (clicked in the 2D scatter plot)
+MAX_TRACKED_CELLS = 10
+TIMES = INDEX.times
+COLUMNS = cache.get_columns(RUN.cache_path)
+TIME_INTERVAL = timeindex.get_step(TIMES)
+
+SIMULATION = catalog.get_simulation()
+SUBSTANCES = SIMULATION.substances
+# Number of voxels along each axis of the microenvironment grids
+GRID_SHAPE = gridstore.get_shape(RUN.output_path)
+# Builds the figures of the next frames in the background while the slider is moved
+PREFETCHER = prefetch.get_prefetcher()
 
 time_slider = dbc.Col(
     [
         html.Label(html.P("Select timestep (minutes)"), htmlFor="frame-slider"),
         html.Div(
             dcc.Slider(
-                min=DATA["time"].min(),
-                max=DATA["time"].max(),
+                min=TIMES[0],
+                max=TIMES[-1],
                 step=TIME_INTERVAL,
                 id="frame-slider",
-                value=DATA["time"].min(),
+                value=TIMES[0],
                 marks=None,
                 tooltip={"placement": "bottom", "always_visible": True},
             ),
@@ -39,42 +67,77 @@ time_slider = dbc.Col(
     width={"size": 4, "offset": 4},
 )
 
+
+# Method to extend the slider when new frames are ingested (live-tail)
+# If the slider was at the last time point, it follows the new frames, which updates
+# the figures through their own callbacks. The slider is also fitted to the time points
+# of another run (its step and the closest time point of the run).
+@callback(
+    [
+        Output("frame-slider", "min"),
+        Output("frame-slider", "max"),
+        Output("frame-slider", "step"),
+        Output("frame-slider", "value"),
+    ],
+    Input("time-data", "data"),
+    [
+        State("frame-slider", "min"),
+        State("frame-slider", "max"),
+        State("frame-slider", "step"),
+        State("frame-slider", "value"),
+    ],
+)
+def update_time_slider(time_data, slider_min, slider_max, slider_step, frame):
+    if time_data is None:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+    index = catalog.get_index(time_data["run"])
+    value = time_data["last"] if frame == slider_max else index.get_nearest(frame)
+    slider = time_data["first"], time_data["last"], timeindex.get_step(index.times), value
+    if slider == (slider_min, slider_max, slider_step, frame):
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+    return slider
+
+
 #################################################################
 # CELL CONTAINER
 #################################################################
 
 
-def extract_data(
-    frame: int, variables_map: Dict[str, int], output_path: Path
-) -> pd.DataFrame:
-    """Extracts the passed variables from the output files for the given time point."""
-    time_str = str(frame).zfill(8)
-    path_name = output_path / f"output{time_str}_cells_physicell.mat"
-    cells = sio.loadmat(path_name)["cells"]
-    # Create a DataFrame where each column is a cell variable
-    data = pd.DataFrame({key: cells[value] for key, value in variables_map.items()})
-    # Add the current time point to the DataFrame to identify it later
-    data["time"] = frame
-    return data
-
-
 scatter_3d = dbc.Col([dcc.Graph(id="3d-scatter")])
 
 
-@callback(Output("3d-scatter", "figure"), Input("frame-slider", "value"))
-def update_bar_chart(slider_range):
-    fig = px.scatter_3d(
-        DATA[DATA["time"] == slider_range],
-        x="position_x",
-        y="position_y",
-        z="position_z",
-        size="total_volume",
-        color="current_phase",
-        hover_data=["current_phase"],
-        opacity=0.7,
+@memo.memoize(catalog.get_version)
+def build_scatter_3d(run, slider_range):
+    cells = catalog.get_index(run).get_frame(
+        slider_range,
+        columns=["position_x", "position_y", "position_z", "total_volume", "current_phase"],
     )
-    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0))
-    fig.update(layout_showlegend=False)
+    cells = lod.downsample(
+        timeindex.remove_padding(cells),
+        coordinates=["position_x", "position_y", "position_z"],
+        point_budget=POINT_BUDGET_3D,
+    )
+    return transport.encode_figure(figures.plot_scatter_3d(cells))
+
+
+# Method to update the 3D scatter plot (the figures of the next frames are prefetched)
+@callback(
+    Output("3d-scatter", "figure"), [Input("frame-slider", "value"), Input("run", "value")]
+)
+def update_bar_chart(slider_range, run):
+    index = catalog.get_index(run)
+    slider_range = index.get_nearest(slider_range)
+
+    def get_tasks(time):
+        key = ("3d-scatter", run, index.version, time)
+        return [(key, partial(build_scatter_3d, run, time))]
+
+    fig = PREFETCHER.get(*get_tasks(slider_range)[0])
+    # The next frames are only scheduled once the current one is ready
+    PREFETCHER.update("3d-scatter", slider_range, index.times, get_tasks)
+    # Only the cell data is sent when the figure is displayed
+    if patches.is_update("frame-slider"):
+        return patches.get_trace_patch(fig)
     return fig
 
 
@@ -82,43 +145,273 @@ scatter_dropdown = dbc.Col(
     [
         html.Label("Custom data:", htmlFor="scatter-custom"),
         dcc.Dropdown(
-            options=DATA.columns,
-            value=DATA.columns[2],
+            options=COLUMNS,
+            value=COLUMNS[2],
             id="scatter-custom",
         ),
     ]
 )
 
-scatter_2d = dbc.Col([scatter_dropdown, html.Br(), dcc.Graph(id="2d-scatter")])
+scatter_2d = dbc.Col(
+    [
+        scatter_dropdown,
+        html.Br(),
+        dcc.Graph(id="2d-scatter"),
+        dcc.Store(id="tracked-cells", data=[]),
+        html.Div(id="selection-stats"),
+    ]
+)
+
 
+@memo.memoize(catalog.get_version)
+def build_scatter_2d(run, custom_data, frame, relayout_data):
+    index = catalog.get_index(run)
+    columns = {"ID", "position_x", "position_y", "total_volume", "current_phase", custom_data}
+    cells = lod.downsample(
+        timeindex.remove_padding(index.get_frame(frame, columns=list(columns))),
+        coordinates=["position_x", "position_y"],
+        point_budget=POINT_BUDGET_2D,
+        ranges=lod.get_view_range(relayout_data),
+    )
+    # The points that aggregate several cells can't be tracked
+    cells.loc[cells["count"] > 1, "ID"] = -1
+    fig = figures.plot_scatter_2d(cells, custom_data, index.get_range(custom_data))
+    return transport.encode_figure(fig)
 
+
+def get_track_traces(run: str, cell_ids: List[int], time: float) -> List[dict]:
+    """
+    Returns the trajectories of the tracked cells, with their position at the time point
+    highlighted (only the rows of the tracked cells are read, see tracks.load_tracks).
+    """
+    store_path = catalog.get_run(run).cache_path / tracks.TRACKS_FOLDER
+    cells = tracks.load_tracks(cell_ids, store_path, ["position_x", "position_y"])
+    traces = []
+    for cell_id, track in cells.groupby("ID"):
+        trace = go.Scatter(
+            x=track["position_x"].to_numpy(),
+            y=track["position_y"].to_numpy(),
+            customdata=track["time"].to_numpy(),
+            mode="lines+markers",
+            marker=dict(size=np.where(track["time"] == time, 12, 4)),
+            name=f"cell {cell_id}",
+            hovertemplate="time=%{customdata}<br>x=%{x}<br>y=%{y}",
+            showlegend=False,
+        )
+        traces.append(transport.encode_values(trace.to_plotly_json()))
+    return traces
+
+
+# Zooming into the plot (relayout) draws the cells in view at a finer level of detail
+# The trajectories of the tracked cells are drawn over the cells.
 @callback(
     Output("2d-scatter", "figure"),
     Input("scatter-custom", "value"),
     Input("frame-slider", "value"),
+    Input("2d-scatter", "relayoutData"),
+    Input("run", "value"),
+    Input("tracked-cells", "data"),
+)
+def update_bar_chart(custom_data, frame, relayout_data, run, tracked_cells):
+    # Selecting cells (see update_selection_stats) doesn't change the view
+    if ctx.triggered_id == "2d-scatter" and "selections" in (relayout_data or {}):
+        return dash.no_update
+    index = catalog.get_index(run)
+    frame = index.get_nearest(frame)
+    view = json.dumps(relayout_data, sort_keys=True)
+
+    def get_tasks(time):
+        key = ("2d-scatter", run, index.version, custom_data, time, view)
+        return [(key, partial(build_scatter_2d, run, custom_data, time, relayout_data))]
+
+    fig = PREFETCHER.get(*get_tasks(frame)[0])
+    PREFETCHER.update("2d-scatter", frame, index.times, get_tasks)
+    if tracked_cells:
+        fig = {**fig, "data": fig["data"] + get_track_traces(run, tracked_cells, frame)}
+    # A new color variable changes the color bar and hover text, so it isn't patched
+    if patches.is_update("frame-slider", "2d-scatter"):
+        return patches.get_trace_patch(fig)
+    return fig
+
+
+# Method to summarize the cells in the box or lasso selection of the 2D scatter plot
+# The cells are found with the spatial index of the time point, on the full cell data
+# (not only the drawn points), and the selection is kept when the time point changes.
+@callback(
+    Output("selection-stats", "children"),
+    [
+        Input("2d-scatter", "selectedData"),
+        Input("frame-slider", "value"),
+        Input("run", "value"),
+    ],
 )
-def update_bar_chart(custom_data, frame):
-    fig = px.scatter(
-        DATA[DATA["time"] == frame],
-        x="position_x",
-        y="position_y",
-        size="total_volume",
-        color_continuous_scale="viridis",
-        range_color=(DATA[custom_data].min(), DATA[custom_data].max()),
-        color=custom_data,
-        hover_data=["current_phase"],
-        opacity=0.7,
+def update_selection_stats(selection, frame, run):
+    index = catalog.get_index(run)
+    frame = index.get_nearest(frame)
+    frame_index = spatial.get_frame_index(index.cache_path, index.version, frame)
+    rows = spatial.select(frame_index, selection)
+    if rows is None:
+        return html.P("Select cells in the 2D plot (box or lasso) to see their statistics.")
+
+    variables = cache.get_series_variables(catalog.get_simulation(run))
+    cells = index.get_frame(frame, columns=["current_phase", *variables]).iloc[rows]
+    neighbours = frame_index.count_neighbours(rows=rows)
+    counts, means = spatial.get_region_stats(cells, variables, neighbours)
+    fig = px.bar(
+        x=counts.index.astype(str),
+        y=counts.to_numpy(),
+        labels={"x": "current_phase", "y": "Number of cells"},
     )
     fig.update_layout(margin=dict(l=0, r=0, b=0, t=0))
+    means = means.rename_axis("variable").reset_index(name="mean").round(3)
+    return [
+        html.P(
+            f"{len(rows)} cells selected (neighbours within {spatial.NEIGHBOUR_RADIUS} µm)"
+        ),
+        dcc.Graph(figure=fig, style={"height": "250px"}),
+        dbc.Table.from_dataframe(means, size="sm", striped=True),
+    ]
+
+
+# Method to track the cell clicked in the 2D scatter plot (clicking it again stops tracking it)
+@callback(
+    Output("tracked-cells", "data"),
+    [
+        Input("2d-scatter", "clickData"),
+        Input("track-clear", "n_clicks"),
+        Input("run", "value"),
+    ],
+    State("tracked-cells", "data"),
+)
+def update_tracked_cells(click_data, _, run, tracked_cells):
+    if ctx.triggered_id != "2d-scatter" or click_data is None:
+        return []
+    point = click_data["points"][0]
+    if "customdata" not in point or point["curveNumber"] != 0:
+        return dash.no_update
+    cell_id = int(point["customdata"][0])
+    if cell_id < 0:
+        return dash.no_update
+    if cell_id in tracked_cells:
+        return [tracked for tracked in tracked_cells if tracked != cell_id]
+    return (tracked_cells + [cell_id])[-MAX_TRACKED_CELLS:]
+
+
+# Method to plot the history of the tracked cells (the custom data over time)
+@callback(
+    Output("track-graph", "figure"),
+    [
+        Input("tracked-cells", "data"),
+        Input("scatter-custom", "value"),
+        Input("run", "value"),
+    ],
+)
+def update_track_graph(tracked_cells, custom_data, run):
+    store_path = catalog.get_run(run).cache_path / tracks.TRACKS_FOLDER
+    cells = tracks.load_tracks(tracked_cells, store_path, [custom_data])
+    cells["ID"] = cells["ID"].astype(str)
+    fig = px.line(cells, x="time", y=custom_data, color="ID", markers=True)
+    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0), legend_title_text="Cell ID")
     return fig
 
 
-scatter_div = dbc.Container([html.H2("Cell data"), dbc.Row([scatter_3d, scatter_2d])])
+track_div = dbc.Row(
+    [
+        dbc.Col(html.P("Click on a cell of the 2D plot to track it over time.")),
+        dbc.Col(
+            dbc.Button("Clear tracked cells", id="track-clear", color="secondary"),
+            width="auto",
+        ),
+        dcc.Graph(id="track-graph", style={"height": "300px"}),
+    ]
+)
+
+scatter_div = dbc.Container(
+    [html.H2("Cell data"), dbc.Row([scatter_3d, scatter_2d]), track_div]
+)
 
 #################################################################
 # ENVIRONMENT CONTAINER
 #################################################################
 
+
+def get_heatmap_values(grid: np.ndarray) -> Tuple[np.ndarray, Optional[dict]]:
+    """
+    Returns the values of a heatmap (from a 2D grid), reduced to the displayed resolution.
+
+    If the values are quantized (see HEATMAP_BITS), the ticks of the color bar are also
+    returned, labelled with the concentrations.
+    """
+    values = transport.reduce_grid(grid)
+    if HEATMAP_BITS is None:
+        return values, None
+    codes, offset, scale = transport.quantize(values, HEATMAP_BITS)
+    return codes, transport.get_quantized_colorbar(offset, scale, HEATMAP_BITS)
+
+
+def read_slice(
+    run: str, frame: float, substance: str, axis: str, index: Optional[int]
+) -> np.ndarray:
+    """Returns a slice of the grid of the substance at the given time point (see gridstore)."""
+    run = catalog.get_run(run)
+    frame_number = catalog.get_simulation(run.name).get_frame_number(frame)
+    store_path = run.cache_path / gridstore.STORE_FOLDER
+    return gridstore.read_slice(frame_number, substance, axis, index, run.output_path, store_path)
+
+
+@memo.memoize(catalog.get_version)
+def build_heatmap(
+    run: str, substance: str, frame: int, palette: str, axis: str, index: Optional[int]
+):
+    """
+    Plots a heatmap of the substance concentration at the given time point.
+
+    The heatmap shows the slice at the given index along the axis, or the maximum
+    intensity projection along the axis if the index is None (see gridstore.read_slice).
+    """
+    # Both heatmaps share the stored grids (changing the palette doesn't read any file)
+    grid = read_slice(run, frame, substance, axis, index)
+    values, ticks = get_heatmap_values(grid)
+    return transport.encode_figure(figures.plot_heatmap(values, palette, axis, ticks))
+
+
+def get_heatmap(
+    graph: str,
+    run: str,
+    substance: str,
+    frame: int,
+    palette: str,
+    palette_input: str,
+    data_inputs: List[str],
+    axis: str,
+    index: int,
+    projection: List[str],
+):
+    """
+    Returns the heatmap of a graph, or a patch of the displayed heatmap.
+
+    When only the palette changes, only the color scale is sent. When only the frame,
+    the substance or the slice index change (data_inputs), only the concentrations are
+    sent. The slices of the next frames are prefetched.
+    """
+    if patches.is_update(palette_input):
+        return patches.get_colorscale_patch(palette)
+
+    index = None if projection else index
+    run_index = catalog.get_index(run)
+
+    def get_tasks(time):
+        key = ("slice", run, run_index.version, time, substance, axis, index)
+        return [(key, partial(read_slice, run, time, substance, axis, index))]
+
+    grid = PREFETCHER.get(*get_tasks(frame)[0])
+    PREFETCHER.update(graph, frame, run_index.times, get_tasks)
+    if patches.is_update(*data_inputs, "slice-index"):
+        values, ticks = get_heatmap_values(grid)
+        return patches.get_heatmap_patch(transport.encode_array(values), ticks)
+    return build_heatmap(run, substance, frame, palette, axis, index)
+
+
 # First substance plot
 env_chart1 = dbc.Col(
     [
@@ -174,9 +467,21 @@ env_chart1 = dbc.Col(
         Input("substance", "value"),
         Input("frame-slider", "value"),
         Input("map", "value"),
+        Input("slice-axis", "value"),
+        Input("slice-index", "value"),
+        Input("slice-projection", "value"),
+        Input("run", "value"),
     ],
 )
-def filter_heatmap(substance: str, frame: int, palette: str):
+def filter_heatmap(
+    substance: str,
+    frame: int,
+    palette: str,
+    axis: str,
+    index: int,
+    projection: List[str],
+    run: str,
+):
     """
     Plots a heatmap with the substance concentration data.
 
@@ -184,16 +489,18 @@ def filter_heatmap(substance: str, frame: int, palette: str):
     substance: str
         The substance to be plotted (selected from the "substance" dropdown)
     """
-    # Load the data from the
-    me = processing.Microenvironment(int(frame/TIME_INTERVAL), OUTPUT_PATH)
-    fig = px.imshow(
-        me.data[substance][0],
-        color_continuous_scale=palette,
-        # title=f"Substance: {substance}",
+    return get_heatmap(
+        "graph",
+        run,
+        substance,
+        frame,
+        palette,
+        "map",
+        ["substance", "frame-slider"],
+        axis,
+        index,
+        projection,
     )
-    fig.update_layout(coloraxis=dict(colorbar=dict(orientation="h", y=-0.5)))
-    fig.update_xaxes(showticklabels=False).update_yaxes(showticklabels=False)
-    return fig
 
 
 env_chart2 = dbc.Col(
@@ -257,25 +564,101 @@ env_chart2 = dbc.Col(
         Input("map_2", "value"),
         Input("vmin_2", "value"),
         Input("vmax_2", "value"),
+        Input("slice-axis", "value"),
+        Input("slice-index", "value"),
+        Input("slice-projection", "value"),
+        Input("run", "value"),
     ],
 )
-def filter_heatmap(substance, frame, palette, vmin, vmax):
-    me = processing.Microenvironment(int(frame/TIME_INTERVAL), OUTPUT_PATH)
-    fig = px.imshow(
-        me.data[substance][0],
-        color_continuous_scale=palette,
-        # zmin=vmin,
-        # zmax=vmax,
-        # labels=dict(x="X coordinates", y="Y coordinates", color="Concentration"),
+def filter_heatmap(substance, frame, palette, vmin, vmax, axis, index, projection, run):
+    return get_heatmap(
+        "graph_2",
+        run,
+        substance,
+        frame,
+        palette,
+        "map_2",
+        ["substance_2", "frame-slider", "vmin_2", "vmax_2"],
+        axis,
+        index,
+        projection,
     )
-    fig.update_layout(coloraxis=dict(colorbar=dict(orientation="h", y=-0.5)))
-    fig.update_xaxes(showticklabels=False).update_yaxes(showticklabels=False)
-    return fig
+
+
+# Slice of the 3D grids shown by both heatmaps
+slice_controls = dbc.Row(
+    [
+        dbc.Col(
+            [
+                html.Label("Slice axis:", htmlFor="slice-axis"),
+                dcc.Dropdown(
+                    options=gridstore.AXES, value="z", clearable=False, id="slice-axis"
+                ),
+            ],
+            width=2,
+        ),
+        dbc.Col(
+            [
+                html.Label("Slice:", htmlFor="slice-index"),
+                dcc.Slider(
+                    min=0,
+                    max=GRID_SHAPE["z"] - 1,
+                    step=1,
+                    value=0,
+                    marks=None,
+                    tooltip={"placement": "bottom", "always_visible": True},
+                    id="slice-index",
+                ),
+            ]
+        ),
+        dbc.Col(
+            dbc.Checklist(
+                options=[{"label": "Maximum projection", "value": "max"}],
+                value=[],
+                switch=True,
+                id="slice-projection",
+            ),
+            width=3,
+        ),
+    ]
+)
+
+
+# Method to fit the slice slider to the number of voxels along the selected axis
+@callback(
+    [Output("slice-index", "max"), Output("slice-index", "value")],
+    [Input("slice-axis", "value"), Input("run", "value")],
+    State("slice-index", "value"),
+)
+def update_slice_slider(axis, run, index):
+    last_index = gridstore.get_shape(catalog.get_run(run).output_path)[axis] - 1
+    return last_index, min(index or 0, last_index)
+
+
+# Method to list the substances of the selected run (keeping the selected ones if possible)
+@callback(
+    [
+        Output("substance", "options"),
+        Output("substance", "value"),
+        Output("substance_2", "options"),
+        Output("substance_2", "value"),
+    ],
+    Input("run", "value"),
+    [State("substance", "value"), State("substance_2", "value")],
+)
+def update_substances(run, substance, substance_2):
+    substances = catalog.get_simulation(run).substances
+    if substance not in substances:
+        substance = substances[0]
+    if substance_2 not in substances:
+        substance_2 = substances[-1]
+    return substances, substance, substances, substance_2
 
 
 env_div = dbc.Container(
     [
         html.H2("Extracellular substances"),
+        slice_controls,
         dbc.Row([env_chart1, env_chart2]),
     ]
 )
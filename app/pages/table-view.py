@@ -1,14 +1,208 @@
 from pathlib import Path
+from typing import List, Optional, Sequence
 
 import dash
-from dash import dash_table
+from dash import dash_table, dcc, html, Input, Output, State, callback
 import dash_bootstrap_components as dbc
 import pandas as pd
+import pyarrow.dataset as ds
+
+import cache
+import catalog
 
 dash.register_page(__name__)
 
-DATA = pd.read_csv("output_data.csv")
-TIME_INTERVAL = int(DATA["time"].unique()[1])
+# The controls are created for the default run, and updated when another run is selected
+INDEX = catalog.get_index()
+PAGE_SIZE = 25
+
+# Operators of the DataTable filter queries and the matching Arrow expressions
+FILTER_OPERATORS = {
+    "ge": lambda field, value: field >= value,
+    "le": lambda field, value: field <= value,
+    "lt": lambda field, value: field < value,
+    "gt": lambda field, value: field > value,
+    "ne": lambda field, value: field != value,
+    "eq": lambda field, value: field == value,
+}
+OPERATOR_SYMBOLS = {">=": "ge", "<=": "le", "<": "lt", ">": "gt", "!=": "ne", "=": "eq"}
+
+
+def parse_filter_query(
+    filter_query: str, columns: Optional[Sequence[str]] = None
+) -> Optional[ds.Expression]:
+    """
+    Converts a DataTable filter query into a pyarrow.dataset expression (ignoring the
+    parts that can't be parsed, e.g., while they are being typed, and the parts on other
+    columns than the passed ones, e.g., of a previously selected run).
+
+    >>> parse_filter_query("{time} >= 60 && {ID} eq 3")
+    <pyarrow.compute.Expression ((time >= 60) and (ID == 3))>
+    >>> parse_filter_query("{time} >= 60 && {ID} > && {ID} eq x")
+    <pyarrow.compute.Expression (time >= 60)>
+    >>> parse_filter_query("{time} >= 60 && {oxygen} < 10", columns=["ID", "time"])
+    <pyarrow.compute.Expression (time >= 60)>
+    """
+    expression = None
+    for filter_part in filter_query.split(" && ") if filter_query else []:
+        try:
+            column, operator, value = filter_part.split(" ", 2)
+            value = float(value.strip("\"'"))
+        except ValueError:
+            continue
+        column = column.strip("{}")
+        if columns is not None and column not in columns:
+            continue
+        operator = OPERATOR_SYMBOLS.get(operator, operator)
+        if operator not in FILTER_OPERATORS:
+            continue
+        part = FILTER_OPERATORS[operator](ds.field(column), value)
+        expression = part if expression is None else expression & part
+    return expression
+
+
+def parse_cell_ids(cell_ids: Optional[str]) -> List[int]:
+    """
+    Returns the cell IDs of a comma-separated list (ignoring invalid IDs).
+
+    >>> parse_cell_ids("3, 10,x,12")
+    [3, 10, 12]
+    """
+    if not cell_ids:
+        return []
+    return [int(cell_id) for cell_id in cell_ids.split(",") if cell_id.strip().isdigit()]
+
+
+def to_records(page: pd.DataFrame) -> List[dict]:
+    """
+    Returns the rows of the page for the table.
+
+    Single-precision values are shown with their own number of digits (e.g., 0.1 instead
+    of 0.10000000149011612).
+    """
+    single = page.select_dtypes("float32").columns
+    page = page.astype({column: str for column in single}).astype({column: float for column in single})
+    return page.to_dict("records")
+
+
+#################################################################
+# FILTERS
+#################################################################
+
+time_range = dbc.Col(
+    [
+        html.Label("Time range (minutes):", htmlFor="table-time-range"),
+        dcc.RangeSlider(
+            min=INDEX.times[0],
+            max=INDEX.times[-1],
+            value=[INDEX.times[0], INDEX.times[-1]],
+            id="table-time-range",
+            marks=None,
+            tooltip={"placement": "bottom", "always_visible": True},
+        ),
+    ]
+)
+
+
+# Method to fit the time range to the time points of the selected run
+# The selected range follows the last time point when new frames are ingested.
+@callback(
+    [
+        Output("table-time-range", "min"),
+        Output("table-time-range", "max"),
+        Output("table-time-range", "value"),
+    ],
+    Input("time-data", "data"),
+    [
+        State("table-time-range", "min"),
+        State("table-time-range", "max"),
+        State("table-time-range", "value"),
+    ],
+)
+def update_time_range(time_data, range_min, range_max, time_range):
+    if time_data is None or (time_data["first"], time_data["last"]) == (range_min, range_max):
+        return dash.no_update, dash.no_update, dash.no_update
+    first, last = time_data["first"], time_data["last"]
+    start = min(max(time_range[0], first), last)
+    end = last if time_range[1] == range_max else min(max(time_range[1], first), last)
+    return first, last, [start, end]
+
+
+cell_ids = dbc.Col(
+    [
+        html.Label("Cell IDs (comma-separated):", htmlFor="table-cell-ids"),
+        dbc.Input(type="text", debounce=True, id="table-cell-ids"),
+    ]
+)
+
+#################################################################
+# TABLE
+# The table only holds the current page: paging, filtering and
+# sorting are done in the server, on the cached data.
+#################################################################
+
+table = dash_table.DataTable(
+    id="cell-table",
+    page_current=0,
+    page_size=PAGE_SIZE,
+    page_action="custom",
+    filter_action="custom",
+    filter_query="",
+    sort_action="custom",
+    sort_mode="multi",
+    sort_by=[],
+)
+
+
+# Method to show the cell variables of the selected run
+# The variables change with the run (e.g., its substances), or when its cache is rebuilt.
+@callback(
+    Output("cell-table", "columns"),
+    [Input("run", "value"), Input("time-data", "data")],
+)
+def update_columns(run, _):
+    columns = cache.get_columns(catalog.get_run(run).cache_path)
+    return [{"name": i, "id": i, "type": "numeric"} for i in columns]
+
+
+# Method to read the current page of the table from the cache
+# The filter and sort queries on variables of another run are ignored.
+@callback(
+    [Output("cell-table", "data"), Output("cell-table", "page_count")],
+    [
+        Input("cell-table", "page_current"),
+        Input("cell-table", "page_size"),
+        Input("cell-table", "filter_query"),
+        Input("cell-table", "sort_by"),
+        Input("table-time-range", "value"),
+        Input("table-cell-ids", "value"),
+        Input("run", "value"),
+    ],
+)
+def update_table(page_current, page_size, filter_query, sort_by, time_range, cell_ids, run):
+    cache_path = catalog.get_run(run).cache_path
+    columns = cache.get_columns(cache_path)
+    # The time range prunes the partitions of the cache before any file is read
+    row_filter = (ds.field("time") >= time_range[0]) & (ds.field("time") <= time_range[1])
+    if parse_cell_ids(cell_ids):
+        row_filter &= ds.field("ID").isin(parse_cell_ids(cell_ids))
+    query_filter = parse_filter_query(filter_query, columns)
+    if query_filter is not None:
+        row_filter &= query_filter
+
+    page, total = cache.query_cells(
+        row_filter=row_filter,
+        sort_by=[
+            (sort["column_id"], "ascending" if sort["direction"] == "asc" else "descending")
+            for sort in sort_by
+            if sort["column_id"] in columns
+        ],
+        offset=page_current * page_size,
+        limit=page_size,
+        cache_path=cache_path,
+    )
+    return to_records(page), max(1, -(-total // page_size))
+
 
 #################################################################
 # APPLICATION LAYOUT
@@ -18,7 +212,9 @@ TIME_INTERVAL = int(DATA["time"].unique()[1])
 
 layout = dbc.Container(
     [
-        dash_table.DataTable(DATA.to_dict('records'), [{"name": i, "id": i} for i in DATA.columns])
+        dbc.Row([time_range, cell_ids]),
+        html.Br(),
+        table,
     ],
     fluid=True,
     className="dbc",
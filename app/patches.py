@@ -0,0 +1,59 @@
+"""
+Partial updates (dash.Patch) of the figures that are already displayed.
+
+When only the frame changes, the callbacks send the data arrays of the traces instead
+of the whole figure (layout, template, color scales and axes stay in the browser). The
+figures are built as usual (and memoized), and the patches are taken from them.
+"""
+from typing import Optional
+
+import plotly.colors
+from dash import Patch, ctx
+
+# Trace properties that change from one frame to the next
+TRACE_KEYS = ["x", "y", "z", "customdata"]
+MARKER_KEYS = ["size", "color", "sizeref"]
+
+
+def is_update(*input_ids: str) -> bool:
+    """
+    Checks if the callback was only triggered by the passed inputs.
+
+    Returns False for the initial call of the callback (e.g., when the page is opened),
+    since the figure isn't displayed yet.
+    """
+    triggered = [trigger["prop_id"].split(".")[0] for trigger in ctx.triggered]
+    return ctx.triggered_id is not None and all(item in input_ids for item in triggered)
+
+
+def get_trace_patch(figure: dict) -> Patch:
+    """
+    Returns a patch that replaces the data of the traces of a displayed figure.
+
+    The displayed figure must have the same traces (e.g., the figure of another frame).
+    """
+    patch = Patch()
+    for index, trace in enumerate(figure["data"]):
+        for key in TRACE_KEYS:
+            if key in trace:
+                patch["data"][index][key] = trace[key]
+        for key in MARKER_KEYS:
+            if key in trace.get("marker", {}):
+                patch["data"][index]["marker"][key] = trace["marker"][key]
+    return patch
+
+
+def get_heatmap_patch(z, colorbar: Optional[dict] = None) -> Patch:
+    """Returns a patch that replaces the values (and color bar ticks) of a displayed heatmap."""
+    patch = Patch()
+    patch["data"][0]["z"] = z
+    for key, value in (colorbar or {}).items():
+        patch["layout"]["coloraxis"]["colorbar"][key] = value
+    return patch
+
+
+def get_colorscale_patch(palette: str, patch: Optional[Patch] = None) -> Patch:
+    """Returns a patch that only changes the color scale of a figure (in its coloraxis)."""
+    patch = Patch() if patch is None else patch
+    patch["layout"]["coloraxis"]["colorscale"] = plotly.colors.get_colorscale(palette)
+    return patch
@@ -0,0 +1,134 @@
+"""
+Background prefetching of the frames that are likely to be shown next.
+
+While the time slider is moved, each figure of a page predicts the next frames from
+the direction of the slider and builds their figures in background threads. Building a
+figure loads its cell columns and microenvironment grids into the shared caches (see
+timeindex and microenv), so both the data and the figure are ready when the slider
+reaches the frame. Pending work for frames that are no longer expected (e.g., after a
+jump) is cancelled.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, List, Sequence, Tuple
+
+import numpy as np
+
+# Number of frames prepared ahead of the current one
+WINDOW = 3
+# Threads running the background tasks (figures are built while holding the GIL, so a
+# few threads are enough to hide the file reads)
+MAX_WORKERS = 2
+# Number of results kept for the frames that were prefetched
+MAX_RESULTS = 64
+
+Task = Tuple[Hashable, Callable[[], Any]]
+
+
+class Prefetcher:
+    """
+    Runs the tasks of the frames next to the current one in a thread pool.
+
+    Each group of tasks (e.g., one figure of a page) has its own slider direction. The
+    results are kept by key, so the callbacks get them with get instead of building them
+    again.
+    """
+
+    def __init__(
+        self, window: int = WINDOW, max_workers: int = MAX_WORKERS, max_results: int = MAX_RESULTS
+    ):
+        self.window = window
+        self.max_results = max_results
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="prefetch")
+        self._futures: "OrderedDict[Hashable, Future]" = OrderedDict()
+        # Last frame position and direction of each group
+        self._positions: Dict[Hashable, Tuple[int, int]] = {}
+        self._pending: Dict[Hashable, List[Hashable]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """
+        Returns the result of the task, prefetched if possible.
+
+        A task that is already running is waited for. Otherwise (not prefetched,
+        cancelled or failed), the result is built in the current thread.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            # A task that hasn't started yet is built here instead
+            if future is not None and future.cancel():
+                del self._futures[key]
+                future = None
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                pass
+        return build()
+
+    def update(
+        self,
+        group: Hashable,
+        time: float,
+        times: Sequence[float],
+        get_tasks: Callable[[float], List[Task]],
+    ) -> None:
+        """
+        Schedules the tasks of the next frames of the group.
+
+        The next frames follow the direction in which the slider last moved (forward by
+        default). Pending tasks of the group for other frames are cancelled. After a jump
+        (further than the prefetched frames), nothing is scheduled until the slider moves
+        again from the new frame.
+        """
+        position = int(np.abs(np.asarray(times) - time).argmin())
+        with self._lock:
+            last_position, direction = self._positions.get(group, (position, 1))
+            if position != last_position:
+                direction = 1 if position > last_position else -1
+            self._positions[group] = (position, direction)
+
+        steps = range(1, self.window + 1) if abs(position - last_position) <= self.window else []
+        next_positions = [position + direction * step for step in steps]
+        tasks = [
+            task
+            for next_position in next_positions
+            if 0 <= next_position < len(times)
+            for task in get_tasks(times[next_position])
+        ]
+
+        with self._lock:
+            keys = [key for key, _ in tasks]
+            for key in self._pending.get(group, []):
+                future = self._futures.get(key)
+                if key not in keys and future is not None and future.cancel():
+                    del self._futures[key]
+            for key, build in tasks:
+                if key not in self._futures:
+                    self._futures[key] = self._executor.submit(build)
+                self._futures.move_to_end(key)
+            self._pending[group] = keys
+            self._evict()
+
+    def _evict(self) -> None:
+        """Forgets the oldest results that are over the limit (pending tasks are kept)."""
+        excess = len(self._futures) - self.max_results
+        done = [key for key, future in self._futures.items() if future.done()]
+        for key in done[:max(0, excess)]:
+            del self._futures[key]
+
+    def clear(self) -> None:
+        """Cancels the pending tasks and forgets every result."""
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+            self._pending.clear()
+
+
+@lru_cache()
+def get_prefetcher() -> Prefetcher:
+    """Returns the prefetcher shared by the pages."""
+    return Prefetcher()
@@ -0,0 +1,245 @@
+"""
+Timings of the callbacks of the app, by stage, for the diagnostics page.
+
+Each request to a callback is timed by the server (see instrument), along with the size
+of its response. The functions that read the data, filter the cells, build the figures
+and serialize them are decorated with timed, so that the time of each request is split
+into these stages ("other" is the rest, e.g., the callback logic and the JSON response
+of Dash). The functions that read files also count the bytes they read. The last
+WINDOW values of each metric are kept, to compute their percentiles.
+
+Optionally, each request is profiled with cProfile, and the profiles are saved in the
+cache folder (they can be opened with pstats or snakeviz).
+"""
+import cProfile
+import io
+import pstats
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import flask
+import numpy as np
+
+# Number of values of each metric kept to compute the percentiles
+WINDOW = 1000
+# Stages of the callbacks (see timed)
+STAGES = ["load", "filter", "figure", "serialize"]
+# Metrics of each callback: times in milliseconds, sizes in bytes
+TIMES = ["total", *STAGES, "other"]
+SIZES = ["bytes_read", "payload"]
+PERCENTILES = {"p50": 50, "p95": 95, "p99": 99}
+# Name of the metrics of the stages that don't run in a request (e.g., prefetching)
+BACKGROUND = "background"
+# URL of the metrics (as JSON)
+ENDPOINT = "/_diagnostics"
+# Folder of the saved profiles (in the cache folder) and number of profiles kept
+PROFILES_FOLDER = "profiles"
+MAX_PROFILES = 50
+# Path of the Dash endpoint of the callbacks
+CALLBACK_PATH = "_dash-update-component"
+# The callbacks of the diagnostics page refresh it periodically, so they aren't profiled
+UNPROFILED = "diagnostics-"
+
+
+class Histogram:
+    """The last values of a metric, with their count since the app started."""
+
+    def __init__(self, window: int = WINDOW):
+        self.values = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.values.append(value)
+        self.count += 1
+
+    def get_summary(self) -> Dict[str, float]:
+        """Returns the count, the mean, the maximum and the percentiles of the last values."""
+        values = np.array(self.values)
+        summary = {"count": self.count, "mean": values.mean(), "max": values.max()}
+        summary.update(zip(PERCENTILES, np.percentile(values, list(PERCENTILES.values()))))
+        return {name: float(value) for name, value in summary.items()}
+
+    def get_bins(self, bins: int = 20) -> Dict[str, list]:
+        """Returns the number of the last values in each bin (and the bin edges)."""
+        counts, edges = np.histogram(np.array(self.values), bins=bins)
+        return {"counts": counts.tolist(), "edges": edges.tolist()}
+
+
+class Request:
+    """The stages, bytes read and profile of a request (while it is being served)."""
+
+    def __init__(self, callback: str):
+        self.callback = callback
+        self.start = time.perf_counter()
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.bytes_read = 0
+        self.profile: Optional[cProfile.Profile] = None
+
+
+# Metrics of each callback (by output), by name
+METRICS: Dict[str, Dict[str, Histogram]] = {}
+_METRICS_LOCK = threading.Lock()
+# The request served by the current thread, and the stage it is in
+_REQUEST: ContextVar[Optional[Request]] = ContextVar("request", default=None)
+_STAGE: ContextVar[Optional[str]] = ContextVar("stage", default=None)
+
+# Settings of the profiles (see configure)
+_profile_path: Optional[Path] = None
+_profile_requests = False
+
+
+def configure(
+    profile_path: Optional[Union[str, Path]] = None, profile_requests: bool = False
+) -> None:
+    """Sets the folder of the saved profiles, and whether the requests are profiled."""
+    global _profile_path, _profile_requests
+    _profile_path = None if profile_path is None else Path(profile_path)
+    _profile_requests = profile_requests and profile_path is not None
+
+
+def set_profiling(enabled: bool) -> None:
+    """Starts or stops profiling the requests (if a profile folder is configured)."""
+    global _profile_requests
+    _profile_requests = enabled and _profile_path is not None
+
+
+def is_profiling() -> bool:
+    return _profile_requests
+
+
+def record(callback: str, metric: str, value: float) -> None:
+    """Adds a value to a metric of the callback."""
+    with _METRICS_LOCK:
+        metrics = METRICS.setdefault(callback, {})
+        metrics.setdefault(metric, Histogram()).add(value)
+
+
+def timed(stage: str) -> Callable:
+    """
+    Decorates a function so that its time is counted in a stage of the callbacks.
+
+    When the function is called by another timed function, its time is only counted in
+    the stage of the outer function.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _STAGE.get() is not None:
+                return function(*args, **kwargs)
+            token = _STAGE.set(stage)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = 1000 * (time.perf_counter() - start)
+                _STAGE.reset(token)
+                request = _REQUEST.get()
+                if request is None:
+                    record(BACKGROUND, stage, elapsed)
+                else:
+                    request.stages[stage] += elapsed
+
+        return wrapper
+
+    return decorator
+
+
+def add_bytes_read(size: int) -> None:
+    """Counts the bytes read from disk by the current request."""
+    request = _REQUEST.get()
+    if request is None:
+        record(BACKGROUND, "bytes_read", size)
+    else:
+        request.bytes_read += size
+
+
+def start_request() -> None:
+    """Starts timing a callback request (registered with Flask's before_request)."""
+    if not flask.request.path.endswith(CALLBACK_PATH):
+        return
+    body = flask.request.get_json(silent=True) or {}
+    request = Request(body.get("output", "unknown"))
+    if _profile_requests and UNPROFILED not in request.callback:
+        request.profile = cProfile.Profile()
+        request.profile.enable()
+    flask.g.profiling_token = _REQUEST.set(request)
+
+
+def end_request(response: flask.Response) -> flask.Response:
+    """Records the metrics of a callback request (registered with Flask's after_request)."""
+    token = flask.g.pop("profiling_token", None)
+    if token is None:
+        return response
+    request = _REQUEST.get()
+    _REQUEST.reset(token)
+    if request.profile is not None:
+        request.profile.disable()
+        save_profile(request.profile, request.callback)
+
+    total = 1000 * (time.perf_counter() - request.start)
+    record(request.callback, "total", total)
+    for stage, elapsed in request.stages.items():
+        record(request.callback, stage, elapsed)
+    record(request.callback, "other", max(0.0, total - sum(request.stages.values())))
+    record(request.callback, "bytes_read", request.bytes_read)
+    record(request.callback, "payload", response.calculate_content_length() or 0)
+    return response
+
+
+def instrument(server: flask.Flask) -> None:
+    """Times the callback requests of the server, and serves the metrics at ENDPOINT."""
+    server.before_request(start_request)
+    server.after_request(end_request)
+    server.add_url_rule(ENDPOINT, "diagnostics", lambda: flask.jsonify(get_report()))
+
+
+def get_report(bins: int = 20) -> Dict[str, Dict[str, dict]]:
+    """
+    Returns the metrics of each callback: the summary of the last values of each metric
+    (see Histogram.get_summary), and their histogram.
+    """
+    with _METRICS_LOCK:
+        return {
+            callback: {
+                metric: {**histogram.get_summary(), "histogram": histogram.get_bins(bins)}
+                for metric, histogram in metrics.items()
+            }
+            for callback, metrics in METRICS.items()
+        }
+
+
+def reset() -> None:
+    """Forgets the metrics of every callback."""
+    with _METRICS_LOCK:
+        METRICS.clear()
+
+
+def save_profile(profile: cProfile.Profile, callback: str) -> None:
+    """Saves the profile of a request, removing the oldest profiles (see MAX_PROFILES)."""
+    _profile_path.mkdir(parents=True, exist_ok=True)
+    name = re.sub(r"[^\w-]+", "_", callback).strip("_")
+    profile.dump_stats(_profile_path / f"{time.time_ns()}-{name}.prof")
+    for old_profile in get_profiles()[MAX_PROFILES:]:
+        old_profile.unlink(missing_ok=True)
+
+
+def get_profiles() -> List[Path]:
+    """Returns the saved profiles, from the newest to the oldest."""
+    if _profile_path is None or not _profile_path.is_dir():
+        return []
+    return sorted(_profile_path.glob("*.prof"), reverse=True)
+
+
+def get_profile_summary(profile_file: Union[str, Path], lines: int = 30) -> str:
+    """Returns the functions of a saved profile that took the most time (cumulative)."""
+    stream = io.StringIO()
+    stats = pstats.Stats(str(profile_file), stream=stream)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(lines)
+    return stream.getvalue()
@@ -0,0 +1,138 @@
+"""
+Samples the substance concentrations of the microenvironment at the cell positions.
+
+While the cell data is ingested into the cache (see cache.build_cache), the local
+concentration of every substance is interpolated at the position of each cell, and saved
+as a cell variable named "local_<substance>". The sampled concentrations can then be used
+like the other cell variables (e.g., to color the scatter plots or in the time series),
+without joining the cell and microenvironment files. The microenvironment files are read
+and sampled in a process pool, one frame per task.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy.interpolate import RegularGridInterpolator
+
+import data
+import microenv
+
+# Interpolation methods of the sampled concentrations
+METHODS = ("nearest", "trilinear")
+# Prefix of the cell variables holding the sampled concentrations
+COLUMN_PREFIX = "local_"
+
+
+def get_column_name(substance: str) -> str:
+    """
+    Returns the name of the cell variable holding the sampled concentration of the substance.
+
+    >>> get_column_name("oxygen")
+    'local_oxygen'
+    """
+    return f"{COLUMN_PREFIX}{substance}"
+
+
+def get_columns(substances: Sequence[str]) -> List[str]:
+    """Returns the names of the cell variables holding the sampled concentrations."""
+    return [get_column_name(substance) for substance in substances]
+
+
+def interpolate(
+    grid: np.ndarray,
+    mesh: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    positions: np.ndarray,
+    method: str = "trilinear",
+) -> np.ndarray:
+    """
+    Returns the concentrations of a (z, y, x) grid at the passed (x, y, z) positions.
+
+    The mesh holds the x, y and z coordinates of the voxel centers (see microenv.get_mesh).
+    Positions outside of the mesh take the value of the closest voxel, and the axes with a
+    single voxel (e.g., z in 2D simulations) are ignored.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown interpolation method: {method} (expected one of {METHODS})")
+    # Same (z, y, x) order as the grid
+    coordinates = mesh[::-1]
+    positions = positions[:, ::-1]
+    axes = [axis for axis in range(3) if grid.shape[axis] > 1]
+    if not axes:
+        return np.full(len(positions), grid.item())
+
+    interpolator = RegularGridInterpolator(
+        [coordinates[axis] for axis in axes],
+        grid.reshape([grid.shape[axis] for axis in axes]),
+        method="nearest" if method == "nearest" else "linear",
+    )
+    points = np.column_stack(
+        [np.clip(positions[:, axis], coordinates[axis][0], coordinates[axis][-1]) for axis in axes]
+    )
+    return interpolator(points)
+
+
+def sample_frame(
+    frame: int, output_path: str, positions: np.ndarray, method: str = "trilinear"
+) -> np.ndarray:
+    """
+    Returns the concentration of each substance at the passed positions of the given frame.
+
+    The returned array has one row per substance and one column per position.
+    """
+    mesh = microenv.get_mesh(Path(output_path))
+    grids = microenv.read_grids(frame, Path(output_path))
+    return np.stack([interpolate(grid, mesh, positions, method) for grid in grids])
+
+
+def add_concentrations(
+    cells: pd.DataFrame,
+    output_path: Union[str, Path],
+    time: pd.Series,
+    method: str = "trilinear",
+    precision: str = "single",
+    max_workers: Optional[int] = None,
+) -> None:
+    """
+    Adds the sampled concentration of each substance (see get_columns) to the cell data.
+
+    The time points of the cell data are mapped to the microenvironment files by the
+    passed time series (indexed by output file number). The rows that pad the frames
+    are set to zero, as their other cell variables. The type of the columns is set by
+    the precision policy (see data.get_column_dtypes).
+    """
+    columns = get_columns(microenv.get_substances(Path(output_path)))
+    dtypes = data.get_column_dtypes(columns, precision)
+    concentrations = {column: np.zeros(len(cells), dtypes[column]) for column in columns}
+
+    frames = pd.Series(time.index, index=time.to_numpy())
+    live = cells["total_volume"].to_numpy() > 0
+    frame_rows = cells.groupby("time", sort=False).indices
+    rows = [time_rows[live[time_rows]] for time_rows in frame_rows.values()]
+    positions = cells[["position_x", "position_y", "position_z"]].to_numpy(dtype=float)
+
+    # Bigger chunks keep the inter-process overhead low when there are many small files
+    chunksize = max(1, len(rows) // (4 * (max_workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        samples = executor.map(
+            sample_frame,
+            [int(frames[time_value]) for time_value in frame_rows],
+            repeat(str(output_path)),
+            [positions[live_rows] for live_rows in rows],
+            repeat(method),
+            chunksize=chunksize,
+        )
+        for live_rows, frame_samples in zip(rows, samples):
+            for column, values in zip(columns, frame_samples):
+                concentrations[column][live_rows] = values
+
+    for column, values in concentrations.items():
+        cells[column] = values
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
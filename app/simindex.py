@@ -0,0 +1,232 @@
+"""
+Metadata index of a PhysiCell output folder.
+
+The SimulationIndex holds everything the app needs to know about the output folder
+before reading the cell data: the time of each frame (from its XML file), the number of
+cells in each frame, the maximum cell ID, the cell variables and the substances. It is
+built in a single scan of the output folder and saved as JSON, so that only new or
+changed frames are scanned on the next runs.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+
+import data
+
+INDEX_FILE = "index.json"
+
+FileStats = Tuple[int, float]
+
+
+def get_file_stats(file: Path) -> FileStats:
+    """Returns the size and modification time of the passed file."""
+    stats = file.stat()
+    return stats.st_size, stats.st_mtime
+
+
+def get_frame_stats(output_path: Union[str, Path]) -> Dict[int, Dict[str, FileStats]]:
+    """
+    Returns the size and modification time of the cell and XML files of each output frame.
+
+    Frames are only listed once both of their files have been written.
+    """
+    output_path = Path(output_path)
+    frame_stats = {}
+    for cell_file in output_path.glob("output*_cells_physicell.mat"):
+        frame = int(cell_file.name[len("output"):len("output") + 8])
+        xml_file = output_path / f"output{str(frame).zfill(8)}.xml"
+        if xml_file.is_file():
+            frame_stats[frame] = {
+                cell_file.name: get_file_stats(cell_file),
+                xml_file.name: get_file_stats(xml_file),
+            }
+    return dict(sorted(frame_stats.items()))
+
+
+def get_substances(output_path: Union[str, Path]) -> List[str]:
+    """Returns the substances stored in the output files."""
+    tree = ElementTree.parse(Path(output_path) / "output00000000.xml")
+    variables = tree.find("microenvironment/domain/variables").findall("variable")
+    return [variable.get("name") for variable in variables]
+
+
+def scan_frame(output_path: str, frame: int, id_row: int) -> Dict[str, float]:
+    """Returns the time, number of cells and maximum cell ID of an output frame."""
+    ids = data.read_cell_rows(f"{output_path}/{data.get_file_name(frame)}", [id_row])[0]
+    return {
+        "time": data.get_frame_time(frame, output_path),
+        "cell_count": len(ids),
+        "max_cell_id": int(ids.max(initial=-1)),
+    }
+
+
+class SimulationIndex:
+    """
+    The metadata of an output folder, with one entry per frame (output file number).
+
+    Attributes
+    ----------
+    output_path
+        The (resolved) path to the output folder.
+    initial
+        The size and modification time of the initial.xml file.
+    variables
+        The cell variables and their row in the cell files (see data.get_variables_idx).
+    substances
+        The names of the substances in the microenvironment.
+    frames
+        For each frame, the stats of its files ("files"), its time, its number of cells
+        and its maximum cell ID.
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        initial: FileStats,
+        variables: Dict[str, int],
+        substances: List[str],
+        frames: Dict[int, dict],
+    ):
+        self.output_path = output_path
+        self.initial = tuple(initial)
+        self.variables = variables
+        self.substances = substances
+        self.frames = dict(sorted(frames.items()))
+
+    @property
+    def frame_numbers(self) -> List[int]:
+        return list(self.frames)
+
+    @property
+    def times(self) -> List[float]:
+        return [frame["time"] for frame in self.frames.values()]
+
+    @property
+    def cell_counts(self) -> List[int]:
+        return [frame["cell_count"] for frame in self.frames.values()]
+
+    @property
+    def max_cell_id(self) -> int:
+        return max((frame["max_cell_id"] for frame in self.frames.values()), default=-1)
+
+    def get_time_series(self) -> pd.Series:
+        """Returns the time of each frame, indexed by frame number (as data.get_time)."""
+        return pd.Series(self.times, index=self.frame_numbers, dtype=float)
+
+    def get_frame_number(self, time: float) -> int:
+        """Returns the number of the frame closest to the passed time."""
+        times = np.asarray(self.times)
+        return self.frame_numbers[int(np.abs(times - time).argmin())]
+
+    def to_dict(self) -> dict:
+        return {
+            "output_path": self.output_path,
+            "initial": self.initial,
+            "variables": self.variables,
+            "substances": self.substances,
+            "frames": self.frames,
+        }
+
+    @classmethod
+    def from_dict(cls, index: dict) -> "SimulationIndex":
+        # JSON stores the frame numbers as strings and the file stats as lists
+        frames = {
+            int(frame): {
+                **entry,
+                "files": {name: tuple(stats) for name, stats in entry["files"].items()},
+            }
+            for frame, entry in index["frames"].items()
+        }
+        return cls(
+            index["output_path"],
+            index["initial"],
+            index["variables"],
+            index["substances"],
+            frames,
+        )
+
+    def save(self, index_file: Union[str, Path]) -> None:
+        with open(index_file, "w") as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, index_file: Union[str, Path]) -> Optional["SimulationIndex"]:
+        """Returns the saved index, or None if it doesn't exist."""
+        if not Path(index_file).is_file():
+            return None
+        with open(index_file, "r") as file:
+            return cls.from_dict(json.load(file))
+
+
+def build_index(
+    output_path: Union[str, Path],
+    index_file: Union[str, Path],
+    max_workers: Optional[int] = None,
+) -> SimulationIndex:
+    """
+    Scans the output folder and saves its index, updating the saved index if possible.
+
+    Only the frames that are new or whose files changed since the saved index was built
+    are scanned (in a process pool). The whole folder is scanned again when the output
+    folder or its initial.xml file change.
+    """
+    output_path = Path(output_path)
+    resolved_path = str(output_path.resolve())
+    initial = get_file_stats(output_path / "initial.xml")
+    frame_stats = get_frame_stats(output_path)
+
+    index = SimulationIndex.load(index_file)
+    if index is None or index.output_path != resolved_path or index.initial != initial:
+        variables = data.get_variables_idx(output_path=str(output_path))
+        index = SimulationIndex(
+            resolved_path, initial, variables, get_substances(output_path), {}
+        )
+
+    frames = {
+        frame: entry
+        for frame, entry in index.frames.items()
+        if frame_stats.get(frame) == entry["files"]
+    }
+    new_frames = [frame for frame in frame_stats if frame not in frames]
+    if new_frames:
+        chunksize = max(1, len(new_frames) // (4 * (max_workers or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            scans = executor.map(
+                scan_frame,
+                repeat(str(output_path)),
+                new_frames,
+                repeat(index.variables["ID"]),
+                chunksize=chunksize,
+            )
+            for frame, scan in zip(new_frames, scans):
+                frames[frame] = {"files": frame_stats[frame], **scan}
+
+    index = SimulationIndex(
+        index.output_path, index.initial, index.variables, index.substances, frames
+    )
+    Path(index_file).parent.mkdir(parents=True, exist_ok=True)
+    index.save(index_file)
+    return index
+
+
+_LOADED: Dict[Path, Tuple[int, SimulationIndex]] = {}
+
+
+def get_index(index_file: Union[str, Path]) -> SimulationIndex:
+    """
+    Returns the saved index, shared by all the modules of the app.
+
+    The file is only read again when it has been updated (e.g., in live-tail mode).
+    """
+    index_file = Path(index_file)
+    version = index_file.stat().st_mtime_ns
+    if index_file not in _LOADED or _LOADED[index_file][0] != version:
+        _LOADED[index_file] = (version, SimulationIndex.load(index_file))
+    return _LOADED[index_file][1]
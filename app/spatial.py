@@ -0,0 +1,109 @@
+"""
+Spatial index of the cell positions, for region queries and neighbourhood statistics.
+
+The KD-trees of the cell positions of a time point are built the first time the time
+point is queried and kept for the next queries (e.g., several selections on the same
+frame), so that the cells inside a box or lasso selection and the neighbours of each
+cell are found without comparing every pair of cells.
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from matplotlib.path import Path as Polygon
+from scipy.spatial import cKDTree
+
+import profiling
+import timeindex
+
+# Distance (in microns) within which two cells are counted as neighbours
+NEIGHBOUR_RADIUS = 20.0
+# Number of time points whose spatial index is kept in memory
+MAX_INDEXES = 32
+COORDINATES = ["position_x", "position_y", "position_z"]
+
+
+class FrameIndex:
+    """
+    The KD-trees of the cell positions at one time point (in the xy plane and in 3D).
+
+    The cells are referred to by their row in the cached frame (see TimeIndex.get_frame),
+    and the rows that pad the frame aren't indexed.
+    """
+
+    def __init__(self, cells: pd.DataFrame):
+        self.rows = np.flatnonzero(cells["total_volume"].to_numpy() > 0)
+        positions = cells[COORDINATES].to_numpy(dtype=float)[self.rows]
+        self.tree_2d = cKDTree(positions[:, :2])
+        self.tree_3d = cKDTree(positions)
+
+    def query_box(self, x_range: Sequence[float], y_range: Sequence[float]) -> np.ndarray:
+        """Returns the rows of the cells inside the box (in the xy plane)."""
+        (x_min, x_max), (y_min, y_max) = sorted(x_range), sorted(y_range)
+        # The box is inside the square (Chebyshev distance) around its center
+        center = [(x_min + x_max) / 2, (y_min + y_max) / 2]
+        radius = max(x_max - x_min, y_max - y_min) / 2
+        candidates = np.asarray(self.tree_2d.query_ball_point(center, radius, p=np.inf), int)
+        x, y = self.tree_2d.data[candidates].T
+        inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        return self.rows[candidates[inside]]
+
+    def query_polygon(self, x: Sequence[float], y: Sequence[float]) -> np.ndarray:
+        """Returns the rows of the cells inside the polygon (in the xy plane)."""
+        vertices = np.column_stack([x, y])
+        candidates = self.query_box((min(x), max(x)), (min(y), max(y)))
+        positions = self.tree_2d.data[np.searchsorted(self.rows, candidates)]
+        return candidates[Polygon(vertices).contains_points(positions)]
+
+    def count_neighbours(
+        self, radius: float = NEIGHBOUR_RADIUS, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Returns the number of other cells within the radius of each cell (or of the rows)."""
+        points = self.tree_3d.data
+        if rows is not None:
+            points = points[np.searchsorted(self.rows, rows)]
+        return self.tree_3d.query_ball_point(points, radius, return_length=True) - 1
+
+
+@lru_cache(maxsize=MAX_INDEXES)
+def get_frame_index(cache_path: Path, version: Optional[int], time: float) -> FrameIndex:
+    """
+    Returns the spatial index of the cells at the given time point of the cache.
+
+    The indexes are kept until the version of the cache (see TimeIndex.version) changes.
+    """
+    cells = timeindex.get_index(cache_path).get_frame(time, COORDINATES + ["total_volume"])
+    return FrameIndex(cells)
+
+
+@profiling.timed("filter")
+def select(frame_index: FrameIndex, selection: dict) -> Optional[np.ndarray]:
+    """
+    Returns the rows of the cells in a box or lasso selection of a 2D scatter plot.
+
+    The selection is the selectedData of the graph. Returns None if it is empty.
+    """
+    if selection is None:
+        return None
+    if "range" in selection:
+        return frame_index.query_box(selection["range"]["x"], selection["range"]["y"])
+    if "lassoPoints" in selection:
+        return frame_index.query_polygon(
+            selection["lassoPoints"]["x"], selection["lassoPoints"]["y"]
+        )
+    return None
+
+
+def get_region_stats(
+    cells: pd.DataFrame, variables: Sequence[str], neighbours: np.ndarray
+) -> Tuple[pd.Series, pd.Series]:
+    """
+    Returns the number of cells in each phase, and the mean of the variables (and of the
+    number of neighbours) of the cells in a region.
+    """
+    counts = cells["current_phase"].astype(int).value_counts().sort_index()
+    means = cells[list(variables)].mean()
+    means["neighbours"] = neighbours.mean() if len(neighbours) else np.nan
+    return counts, means
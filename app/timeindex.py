@@ -0,0 +1,140 @@
+"""
+Time-indexed access to the cached cell data.
+
+The pages use a TimeIndex to read the cells of one time point without filtering the
+whole table: each time point is mapped to its partition of the cache, and the global
+range of every cell variable is taken from the precomputed statistics.
+"""
+import bisect
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import cache
+import profiling
+from arraycache import ArrayCache
+
+# Memory budget (in bytes) for the cell variables kept in memory, shared by every run
+MEMORY_BUDGET = 512 * 1024**2
+
+COLUMNS = ArrayCache(MEMORY_BUDGET)
+
+
+class TimeIndex:
+    """
+    Maps each cached time point to its cell data and keeps the global per-variable ranges.
+
+    The columns that are read are kept in a memory-bounded LRU cache, so only the
+    columns that haven't been read yet are loaded from disk. The cache is shared by the
+    indexes of every run (see catalog), so the columns of the runs that aren't being
+    looked at are evicted first. The index is refreshed
+    automatically when the cache manifest changes (e.g., when new frames are ingested in
+    live-tail mode).
+    """
+
+    def __init__(self, cache_path: Union[str, Path] = cache.CACHE_PATH):
+        self.cache_path = Path(cache_path)
+        self.times: List[float] = []
+        self.minimum = pd.Series(dtype=float)
+        self.maximum = pd.Series(dtype=float)
+        self.columns = COLUMNS
+        self._partitions: Dict[float, Path] = {}
+        self._version: Optional[int] = None
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Reloads the time points and statistics if the cache was updated."""
+        manifest_file = self.cache_path / cache.MANIFEST_FILE
+        version = manifest_file.stat().st_mtime_ns if manifest_file.is_file() else None
+        if version == self._version:
+            return
+
+        self._partitions = cache.get_partitions(self.cache_path)
+        self.times = sorted(self._partitions)
+        # Frames may have been re-ingested
+        self.columns.discard(lambda key: key[0] == self.cache_path)
+        stats = cache.load_stats(self.cache_path)
+        if stats is not None:
+            self.minimum = stats[stats["statistic"] == "min"].min(numeric_only=True)
+            self.maximum = stats[stats["statistic"] == "max"].max(numeric_only=True)
+        self._version = version
+
+    @property
+    def version(self) -> Optional[int]:
+        """The version of the cache (changes when frames are ingested)."""
+        self.refresh()
+        return self._version
+
+    def get_nearest(self, time: float) -> float:
+        """Returns the cached time point closest to the given time."""
+        self.refresh()
+        position = bisect.bisect_left(self.times, time)
+        candidates = self.times[max(0, position - 1):position + 1]
+        return min(candidates, key=lambda candidate: abs(candidate - time))
+
+    @profiling.timed("load")
+    def get_frame(self, time: float, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Returns the cells at the given time point (only the passed columns, if any).
+
+        The cells of the closest cached time point are returned (e.g., when the time
+        comes from a slider fitted to another run).
+        """
+        time = self.get_nearest(time)
+        if columns is None:
+            columns = cache.get_columns(self.cache_path)
+        columns = list(dict.fromkeys(columns))
+
+        cells = {column: self.columns.get((self.cache_path, time, column)) for column in columns}
+        # The time is stored in the partition name, not in the files
+        missing = [c for c, values in cells.items() if values is None and c != "time"]
+        if missing:
+            table = pq.read_table(self._partitions[time], columns=missing, memory_map=True)
+            for column in missing:
+                cells[column] = table.column(column).to_numpy()
+                self.columns.put((self.cache_path, time, column), cells[column])
+            profiling.add_bytes_read(table.nbytes)
+
+        cells = pd.DataFrame(cells, columns=columns)
+        if "time" in columns:
+            cells["time"] = time
+        return cells
+
+    def get_range(self, column: str) -> Tuple[float, float]:
+        """Returns the minimum and maximum of the cell variable over all the time points."""
+        self.refresh()
+        if column == "time":
+            return self.times[0], self.times[-1]
+        return float(self.minimum[column]), float(self.maximum[column])
+
+
+def get_step(times: Sequence[float]) -> float:
+    """
+    Returns the smallest interval between the time points (the step of the time sliders).
+
+    >>> get_step([0.0, 60.0, 120.0, 150.0])
+    30.0
+    >>> get_step([0.0])
+    1.0
+    """
+    return float(np.diff(times).min()) if len(times) > 1 else 1.0
+
+
+def remove_padding(cells: pd.DataFrame) -> pd.DataFrame:
+    """
+    Removes the rows of the cells that don't exist at their time point.
+
+    The cached frames are padded with zeros up to the maximum number of cells, so these
+    rows are recognized by their null volume.
+    """
+    return cells[cells["total_volume"] > 0]
+
+
+@lru_cache()
+def get_index(cache_path: Union[str, Path] = cache.CACHE_PATH) -> TimeIndex:
+    """Returns the TimeIndex of the cache, shared by all the pages."""
+    return TimeIndex(cache_path)
@@ -0,0 +1,125 @@
+"""
+Per-time point aggregates of the cell data, for the time series page.
+
+The aggregates are computed while the cell data is ingested into the cache, and saved
+in a small table with one row per time point (see cache.write_series), so that the
+population dynamics can be plotted without reading the cell data. Other aggregations
+(grouped by a cell variable) are computed on demand from the cached columns (see
+cache.aggregate_cells).
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# PhysiCell phase codes of dead cells (apoptotic, necrotic, debris) start at 100
+DEAD_PHASE = 100
+# Quantiles saved for each custom variable
+QUANTILES = {"q25": 0.25, "median": 0.5, "q75": 0.75}
+# Statistics available for the grouped aggregations
+STATISTICS = ["count", "mean", "median", "std", "min", "max", "sum"]
+# Cell variables that can be used to group the cells
+GROUP_VARIABLES = ["cell_type", "current_phase", "cycle_model"]
+# Last of the standard PhysiCell cell variables, the next ones are custom variables
+LAST_STANDARD_VARIABLE = "motility_reserved"
+
+
+def get_custom_variables(variables: Dict[str, int]) -> List[str]:
+    """
+    Returns the custom cell variables (the ones after the standard PhysiCell variables).
+
+    >>> get_custom_variables({"ID": 0, "motility_reserved": 26, "intra_oxy": 27})
+    ['intra_oxy']
+    """
+    last_row = variables.get(LAST_STANDARD_VARIABLE, -1)
+    rows = sorted(variables.items(), key=lambda item: item[1])
+    return [name for name, row in rows if row > last_row]
+
+
+def is_live(phases: Sequence[int]) -> np.ndarray:
+    """
+    Returns whether the cells in the passed phases are alive (see DEAD_PHASE).
+
+    >>> is_live(pd.Series([14, 100, 0, 101])).tolist()
+    [True, False, True, False]
+    """
+    return np.asarray(phases).astype(int) < DEAD_PHASE
+
+
+def get_count_columns(columns: Sequence[str]) -> List[str]:
+    """Returns the columns of the series table that count cells."""
+    return [
+        column
+        for column in columns
+        if column in ("live", "dead") or column.startswith(("phase=", "cell_type="))
+    ]
+
+
+def compute_series(cells: pd.DataFrame, variables: Sequence[str]) -> pd.DataFrame:
+    """
+    Returns the aggregates of each time point of the cell data (one row per time point).
+
+    The table holds the number of live and dead cells ("live" and "dead"), of cells in
+    each phase ("phase=<code>") and of each type ("cell_type=<type>"), and the mean,
+    standard deviation and quantiles of the passed variables ("<variable>.<statistic>").
+    The rows that pad the frames of the cache are not counted.
+    """
+    times = pd.Index(np.unique(cells["time"]), name="time")
+    # Same as timeindex.remove_padding (which imports the cache)
+    cells = cells[cells["total_volume"] > 0]
+    phases = cells["current_phase"].astype(int)
+    status = np.where(is_live(phases), "live", "dead")
+
+    counts = [
+        cells.groupby([cells["time"], status]).size().unstack(fill_value=0)
+        .reindex(columns=["live", "dead"], fill_value=0),
+        cells.groupby(["time", phases]).size().unstack(fill_value=0).add_prefix("phase="),
+        cells.groupby(["time", cells["cell_type"].astype(int)]).size()
+        .unstack(fill_value=0).add_prefix("cell_type="),
+    ]
+    grouped = cells.groupby("time")[list(variables)]
+    statistics = [grouped.mean().add_suffix(".mean"), grouped.std().add_suffix(".std")]
+    statistics += [grouped.quantile(q).add_suffix(f".{name}") for name, q in QUANTILES.items()]
+
+    series = pd.concat(
+        [count.reindex(times, fill_value=0) for count in counts]
+        + [statistic.reindex(times) for statistic in statistics],
+        axis=1,
+    )
+    return series.reset_index()
+
+
+@profiling.timed("filter")
+def aggregate(
+    cells: pd.DataFrame,
+    variable: str,
+    statistic: str = "mean",
+    group_by: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Computes a statistic of a cell variable at each time point, per group of cells.
+
+    Returns a table indexed by time, with one column per group (or a single column named
+    after the variable). The rows that pad the frames of the cache are not counted.
+
+    Parameters
+    ----------
+    cells
+        The cell data, with the time, total volume, variable and group_by columns.
+    variable
+        The cell variable to aggregate.
+    statistic
+        The statistic to compute (one of STATISTICS).
+    group_by
+        A cell variable to group the cells by (e.g., "cell_type" or "current_phase").
+    """
+    if statistic not in STATISTICS:
+        raise ValueError(f"Unknown statistic: {statistic} (expected one of {STATISTICS})")
+    cells = cells[cells["total_volume"] > 0]
+    keys = ["time"] + ([group_by] if group_by else [])
+    result = cells.groupby(keys, observed=True)[variable].agg(statistic)
+    if group_by is None:
+        return result.to_frame(variable)
+    return result.unstack(group_by)
@@ -0,0 +1,314 @@
+"""
+Cell-major store of the cached cell data, to follow cells across time points.
+
+The cell data cache is partitioned by time point, so the history of one cell would have
+to be read from every partition. The track store keeps a copy of the cells (without the
+rows that pad the frames) sorted by cell ID and time, as memory-mapped NumPy files: the
+rows of a cell are contiguous, and the index of each segment holds the cell IDs and the
+offset of their first row. A segment is added each time frames are ingested (see
+cache.build_cache), and segments of similar sizes are merged when there are too many of
+them (so that the rows of the old frames aren't merged again at each ingestion).
+
+The store is updated while the pages read it, so the segments are never modified: the
+segment list (a JSON file, replaced at once) names the segments that are read, and the
+segments that are merged or replaced are removed by the next update.
+"""
+import json
+import math
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# Name of the store folder (in the cache folder)
+TRACKS_FOLDER = "tracks"
+# File listing the segments of the store
+SEGMENTS_FILE = "segments.json"
+# The segments whose number of rows have the same order of magnitude (in this base) are
+# in the same tier, and the segments of a tier are merged when there are too many of them
+TIER_BASE = 4
+SEGMENTS_PER_TIER = 4
+# Files of the index of each segment
+IDS_FILE = "ids.npy"
+STARTS_FILE = "starts.npy"
+
+
+def read_segment_list(store_path: Union[str, Path]) -> List[dict]:
+    """
+    Returns the segments of the store: their folder name, number of rows and first and
+    last time points.
+    """
+    segments_file = Path(store_path) / SEGMENTS_FILE
+    if not segments_file.is_file():
+        return []
+    with open(segments_file, "r") as file:
+        return json.load(file)["segments"]
+
+
+def write_segment_list(segments: List[dict], store_path: Union[str, Path]) -> None:
+    """
+    Saves the segments of the store, with a new version number.
+
+    The list is written to a temporary file first, which then replaces the list, so that
+    it is never read while being written.
+    """
+    segments_file = Path(store_path) / SEGMENTS_FILE
+    version = 0
+    if segments_file.is_file():
+        with open(segments_file, "r") as file:
+            version = json.load(file)["version"] + 1
+    temporary_file = segments_file.with_suffix(".tmp")
+    with open(temporary_file, "w") as file:
+        json.dump({"version": version, "segments": segments}, file)
+    os.replace(temporary_file, segments_file)
+
+
+def get_segments(store_path: Union[str, Path]) -> List[Path]:
+    """Returns the segment folders of the store."""
+    return [Path(store_path) / segment["name"] for segment in read_segment_list(store_path)]
+
+
+def remove_unused_segments(store_path: Union[str, Path]) -> None:
+    """
+    Removes the segment folders that aren't in the segment list (merged or replaced by the
+    last update, or left by an interrupted write).
+
+    This is done before the next update, so that the pages that read the previous list
+    can still read its segments in the meantime.
+    """
+    store_path = Path(store_path)
+    listed = {segment["name"] for segment in read_segment_list(store_path)}
+    for folder in store_path.glob("*-*"):
+        if folder.is_dir() and folder.name not in listed:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def get_new_folder(store_path: Path) -> Path:
+    """Returns the folder of a new segment, numbered after the existing folders."""
+    numbers = [int(folder.name.split("-")[1]) for folder in store_path.glob("segment-*")]
+    return store_path / f"segment-{max(numbers, default=-1) + 1:06d}"
+
+
+def save_segment(
+    folder: Path,
+    columns: Iterable[str],
+    save_column: Callable[[Path, str], None],
+    ids: np.ndarray,
+    times: np.ndarray,
+) -> dict:
+    """
+    Writes a segment (sorted by cell ID and time) and returns its entry of the segment list.
+
+    The columns are written one at a time by save_column(temporary folder, column). The
+    segment is written under another name first, so that it is never read half-written.
+    """
+    temporary_folder = folder.with_name(folder.name.replace("segment", "writing"))
+    shutil.rmtree(temporary_folder, ignore_errors=True)
+    temporary_folder.mkdir(parents=True)
+    for column in columns:
+        save_column(temporary_folder, column)
+    cell_ids, starts = np.unique(ids, return_index=True)
+    np.save(temporary_folder / IDS_FILE, cell_ids)
+    np.save(temporary_folder / STARTS_FILE, np.append(starts, len(ids)))
+    temporary_folder.rename(folder)
+    return {
+        "name": folder.name,
+        "rows": len(ids),
+        "first": float(times.min()),
+        "last": float(times.max()),
+    }
+
+
+def write_segment(cells: pd.DataFrame, store_path: Union[str, Path]) -> Optional[dict]:
+    """
+    Writes the cells as a new segment sorted by cell ID and time, and returns its entry of
+    the segment list (None if there are no cells).
+
+    The rows that pad the frames (with a null volume) are not stored.
+    """
+    cells = cells[cells["total_volume"] > 0]
+    if cells.empty:
+        return None
+    order = np.lexsort((cells["time"].to_numpy(), cells["ID"].to_numpy()))
+
+    def save_column(folder: Path, column: str) -> None:
+        np.save(folder / f"{column}.npy", np.asarray(cells[column])[order])
+
+    return save_segment(
+        get_new_folder(Path(store_path)),
+        cells.columns,
+        save_column,
+        cells["ID"].to_numpy()[order],
+        cells["time"].to_numpy(),
+    )
+
+
+def read_segment(
+    segment: Path,
+    cell_ids: Optional[Sequence[int]] = None,
+    columns: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    """Returns the rows of the passed cells (all by default) stored in the segment."""
+    if columns is None:
+        columns = get_columns(segment)
+    if cell_ids is None:
+        rows = slice(None)
+    else:
+        stored_ids = np.load(segment / IDS_FILE)
+        starts = np.load(segment / STARTS_FILE)
+        positions = np.searchsorted(stored_ids, cell_ids)
+        found = positions < len(stored_ids)
+        found[found] = stored_ids[positions[found]] == np.asarray(cell_ids)[found]
+        positions = positions[found]
+        rows = np.concatenate(
+            [np.arange(starts[p], starts[p + 1]) for p in positions] or [np.array([], int)]
+        )
+    return pd.DataFrame(
+        {column: np.load(segment / f"{column}.npy", mmap_mode="r")[rows] for column in columns}
+    )
+
+
+def get_columns(segment: Path) -> List[str]:
+    """Returns the cell variables stored in the segment."""
+    names = {IDS_FILE, STARTS_FILE}
+    return [file.stem for file in sorted(segment.glob("*.npy")) if file.name not in names]
+
+
+def merge_segments(
+    segments: Sequence[Path], store_path: Union[str, Path], removed_times: Iterable[float] = ()
+) -> Optional[dict]:
+    """
+    Merges the segments into a new segment and returns its entry of the segment list
+    (None if no rows are left).
+
+    The rows of the removed time points (e.g., of frames that are ingested again) are
+    dropped. Only the ID and time columns are loaded to sort the rows, then each column is
+    copied from the memory-mapped segments to the new (memory-mapped) segment, one at a
+    time, so the segments don't have to fit in memory.
+    """
+    removed_times = list(removed_times)
+    ids, times, rows, sources = [], [], [], []
+    for source, segment in enumerate(segments):
+        segment_times = np.load(segment / "time.npy", mmap_mode="r")
+        kept = np.flatnonzero(~np.isin(segment_times, removed_times))
+        ids.append(np.load(segment / "ID.npy", mmap_mode="r")[kept])
+        times.append(segment_times[kept])
+        rows.append(kept)
+        sources.append(np.full(len(kept), source))
+    ids, times = np.concatenate(ids), np.concatenate(times)
+    if len(ids) == 0:
+        return None
+    order = np.lexsort((times, ids))
+    rows, sources = np.concatenate(rows)[order], np.concatenate(sources)[order]
+    # Positions of the rows of each segment in the merged segment
+    positions = [np.flatnonzero(sources == source) for source in range(len(segments))]
+
+    def save_column(folder: Path, column: str) -> None:
+        values = [np.load(segment / f"{column}.npy", mmap_mode="r") for segment in segments]
+        merged = np.lib.format.open_memmap(
+            folder / f"{column}.npy", mode="w+", dtype=values[0].dtype, shape=(len(order),)
+        )
+        for segment_values, segment_positions in zip(values, positions):
+            merged[segment_positions] = segment_values[rows[segment_positions]]
+        merged.flush()
+
+    return save_segment(
+        get_new_folder(Path(store_path)), get_columns(segments[0]), save_column, ids[order], times
+    )
+
+
+def get_tier(rows: int) -> int:
+    """
+    Returns the tier of a segment, from its number of rows.
+
+    >>> [get_tier(rows) for rows in [1, 3, 4, 100, 1000]]
+    [0, 0, 1, 3, 4]
+    """
+    return int(math.log(max(rows, 1), TIER_BASE))
+
+
+def compact(segments: List[dict], store_path: Union[str, Path]) -> List[dict]:
+    """
+    Returns the segment list after merging the segments of the tiers that have more than
+    SEGMENTS_PER_TIER segments.
+
+    Merging the smallest tier first may fill the next one, which is then merged too. The
+    big segments of the old frames are only merged again when their tier is full.
+    """
+    while True:
+        tiers = {}
+        for segment in segments:
+            tiers.setdefault(get_tier(segment["rows"]), []).append(segment)
+        full_tiers = [tier for tier, members in tiers.items() if len(members) > SEGMENTS_PER_TIER]
+        if not full_tiers:
+            return segments
+        merged = tiers[min(full_tiers)]
+        segment = merge_segments(
+            [Path(store_path) / member["name"] for member in merged], store_path
+        )
+        segments = [member for member in segments if member not in merged] + [segment]
+
+
+def add_frames(
+    cells: pd.DataFrame,
+    store_path: Union[str, Path],
+    replaced_times: Iterable[float] = (),
+    rebuild: bool = False,
+) -> None:
+    """
+    Adds the cells of newly ingested frames to the store (or replaces every segment by
+    them if rebuild is set, e.g., when the cache is rebuilt).
+
+    The segments that hold rows of the replaced time points are merged again without them,
+    and the tiers that have too many segments are merged (see compact). The new segments
+    are read once the segment list is written.
+    """
+    store_path = Path(store_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+    remove_unused_segments(store_path)
+    segments = [] if rebuild else read_segment_list(store_path)
+
+    replaced_times = list(replaced_times)
+    if replaced_times:
+        rewritten = [
+            segment
+            for segment in segments
+            if any(segment["first"] <= time <= segment["last"] for time in replaced_times)
+        ]
+        segments = [segment for segment in segments if segment not in rewritten]
+        for segment in rewritten:
+            segments.append(
+                merge_segments([store_path / segment["name"]], store_path, replaced_times)
+            )
+    segments.append(write_segment(cells, store_path))
+    segments = compact([segment for segment in segments if segment is not None], store_path)
+    write_segment_list(segments, store_path)
+
+
+@profiling.timed("load")
+def load_tracks(
+    cell_ids: Sequence[int],
+    store_path: Union[str, Path],
+    columns: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    """
+    Returns the history of the passed cells, sorted by cell ID and time.
+
+    Only the rows of the cells are read from the store (the ID and time columns are
+    always returned).
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(["ID", "time", *columns]))
+    tracks = [read_segment(segment, cell_ids, columns) for segment in get_segments(store_path)]
+    if not tracks:
+        return pd.DataFrame(columns=columns)
+    tracks = pd.concat(tracks, ignore_index=True)
+    profiling.add_bytes_read(tracks.memory_usage(index=False).sum())
+    order = np.lexsort((tracks["time"].to_numpy(), tracks["ID"].to_numpy()))
+    return tracks.iloc[order].reset_index(drop=True)
+
@@ -0,0 +1,150 @@
+"""
+Compact encoding of the numeric arrays sent to the browser.
+
+Plotly.js (2.28 and later) reads arrays encoded as base64 typed arrays ({"dtype": ...,
+"bdata": ..., "shape": ...}), which are much smaller and faster to parse than JSON lists
+of numbers. The figures of the pages are encoded with single-precision floats, and the
+microenvironment grids are reduced to the resolution at which they are displayed.
+Grids can also be quantized to 8 or 16-bit integers, with the color bar labelled with
+the original values.
+"""
+import base64
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+import profiling
+
+# Typed arrays supported by Plotly.js and their codes
+TYPE_CODES = {
+    np.dtype(np.float64): "f8",
+    np.dtype(np.float32): "f4",
+    np.dtype(np.int32): "i4",
+    np.dtype(np.uint32): "u4",
+    np.dtype(np.int16): "i2",
+    np.dtype(np.uint16): "u2",
+    np.dtype(np.int8): "i1",
+    np.dtype(np.uint8): "u1",
+}
+CODE_TYPES = {code: dtype for dtype, code in TYPE_CODES.items()}
+# Maximum number of voxels along each axis of a displayed grid (about its size in pixels)
+GRID_RESOLUTION = 300
+# Number of ticks of the color bar of a quantized heatmap
+COLORBAR_TICKS = 5
+
+
+def encode_array(array: np.ndarray, single: bool = True) -> dict:
+    """
+    Encodes a numeric array as a Plotly.js typed array.
+
+    With single set, double-precision floats are sent as single-precision floats. 64-bit
+    integers (not supported by Plotly.js) are sent as 32-bit integers when possible.
+
+    >>> encode_array(np.array([1.0, 2.0]))
+    {'dtype': 'f4', 'bdata': 'AACAPwAAAEA='}
+    >>> encode_array(np.zeros((2, 3), dtype=np.uint8))
+    {'dtype': 'u1', 'bdata': 'AAAAAAAA', 'shape': '2, 3'}
+    """
+    array = np.asarray(array)
+    if array.dtype == np.bool_:
+        array = array.astype(np.uint8)
+    elif array.dtype.kind in "iu" and array.dtype not in TYPE_CODES:
+        fits = array.size == 0 or (array.min() >= -(2**31) and array.max() < 2**31)
+        array = array.astype(np.int32 if fits else np.float64)
+    if single and array.dtype.kind == "f" and array.dtype.itemsize == 8:
+        array = array.astype(np.float32)
+    # Typed arrays are read in the byte order of the browser (little-endian)
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+    spec = {
+        "dtype": TYPE_CODES[array.dtype.newbyteorder("=")],
+        "bdata": base64.b64encode(array.tobytes()).decode(),
+    }
+    if array.ndim > 1:
+        spec["shape"] = ", ".join(str(size) for size in array.shape)
+    return spec
+
+
+def decode_array(spec: dict) -> np.ndarray:
+    """Decodes a Plotly.js typed array (see encode_array)."""
+    array = np.frombuffer(base64.b64decode(spec["bdata"]), dtype=CODE_TYPES[spec["dtype"]])
+    if "shape" in spec:
+        array = array.reshape([int(size) for size in spec["shape"].split(",")])
+    return array
+
+
+def encode_values(value: Any, single: bool = True) -> Any:
+    """
+    Encodes the numeric arrays found in a (JSON-like) figure or value.
+
+    Arrays already encoded by Plotly.py (version 6 or later) are converted to single
+    precision if needed.
+    """
+    if isinstance(value, np.ndarray) and value.dtype.kind in "biuf":
+        return encode_array(value, single)
+    if isinstance(value, dict):
+        if "bdata" in value and "dtype" in value:
+            if value["dtype"] == "f8":
+                return encode_array(decode_array(value), single)
+            return value
+        return {key: encode_values(item, single) for key, item in value.items()}
+    is_container = isinstance(value, (list, tuple))
+    if is_container and any(isinstance(item, (dict, np.ndarray)) for item in value):
+        return [encode_values(item, single) for item in value]
+    return value
+
+
+@profiling.timed("serialize")
+def encode_figure(figure, single: bool = True) -> dict:
+    """Returns the figure as a dict, with its data arrays encoded (see encode_values)."""
+    figure = figure.to_plotly_json() if hasattr(figure, "to_plotly_json") else figure
+    return {**figure, "data": encode_values(figure["data"], single)}
+
+
+def reduce_grid(grid: np.ndarray, resolution: int = GRID_RESOLUTION) -> np.ndarray:
+    """
+    Averages blocks of voxels so that the grid has at most resolution voxels per axis.
+
+    The blocks are square, so the aspect ratio of the grid is kept. Incomplete blocks at
+    the edges are averaged over the voxels they have.
+
+    >>> reduce_grid(np.arange(16.0).reshape(4, 4), resolution=2)
+    array([[ 2.5,  4.5],
+           [10.5, 12.5]])
+    """
+    factor = int(np.ceil(max(grid.shape) / resolution))
+    if factor <= 1:
+        return grid
+    rows, columns = (-(-size // factor) for size in grid.shape)
+    padded = np.full((rows * factor, columns * factor), np.nan)
+    padded[:grid.shape[0], :grid.shape[1]] = grid
+    blocks = padded.reshape(rows, factor, columns, factor)
+    return np.nanmean(blocks, axis=(1, 3))
+
+
+def quantize(
+    array: np.ndarray, bits: int = 8, limits: Optional[Tuple[float, float]] = None
+) -> Tuple[np.ndarray, float, float]:
+    """
+    Maps the values of the array to unsigned integers of the given number of bits.
+
+    Returns the integers, the offset and the scale, so that values = offset + scale *
+    integers (up to the quantization step). The limits default to the array range.
+
+    >>> quantize(np.array([0.0, 0.5, 1.0]))
+    (array([  0, 128, 255], dtype=uint8), 0.0, 0.00392156862745098)
+    """
+    dtype = {8: np.uint8, 16: np.uint16}[bits]
+    minimum, maximum = limits if limits is not None else (np.nanmin(array), np.nanmax(array))
+    levels = 2**bits - 1
+    scale = float(maximum - minimum) / levels or 1.0
+    codes = np.clip(np.round((array - minimum) / scale), 0, levels)
+    return np.nan_to_num(codes).astype(dtype), float(minimum), scale
+
+
+def get_quantized_colorbar(offset: float, scale: float, bits: int) -> dict:
+    """Returns the color bar ticks of a quantized heatmap, labelled with the original values."""
+    codes = np.linspace(0, 2**bits - 1, COLORBAR_TICKS)
+    return {
+        "tickvals": codes.tolist(),
+        "ticktext": [f"{offset + scale * code:.3g}" for code in codes],
+    }
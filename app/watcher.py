@@ -0,0 +1,112 @@
+"""
+Watches the output folder of a running simulation and ingests the new frames into the cache.
+
+File events are received through watchdog (inotify on Linux) when it is installed.
+Otherwise, the output folder is polled at a fixed interval.
+"""
+import logging
+import threading
+from pathlib import Path
+from typing import List, Optional, Union
+from xml.etree import ElementTree
+
+from scipy.io.matlab import MatReadError
+
+import cache
+
+try:
+    from watchdog.events import PatternMatchingEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+
+class OutputWatcher:
+    """
+    Keeps the cache up to date while the simulation writes new output files.
+
+    Parameters
+    ----------
+    output_path
+        The path to where the output files are written.
+    cache_path
+        The path to the cache of the cell data.
+    interval
+        The time (in seconds) between two updates of the cache. When file events are
+        available, it is the time to wait for the files of a frame to be fully written.
+    precision
+        The precision policy of the cached cell data (see data.get_column_dtypes).
+    interpolation
+        The interpolation method of the sampled concentrations (see sampling).
+    """
+
+    def __init__(
+        self,
+        output_path: Union[str, Path],
+        cache_path: Union[str, Path] = cache.CACHE_PATH,
+        interval: float = 5.0,
+        precision: str = "single",
+        interpolation: str = "trilinear",
+    ):
+        self.output_path = Path(output_path)
+        self.cache_path = Path(cache_path)
+        self.interval = interval
+        self.precision = precision
+        self.interpolation = interpolation
+
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._observer = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Starts watching the output folder in a background thread."""
+        if Observer is not None:
+            handler = PatternMatchingEventHandler(patterns=["*output*"])
+            handler.on_any_event = lambda event: self._changed.set()
+            self._observer = Observer()
+            self._observer.schedule(handler, str(self.output_path), recursive=False)
+            self._observer.start()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops watching the output folder."""
+        self._stopped.set()
+        self._changed.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
+
+    def update(self) -> List[int]:
+        """Ingests the new or changed frames and returns their numbers."""
+        try:
+            return cache.build_cache(
+                self.output_path,
+                self.cache_path,
+                precision=self.precision,
+                interpolation=self.interpolation,
+            )
+        except (OSError, ValueError, MatReadError, ElementTree.ParseError):
+            # Files that are still being written can't be read yet, try again later
+            self._changed.set()
+            return []
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            if self._observer is not None:
+                self._changed.wait()
+                self._changed.clear()
+            # Also lets the simulation finish writing the files that triggered the event
+            if self._stopped.wait(self.interval):
+                break
+            try:
+                self.update()
+            except Exception:
+                # Live-tail keeps running: the next update may succeed (e.g., with new files)
+                logger.exception("Could not update the cache from %s", self.output_path)
@@ -0,0 +1,252 @@
+"""
+Benchmarks the data ingestion and the page callbacks on a synthetic PhysiCell output folder.
+
+Reports the time and peak memory of the ingestion functions, and the p50/p99 latency of
+each server-side callback of the app (requests are sent through the Dash HTTP endpoint,
+so the latency includes the JSON serialization of the responses).
+
+Usage (from the repository root):
+    python benchmarks/harness.py --frames 100 --cells 10000 --grid 50 50 1 --requests 50
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+import synthetic  # noqa: E402
+
+
+def measure(function: Callable, *args, **kwargs) -> Tuple[float, float]:
+    """
+    Returns the wall-clock time (in seconds) and the peak memory (in MB) of the function.
+
+    The memory is traced in the current process only (not in worker processes).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024**2
+
+
+def benchmark_ingestion(output_path: Path, cache_path: Path) -> Dict[str, Tuple[float, float]]:
+    """Measures the functions that read the output folder into the cache."""
+    import cache
+    import data
+    import simindex
+
+    output_path = str(output_path)
+    return {
+        "get_max_cell_num": measure(data.get_max_cell_num, output_path),
+        "get_variables_idx": measure(data.get_variables_idx, output_path),
+        "build_index": measure(
+            simindex.build_index, output_path, Path(cache_path) / simindex.INDEX_FILE
+        ),
+        "extract_data": measure(data.extract_data, output_path),
+        "extract_data_parallel": measure(data.extract_data_parallel, output_path),
+        "build_cache (full)": measure(cache.build_cache, output_path, cache_path, False),
+        "build_cache (no changes)": measure(cache.build_cache, output_path, cache_path),
+    }
+
+
+def check_aggregations(cache_path: Path) -> int:
+    """
+    Aggregates every cell variable offered by the data series page, with every statistic
+    and grouping, and returns the number of aggregations (errors are raised).
+    """
+    import cache
+    import timeseries
+
+    variables = [column for column in cache.get_columns(cache_path) if column != "time"]
+    groups = [None] + [group for group in timeseries.GROUP_VARIABLES if group in variables]
+    combinations = list(itertools.product(variables, timeseries.STATISTICS, groups))
+    for variable, statistic, group_by in combinations:
+        cache.aggregate_cells(variable, statistic, group_by, cache_path=cache_path)
+    return len(combinations)
+
+
+def get_input_values(output_path: Path) -> Dict[str, list]:
+    """Returns the values that are cycled through for each callback input ("id.property")."""
+    import microenv
+    import timeindex
+
+    times = timeindex.get_index().times
+    substances = microenv.get_substances(output_path)
+    return {
+        "frame-slider.value": times,
+        "scatter-custom.value": ["current_phase", "intra_oxy", "total_volume"],
+        "2d-scatter.relayoutData": [None],
+        "2d-scatter.clickData": [None],
+        "2d-scatter.selectedData": [None, {"range": {"x": [0, 500], "y": [0, 500]}}],
+        "tracked-cells.data": [[], [3, 7]],
+        "track-clear.n_clicks": [None],
+        "substance.value": substances,
+        "substance_2.value": substances[::-1],
+        "map.value": ["darkmint", "viridis"],
+        "map_2.value": ["sunset", "viridis"],
+        "vmin_2.value": [0],
+        "vmax_2.value": [1],
+        "slice-axis.value": ["z", "x"],
+        "slice-index.value": [0, 1],
+        "slice-projection.value": [[], ["max"]],
+        "animation-frame.value": list(range(len(times))),
+        "cell-table.page_current": list(range(5)),
+        "cell-table.page_size": [25],
+        "cell-table.filter_query": ["", "{current_phase} = 14"],
+        "cell-table.sort_by": [[], [{"column_id": "total_volume", "direction": "desc"}]],
+        "table-time-range.value": [[times[0], times[-1]]],
+        "table-cell-ids.value": [None, "1,2,3"],
+        "population-groups.value": ["status", "phase=", "cell_type="],
+        "time-data.data": [None],
+        "run.value": ["output"],
+        "compare-runs.value": [None, ["output"]],
+        "series-variable.value": ["intra_oxy", "intra_glu"],
+        "aggregate-variable.value": ["total_volume", "intra_oxy", "current_phase", "cell_type"],
+        "aggregate-statistic.value": ["mean", "median", "count"],
+        "aggregate-group.value": ["cell_type", None, "current_phase"],
+        "diagnostics-interval.n_intervals": [None, 1],
+        "diagnostics-callback.value": [None, "2d-scatter.figure"],
+        "diagnostics-metric.value": ["total", "payload"],
+        "diagnostics-profiling.value": [False],
+        "diagnostics-profile.value": [None],
+    }
+
+
+def parse_outputs(output: str) -> List[Dict[str, str]]:
+    """Splits the output string of a callback ("..a.b...c.d..") into its outputs."""
+    outputs = output.strip(".").split("...") if output.startswith("..") else [output]
+    return [
+        {"id": item.rsplit(".", 1)[0], "property": item.rsplit(".", 1)[1]} for item in outputs
+    ]
+
+
+def benchmark_callbacks(
+    input_values: Dict[str, list],
+    requests: int,
+    prefetch_frames: bool = False,
+    memoize: bool = False,
+) -> Dict[str, Tuple[float, float, int]]:
+    """
+    Sends requests to every server-side callback.
+
+    Returns the p50/p99 latency (in milliseconds) and number of failed requests of each
+    callback. Callbacks with inputs that have no benchmark values are skipped. The
+    figures of the next frames are only prefetched if prefetch_frames is set (all the
+    inputs change between requests, so prefetching mostly competes with the requests).
+    The results are only memoized if memoize is set (the input values are cycled, so
+    most requests would be served from the memory cache).
+    """
+    import app as dashboard
+    import catalog
+    import memo
+    import prefetch
+
+    catalog.configure(dashboard.OUTPUT_PATH)
+    prefetch.get_prefetcher().window = prefetch.WINDOW if prefetch_frames else 0
+    memo.configure(memory_budget=memo.MEMORY_BUDGET if memoize else 0)
+
+    server = dashboard.create_app().server
+    # Failed requests are counted instead of logged
+    server.logger.setLevel(logging.CRITICAL)
+    client = server.test_client()
+    latencies = {}
+    for dependency in client.get("/_dash-dependencies").get_json():
+        inputs = [f"{item['id']}.{item['property']}" for item in dependency["inputs"]]
+        if dependency.get("clientside_function") or any(
+            name not in input_values for name in inputs
+        ):
+            continue
+
+        outputs = parse_outputs(dependency["output"])
+        value_cycles = [itertools.cycle(input_values[name]) for name in inputs]
+        timings = []
+        failures = 0
+        for _ in range(requests):
+            payload = {
+                "output": dependency["output"],
+                "outputs": outputs if len(outputs) > 1 else outputs[0],
+                "inputs": [
+                    {**item, "value": next(values)}
+                    for item, values in zip(dependency["inputs"], value_cycles)
+                ],
+                "changedPropIds": inputs,
+                "state": [{**item, "value": None} for item in dependency["state"]],
+            }
+            start = time.perf_counter()
+            response = client.post("/_dash-update-component", json=payload)
+            timings.append(time.perf_counter() - start)
+            failures += response.status_code not in (200, 204)
+        latencies[dependency["output"]] = (
+            1000 * np.percentile(timings, 50),
+            1000 * np.percentile(timings, 99),
+            failures,
+        )
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    synthetic.add_arguments(parser)
+    parser.add_argument("--requests", type=int, default=20, help="requests per callback")
+    parser.add_argument("--workdir", help="folder to keep the outputs (temporary by default)")
+    parser.add_argument("--skip-callbacks", action="store_true")
+    parser.add_argument("--prefetch", action="store_true", help="prefetch the next frames")
+    parser.add_argument("--memoize", action="store_true", help="memoize the figures")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="physicell-benchmark-"))
+    output_path = workdir / "output"
+    # The pages look for the outputs in "../output" and for the cache in "cache"
+    app_path = workdir / "app"
+    app_path.mkdir(parents=True, exist_ok=True)
+
+    elapsed, _ = measure(
+        synthetic.generate_output,
+        output_path,
+        frames=args.frames,
+        cells=args.cells,
+        substances=args.substances,
+        grid=tuple(args.grid),
+        custom_variables=args.variables,
+    )
+    print(f"Synthetic outputs written to {output_path} ({elapsed:.1f} s)\n")
+
+    os.chdir(app_path)
+    print(f"{'Ingestion':<40}{'time (s)':>12}{'peak (MB)':>12}")
+    for name, (elapsed, peak) in benchmark_ingestion(output_path, Path("cache")).items():
+        print(f"{name:<40}{elapsed:>12.3f}{peak:>12.1f}")
+    print(f"\nAggregations checked: {check_aggregations(Path('cache'))}")
+
+    if args.skip_callbacks:
+        return
+    print(f"\n{'Callback':<60}{'p50 (ms)':>10}{'p99 (ms)':>10}{'failed':>8}")
+    latencies = benchmark_callbacks(
+        get_input_values(output_path), args.requests, args.prefetch, args.memoize
+    )
+    for output, (p50, p99, failures) in latencies.items():
+        print(f"{output:<60}{p50:>10.1f}{p99:>10.1f}{failures:>8}")
+
+    # Median time of the stages of each callback, measured by the server (see profiling)
+    import profiling
+
+    stages = [*profiling.STAGES, "other"]
+    print(f"\n{'Callback stages (p50, ms)':<60}" + "".join(f"{stage:>10}" for stage in stages))
+    for output, metrics in profiling.get_report().items():
+        if "total" in metrics:
+            print(f"{output:<60}" + "".join(f"{metrics[s]['p50']:>10.1f}" for s in stages))
+
+
+if __name__ == "__main__":
+    main()
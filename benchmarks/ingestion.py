@@ -0,0 +1,58 @@
+"""
+Compares the ingestion time of data.extract_data and data.extract_data_parallel.
+
+Usage (from the repository root):
+    python benchmarks/ingestion.py output --repeats 3 --workers 4
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+import data  # noqa: E402
+
+
+def time_call(function, repeats: int, **kwargs) -> float:
+    """Returns the best wall-clock time (in seconds) of the passed function."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(**kwargs)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("output_path", help="PhysiCell output folder")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    # Make sure that both engines return the same DataFrame before timing them
+    # (data.extract_data doesn't reduce the precision of the columns)
+    pd.testing.assert_frame_equal(
+        data.extract_data(output_path=args.output_path),
+        data.extract_data_parallel(
+            output_path=args.output_path, max_workers=args.workers, precision="double"
+        ),
+    )
+
+    serial = time_call(data.extract_data, args.repeats, output_path=args.output_path)
+    parallel = time_call(
+        data.extract_data_parallel,
+        args.repeats,
+        output_path=args.output_path,
+        max_workers=args.workers,
+        precision="double",
+    )
+    print(f"extract_data:          {serial:.3f} s")
+    print(f"extract_data_parallel: {parallel:.3f} s ({serial / parallel:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
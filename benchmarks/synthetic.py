@@ -0,0 +1,185 @@
+"""
+Generates synthetic PhysiCell output folders to benchmark the app.
+
+The folders have the same structure as the outputs of PhysiCell 1.10.2: initial.xml,
+outputNNNNNNNN.xml, outputNNNNNNNN_cells_physicell.mat and
+outputNNNNNNNN_microenvironment0.mat files. The population grows linearly from half of
+the passed number of cells (first frame) to the full number of cells (last frame).
+
+Usage (from the repository root):
+    python benchmarks/synthetic.py output --frames 100 --cells 10000 --grid 50 50 1
+"""
+import argparse
+from pathlib import Path
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+from scipy import io as sio
+
+# PhysiCell cell variables (name and number of rows), in the order of the output files
+CELL_LABELS = [
+    ("ID", 1),
+    ("position", 3),
+    ("total_volume", 1),
+    ("cell_type", 1),
+    ("cycle_model", 1),
+    ("current_phase", 1),
+    ("elapsed_time_in_phase", 1),
+    ("nuclear_volume", 1),
+    ("cytoplasmic_volume", 1),
+    ("fluid_fraction", 1),
+    ("calcified_fraction", 1),
+    ("orientation", 3),
+    ("polarity", 1),
+    ("migration_speed", 1),
+    ("motility_vector", 3),
+    ("migration_bias", 1),
+    ("motility_bias_direction", 3),
+    ("persistence_time", 1),
+    ("motility_reserved", 1),
+]
+# Custom variables used by the pages, followed by generic ones
+CUSTOM_LABELS = ["intra_oxy", "intra_glu", "intra_lac", "intra_energy"]
+SUBSTANCE_NAMES = ["oxygen", "glucose", "lactate"]
+VOXEL_SIZE = 20.0
+TIME_INTERVAL = 60.0
+LIVE_PHASE = 14
+DEAD_PHASE = 100
+
+
+def get_labels(custom_variables: int) -> List[Tuple[str, int]]:
+    """Returns the cell variables and their number of rows, including the custom variables."""
+    custom = CUSTOM_LABELS + [f"custom_{i}" for i in range(len(CUSTOM_LABELS), custom_variables)]
+    return CELL_LABELS + [(name, 1) for name in custom[:custom_variables]]
+
+
+def get_substances(substances: int) -> List[str]:
+    """Returns the names of the substances."""
+    names = SUBSTANCE_NAMES + [f"substance_{i}" for i in range(len(SUBSTANCE_NAMES), substances)]
+    return names[:substances]
+
+
+def write_initial_xml(output_path: Path, labels: Sequence[Tuple[str, int]]) -> None:
+    """Writes the initial.xml file, with the labels of the cell variables."""
+    index = 0
+    label_nodes = []
+    for name, size in labels:
+        label_nodes.append(f'<label index="{index}" size="{size}" units="none">{name}</label>')
+        index += size
+    (output_path / "initial.xml").write_text(
+        "<MultiCellDS><cellular_information><cell_populations>"
+        '<cell_population type="individual"><custom>'
+        '<simplified_data type="matlab" source="PhysiCell" data_version="2">'
+        f"<labels>{''.join(label_nodes)}</labels>"
+        "<filename>initial_cells.mat</filename>"
+        "</simplified_data></custom></cell_population>"
+        "</cell_populations></cellular_information></MultiCellDS>"
+    )
+
+
+def write_frame_xml(
+    output_path: Path, frame: int, mesh: Sequence[np.ndarray], substances: Sequence[str]
+) -> None:
+    """Writes the XML file of a frame, with its time and the microenvironment description."""
+    coordinates = "".join(
+        f'<{axis}_coordinates delimiter=" ">{" ".join(map(str, values))}</{axis}_coordinates>'
+        for axis, values in zip(["x", "y", "z"], mesh)
+    )
+    variables = "".join(
+        f'<variable name="{name}" units="mM" ID="{i}"/>' for i, name in enumerate(substances)
+    )
+    (output_path / f"output{str(frame).zfill(8)}.xml").write_text(
+        "<MultiCellDS>"
+        f'<metadata><current_time units="min">{frame * TIME_INTERVAL}</current_time></metadata>'
+        '<microenvironment><domain name="microenvironment">'
+        f'<mesh type="Cartesian">{coordinates}</mesh>'
+        f"<variables>{variables}</variables>"
+        "</domain></microenvironment></MultiCellDS>"
+    )
+
+
+def generate_cells(
+    cell_num: int, variable_num: int, mesh: Sequence[np.ndarray], rng
+) -> np.ndarray:
+    """Returns the (variables, cells) matrix of a frame, as saved by PhysiCell."""
+    cells = rng.random((variable_num, cell_num))
+    cells[0] = np.arange(cell_num)
+    for axis, values in enumerate(mesh):
+        cells[1 + axis] = values.min() + cells[1 + axis] * (values.max() - values.min())
+    cells[4] = 1000.0 + 2000.0 * cells[4]  # total_volume
+    cells[5] = rng.integers(0, 2, cell_num)  # cell_type
+    cells[6] = 5  # cycle_model (live cells)
+    cells[7] = np.where(cells[7] < 0.9, LIVE_PHASE, DEAD_PHASE)  # current_phase
+    return cells
+
+
+def generate_microenvironment(
+    mesh: Sequence[np.ndarray], substance_num: int, rng
+) -> np.ndarray:
+    """Returns the (4 + substances, voxels) matrix of a frame, as saved by PhysiCell."""
+    z, y, x = np.meshgrid(mesh[2], mesh[1], mesh[0], indexing="ij")
+    voxels = [x.ravel(), y.ravel(), z.ravel(), np.full(x.size, VOXEL_SIZE**3)]
+    return np.vstack(voxels + [rng.random(x.size) for _ in range(substance_num)])
+
+
+def generate_output(
+    output_path: Union[str, Path],
+    frames: int = 10,
+    cells: int = 1000,
+    substances: int = 3,
+    grid: Tuple[int, int, int] = (50, 50, 1),
+    custom_variables: int = 4,
+    seed: int = 0,
+) -> Path:
+    """Writes a synthetic PhysiCell output folder and returns its path."""
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    labels = get_labels(custom_variables)
+    variable_num = sum(size for _, size in labels)
+    substance_names = get_substances(substances)
+    mesh = [(np.arange(n) - (n - 1) / 2) * VOXEL_SIZE for n in grid]
+    write_initial_xml(output_path, labels)
+
+    for frame in range(frames):
+        cell_num = cells // 2 + (cells - cells // 2) * frame // max(1, frames - 1)
+        file_stem = f"output{str(frame).zfill(8)}"
+        write_frame_xml(output_path, frame, mesh, substance_names)
+        sio.savemat(
+            output_path / f"{file_stem}_cells_physicell.mat",
+            {"cells": generate_cells(cell_num, variable_num, mesh, rng)},
+        )
+        sio.savemat(
+            output_path / f"{file_stem}_microenvironment0.mat",
+            {"multiscale_microenvironment": generate_microenvironment(mesh, substances, rng)},
+        )
+    return output_path
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the size options of the synthetic outputs to the parser."""
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--cells", type=int, default=1000, help="cells in the last frame")
+    parser.add_argument("--substances", type=int, default=3)
+    parser.add_argument("--grid", type=int, nargs=3, default=[50, 50, 1], metavar=("X", "Y", "Z"))
+    parser.add_argument("--variables", type=int, default=4, help="custom cell variables")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("output_path", help="folder where the outputs are written")
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate_output(
+        args.output_path,
+        frames=args.frames,
+        cells=args.cells,
+        substances=args.substances,
+        grid=tuple(args.grid),
+        custom_variables=args.variables,
+    )
+
+
+if __name__ == "__main__":
+    main()